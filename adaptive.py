@@ -0,0 +1,365 @@
+import argparse
+import random
+import time
+from collections import namedtuple
+import data_access
+import database
+import tracing
+from quiz_engine import QuizSession, load_questions_by_id, option_letter
+
+# Adaptive tests under a two-parameter logistic (2PL) model: a student of ability theta
+# answers item i correctly with probability 1 / (1 + exp(-a_i * (theta - b_i))), where b_i is
+# the item's difficulty and a_i its discrimination.  Item parameters are calibrated from the
+# attempt history, each question is the most informative one at the current ability
+# estimate, and the test stops once the estimate is precise enough.
+# numpy is imported inside the functions, so importing this module (study.py does) stays cheap.
+
+# Stopping rule: standard error of the ability estimate, and bounds on the test length
+SE_TARGET = 0.3
+MIN_ITEMS = 10
+MAX_ITEMS = 60
+
+# The next question is drawn at random from this many most informative ones, so that a
+# student retaking the test does not see the same sequence and uncalibrated items get answers
+RANDOMESQUE = 3
+
+# Parameters of items nobody has answered yet
+DEFAULT_DISCRIMINATION = 1.0
+DEFAULT_DIFFICULTY = 0.0
+
+# Priors of the calibration: abilities N(0, 1), difficulties N(0, 2^2), log discriminations N(0, 0.5^2)
+DIFFICULTY_SD = 2.0
+LOG_DISCRIMINATION_SD = 0.5
+
+# Calibration stops after this many rounds or when no parameter moves by more than TOLERANCE
+CALIBRATION_ROUNDS = 100
+TOLERANCE = 1e-4
+MAX_STEP = 1.0  # Largest Newton step per round, which keeps the first rounds stable
+
+# Ability is estimated as the posterior mean over this grid (EAP)
+THETA_RANGE = 4.0
+GRID_POINTS = 81
+
+# One subject's items: the first stored question of every content hash and its parameters
+ItemPool = namedtuple('ItemPool', 'question_ids discrimination difficulty')
+
+def probability(theta, discrimination, difficulty):
+    """Probability of a correct answer under the 2PL model; broadcasts over arrays."""
+    import numpy as np
+    return 1.0 / (1.0 + np.exp(-discrimination * (theta - difficulty)))
+
+def information(theta, discrimination, difficulty):
+    """Fisher information of items at ability theta: a^2 * P * (1 - P)."""
+    p = probability(theta, discrimination, difficulty)
+    return discrimination * discrimination * p * (1.0 - p)
+
+# ----------------------------
+# Calibration
+# ----------------------------
+
+def _newton_step(index, count, gradient, curvature, value, prior_mean, prior_sd):
+    """Per-parameter Newton step of a penalised log-likelihood, summing the response terms with bincount."""
+    import numpy as np
+    g = np.bincount(index, weights=gradient, minlength=count) - (value - prior_mean) / prior_sd ** 2
+    h = np.bincount(index, weights=curvature, minlength=count) + 1.0 / prior_sd ** 2
+    return np.clip(g / h, -MAX_STEP, MAX_STEP)
+
+def fit_2pl(persons, items, correct, person_count, item_count, rounds=CALIBRATION_ROUNDS):
+    """Fit a 2PL model to responses by joint maximum a posteriori estimation.
+
+    persons, items and correct are equal-length arrays with one entry per response.
+    Abilities, difficulties and log discriminations are updated in turn with one
+    Newton step each per round, vectorised over all responses.  The priors keep the
+    estimates of items answered only a few times, or always right, finite.
+    Returns (theta, discrimination, difficulty).
+    """
+    import numpy as np
+    persons = np.asarray(persons, dtype=np.int64)
+    items = np.asarray(items, dtype=np.int64)
+    y = np.asarray(correct, dtype=np.float64)
+
+    # Start each difficulty at the logit of its item's smoothed error rate
+    answered = np.bincount(items, minlength=item_count)
+    right = np.bincount(items, weights=y, minlength=item_count)
+    p = (right + 0.5) / (answered + 1.0)
+    difficulty = np.log((1.0 - p) / p)
+    theta = np.zeros(person_count)
+    log_a = np.zeros(item_count)
+
+    for _ in range(rounds):
+        a = np.exp(log_a)[items]
+        p = probability(theta[persons], a, difficulty[items])
+        residual, weight = y - p, p * (1.0 - p)
+        theta_step = _newton_step(persons, person_count, a * residual, a * a * weight, theta, 0.0, 1.0)
+        theta += theta_step
+
+        p = probability(theta[persons], a, difficulty[items])
+        residual, weight = y - p, p * (1.0 - p)
+        difficulty_step = _newton_step(items, item_count, -a * residual, a * a * weight, difficulty, 0.0, DIFFICULTY_SD)
+        difficulty += difficulty_step
+
+        distance = theta[persons] - difficulty[items]
+        p = probability(theta[persons], a, difficulty[items])
+        residual, weight = y - p, p * (1.0 - p)
+        log_a_step = _newton_step(items, item_count, residual * a * distance, weight * (a * distance) ** 2,
+                                  log_a, 0.0, LOG_DISCRIMINATION_SD)
+        log_a += log_a_step
+
+        if max(np.abs(theta_step).max(initial=0), np.abs(difficulty_step).max(initial=0),
+               np.abs(log_a_step).max(initial=0)) < TOLERANCE:
+            break
+    return theta, np.exp(log_a), difficulty
+
+@tracing.traced('quiz.calibrate')
+def calibrate(db_name, subject):
+    """Fit the item parameters of a subject from its graded attempts and store them.
+
+    Each test session counts as one examinee.  Attempts of unknown outcome (imported
+    history) are left out.  Returns (items calibrated, sessions), or None for an unknown subject.
+    """
+    import numpy as np
+    conn = data_access.get_connection(db_name)
+    row = conn.execute("SELECT id FROM subjects WHERE name = ?", (subject,)).fetchone()
+    if row is None:
+        return None
+    subject_id = row[0]
+
+    sessions, hashes = {}, {}
+    rows = conn.execute('''
+        SELECT id, session_id, content_hash, correct FROM attempts
+        WHERE subject_id = ? AND correct IS NOT NULL ORDER BY id
+    ''', (subject_id,)).fetchall()
+    count = len(rows)
+    persons = np.fromiter((sessions.setdefault(r[1], len(sessions)) for r in rows), dtype=np.int64, count=count)
+    items = np.fromiter((hashes.setdefault(r[2], len(hashes)) for r in rows), dtype=np.int64, count=count)
+    correct = np.fromiter((r[3] for r in rows), dtype=np.float64, count=count)
+    last_attempt_id = rows[-1][0] if rows else 0
+
+    _, discrimination, difficulty = fit_2pl(persons, items, correct, len(sessions), len(hashes))
+    responses = np.bincount(items, minlength=len(hashes))
+    with conn:
+        conn.execute("DELETE FROM item_parameters WHERE subject_id = ?", (subject_id,))
+        conn.executemany('''
+            INSERT INTO item_parameters (subject_id, content_hash, discrimination, difficulty, responses)
+            VALUES (?, ?, ?, ?, ?)
+        ''', zip([subject_id] * len(hashes), hashes, discrimination.tolist(), difficulty.tolist(), responses.tolist()))
+        conn.execute('''
+            INSERT OR REPLACE INTO item_calibrations (subject_id, last_attempt_id, sessions, calibrated_at)
+            VALUES (?, ?, ?, ?)
+        ''', (subject_id, last_attempt_id, len(sessions), time.time()))
+    return len(hashes), len(sessions)
+
+def ensure_calibrated(db_name, subject):
+    """Recalibrate a subject if graded attempts were recorded since its last calibration."""
+    conn = data_access.get_connection(db_name)
+    row = conn.execute('''
+        SELECT (SELECT max(a.id) FROM attempts a WHERE a.subject_id = s.id AND a.correct IS NOT NULL),
+               (SELECT c.last_attempt_id FROM item_calibrations c WHERE c.subject_id = s.id)
+        FROM subjects s WHERE s.name = ?
+    ''', (subject,)).fetchone()
+    if row is not None and row[0] is not None and row[0] != row[1]:
+        calibrate(db_name, subject)
+
+# (db_name, subject name in lower case) -> ((question revision, last calibrated attempt), ItemPool)
+pool_cache = {}
+
+@tracing.traced('sql.load_item_pool')
+def load_item_pool(db_name, subject):
+    """Return the ItemPool of a subject as numpy arrays, cached until its questions or calibration change.
+
+    Copies of a question share a content hash and appear once.  Items without
+    calibrated parameters get the defaults.
+    """
+    import numpy as np
+    conn = data_access.get_connection(db_name)
+    row = conn.execute('''
+        SELECT s.id, s.revision, (SELECT c.last_attempt_id FROM item_calibrations c WHERE c.subject_id = s.id)
+        FROM subjects s WHERE s.name = ?
+    ''', (subject,)).fetchone()
+    if row is None:
+        return ItemPool(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+    subject_id, version = row[0], row[1:]
+
+    key = (db_name, subject.lower())
+    cached = pool_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    rows = conn.execute('''
+        SELECT min(g.question_id), coalesce(p.discrimination, ?), coalesce(p.difficulty, ?)
+        FROM question_signatures g
+        LEFT JOIN item_parameters p ON p.subject_id = g.subject_id AND p.content_hash = g.content_hash
+        WHERE g.subject_id = ?
+        GROUP BY g.content_hash ORDER BY 1
+    ''', (DEFAULT_DISCRIMINATION, DEFAULT_DIFFICULTY, subject_id)).fetchall()
+    pool = ItemPool(np.array([r[0] for r in rows], dtype=np.int64),
+                    np.array([r[1] for r in rows], dtype=np.float64),
+                    np.array([r[2] for r in rows], dtype=np.float64))
+    pool_cache[key] = (version, pool)
+    return pool
+
+# ----------------------------
+# Adaptive Sessions
+# ----------------------------
+
+class AdaptiveSession(QuizSession):
+    """A QuizSession that picks each question after the previous answer.
+
+    questions holds the questions asked so far, the last one being the current question
+    until it is answered.  The ability estimate is the mean of the posterior over a grid
+    (standard normal prior), and its standard error the posterior standard deviation.
+    The test ends after min_items once the standard error is at most se_target, after
+    max_items, or when the pool runs out.
+    """
+
+    def __init__(self, db_name, pool, rng=None, se_target=SE_TARGET, min_items=MIN_ITEMS, max_items=MAX_ITEMS,
+                 session_id=None):
+        import numpy as np
+        super().__init__([], session_id)
+        self.db_name = db_name
+        self.rng = rng or random
+        # Shuffled once, so that ties between equally informative items (all uncalibrated ones) break at random
+        order = np.random.default_rng(self.rng.getrandbits(64)).permutation(len(pool.question_ids))
+        self.question_ids = pool.question_ids[order]
+        self.discrimination = pool.discrimination[order]
+        self.difficulty = pool.difficulty[order]
+        self.available = np.ones(len(order), dtype=bool)
+        self.remaining = len(order)
+        self.positions = []  # Pool positions of the questions asked
+        self.se_target = se_target
+        self.min_items = min_items
+        self.max_items = min(max_items, len(order))
+
+        self.grid = np.linspace(-THETA_RANGE, THETA_RANGE, GRID_POINTS)
+        self.log_posterior = -0.5 * self.grid ** 2
+        self.theta, self.se = 0.0, 1.0
+        if self.max_items:
+            self.select_next()
+
+    @property
+    def ability(self):
+        """The current (ability estimate, standard error)."""
+        return self.theta, self.se
+
+    def progress(self):
+        return f"Question {len(self.answers) + 1} (at most {self.max_items})"
+
+    def answer(self, choice):
+        letter = super().answer(choice)
+        position = self.positions[-1]
+        p = probability(self.grid, self.discrimination[position], self.difficulty[position])
+        self.update_ability(p if letter == self.questions[-1][4].strip().lower() else 1.0 - p)
+        if not self.should_stop():
+            self.select_next()
+        return letter
+
+    def update_ability(self, likelihood):
+        """Multiply the posterior by one answer's likelihood over the grid and re-estimate."""
+        import numpy as np
+        self.log_posterior += np.log(np.maximum(likelihood, 1e-300))
+        weights = np.exp(self.log_posterior - self.log_posterior.max())
+        weights /= weights.sum()
+        self.theta = float(weights @ self.grid)
+        self.se = float(np.sqrt(weights @ (self.grid - self.theta) ** 2))
+
+    def should_stop(self):
+        answered = len(self.answers)
+        return (answered >= self.max_items or not self.remaining
+                or (answered >= self.min_items and self.se <= self.se_target))
+
+    @tracing.traced('quiz.adaptive_select')
+    def select_next(self):
+        """Append the next question: one of the RANDOMESQUE most informative at the current estimate.
+
+        Returns False if no stored question is left.
+        """
+        import numpy as np
+        while self.remaining:
+            scores = information(self.theta, self.discrimination, self.difficulty)
+            scores[~self.available] = -1.0
+            k = min(RANDOMESQUE, self.remaining)
+            position = int(self.rng.choice(np.argpartition(scores, -k)[-k:]))
+            self.available[position] = False
+            self.remaining -= 1
+            loaded = load_questions_by_id(self.db_name, [int(self.question_ids[position])])
+            if loaded:  # Otherwise deleted since the pool was loaded
+                self.positions.append(position)
+                self.questions.append(loaded[0])
+                return True
+        return False
+
+def start_session(db_name, subject, rng=None, **options):
+    """Calibrate a subject if needed and start an AdaptiveSession; None if it has no questions."""
+    ensure_calibrated(db_name, subject)
+    pool = load_item_pool(db_name, subject)
+    if not len(pool.question_ids):
+        return None
+    return AdaptiveSession(db_name, pool, rng, **options)
+
+def simulate(db_name, subject, ability, runs, rng=None):
+    """Let a simulated student of the given ability take adaptive tests, answering as the 2PL model predicts.
+
+    Nothing is recorded.  Returns a list of (questions asked, estimate, standard error).
+    """
+    rng = rng or random
+    outcomes = []
+    for _ in range(runs):
+        session = start_session(db_name, subject, rng)
+        if session is None:
+            break
+        for q in session:
+            position = session.positions[-1]
+            p = probability(ability, session.discrimination[position], session.difficulty[position])
+            letters = [option_letter(option) for option in q[3]]
+            key = q[4].strip().lower()
+            wrong = [letter for letter in letters if letter != key] or [key]
+            session.answer(key if rng.random() < p else rng.choice(wrong))
+        outcomes.append((len(session.answers), session.theta, session.se))
+    return outcomes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate items and check adaptive tests.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help="Fit item parameters from the attempt history")
+    calibrate_parser.add_argument('subject')
+    items_parser = subparsers.add_parser('items', help="Show the calibrated items of a subject")
+    items_parser.add_argument('subject')
+    simulate_parser = subparsers.add_parser('simulate', help="Run adaptive tests for a simulated student")
+    simulate_parser.add_argument('subject')
+    simulate_parser.add_argument('--ability', type=float, default=0.0, help="True ability of the simulated student")
+    simulate_parser.add_argument('--runs', type=int, default=20)
+    simulate_parser.add_argument('--seed', type=int, help="Seed for reproducible runs")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.enable_from_arguments(args)
+
+    db_name = 'questions.db'  # Database name
+    database.create_database(db_name)
+    if args.command == 'calibrate':
+        result = calibrate(db_name, args.subject)
+        if result is None:
+            print(f"No subject '{args.subject}'.")
+        else:
+            print(f"Calibrated {result[0]} items from {result[1]} sessions.")
+    elif args.command == 'items':
+        ensure_calibrated(db_name, args.subject)
+        rows = data_access.get_connection(db_name).execute('''
+            SELECT q.question, p.discrimination, p.difficulty, p.responses FROM item_parameters p
+            JOIN subjects s ON s.id = p.subject_id
+            JOIN question_signatures g ON g.subject_id = p.subject_id AND g.content_hash = p.content_hash
+            JOIN questions q ON q.id = g.question_id
+            WHERE s.name = ? GROUP BY p.content_hash ORDER BY p.difficulty
+        ''', (args.subject,)).fetchall()
+        for question, discrimination, difficulty, responses in rows:
+            print(f"b={difficulty:+6.2f}  a={discrimination:5.2f}  n={responses:<5} {question[:70]}")
+    else:
+        outcomes = simulate(db_name, args.subject, args.ability, args.runs, random.Random(args.seed))
+        if not outcomes:
+            print(f"No questions found for '{args.subject}'.")
+        else:
+            count = len(outcomes)
+            print(f"{count} tests of a student with ability {args.ability:+.2f}:")
+            print(f"  questions asked  {sum(o[0] for o in outcomes) / count:6.1f}")
+            print(f"  mean estimate    {sum(o[1] for o in outcomes) / count:+6.2f}")
+            print(f"  RMSE             {(sum((o[1] - args.ability) ** 2 for o in outcomes) / count) ** 0.5:6.2f}")
+            print(f"  mean SE          {sum(o[2] for o in outcomes) / count:6.2f}")
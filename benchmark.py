@@ -0,0 +1,947 @@
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import data_access
+import database
+import load_study_notes
+from generate_corpus import generate_contents, generate_questions, generate_references, question_lines, \
+    write_notes_docx, write_pdf, write_questions_docx
+
+# ----------------------------
+# Benchmarks
+# ----------------------------
+
+@contextlib.contextmanager
+def temporary_database():
+    """Yield the path of a fresh, migrated database in a temporary directory."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        database.create_database(db_name)
+        try:
+            yield db_name
+        finally:
+            data_access.close_all()
+
+def timed(func, *args):
+    """Run func(*args) and return the elapsed wall-clock seconds."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def bench_ingest(count):
+    """Compare per-row inserts against QuestionStore batched inserts."""
+    questions = generate_questions(count)
+    references = generate_references(count)
+
+    def per_row(db_name):
+        for q in questions:
+            row = database.question_row('Bench', q)
+            database.insert_question(db_name, *row[:6])
+        for reference in references:
+            database.insert_reference(db_name, 'Bench', reference)
+
+    def batched(db_name):
+        with database.QuestionStore(db_name) as store:
+            store.insert_questions('Bench', questions)
+            store.insert_references('Bench', references)
+
+    print(f"Ingesting {count} questions and {count} references")
+    for label, func in (("per-row", per_row), ("QuestionStore", batched)):
+        with temporary_database() as db_name:
+            elapsed = timed(func, db_name)
+        print(f"  {label:<14} {elapsed:8.3f}s  {2 * count / elapsed:12,.0f} rows/sec")
+
+def bench_workers(subjects, files_per_subject, questions_per_file, worker_counts):
+    """Time a full ingestion of a generated contents/ tree at several worker counts."""
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = os.path.join(tmp, 'contents')
+        total = generate_contents(base_dir, subjects, files_per_subject, questions_per_file)
+        print(f"Ingesting {total} questions from {subjects * files_per_subject} files ({os.cpu_count()} CPUs)")
+        
+        dumps = set()
+        for workers in worker_counts:
+            db_name = os.path.join(tmp, f"workers{workers}.db")
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = timed(load_study_notes.insert_questions_and_references_from_subfolders, base_dir, db_name, workers)
+            conn = data_access.get_connection(db_name)
+            dumps.add(tuple(conn.execute("SELECT * FROM questions ORDER BY id")))
+            data_access.close_connection(db_name)
+            print(f"  workers={workers:<3} {elapsed:8.3f}s  {total / elapsed:12,.0f} questions/sec")
+        print(f"  identical rows across worker counts: {len(dumps) == 1}")
+
+def bench_pdf(count):
+    """Compare materialised and streaming PDF parsing: time to first question and peak memory."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, 'bank.pdf')
+        write_pdf(pdf_path, list(question_lines(generate_questions(count))))
+        print(f"Parsing {count} questions from a {database.pdf_page_count(pdf_path)}-page PDF")
+        
+        for label, parse in (("materialised", database.parse_questions_from_pdf),
+                             ("streaming", database.iter_questions_from_pdf)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            questions = iter(parse(pdf_path))
+            next(questions)
+            first = time.perf_counter() - start
+            rest = sum(1 for _ in questions)
+            total = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label:<13} first question {first * 1000:9.1f} ms  total {total:7.3f}s  "
+                  f"peak {peak / 2**20:7.1f} MiB  ({rest + 1} questions)")
+
+def bench_sample(sizes, count, repeat=20):
+    """Time drawing a Practice test: loading the whole subject versus sample_questions."""
+    import quiz_engine
+    print(f"Drawing {count} questions (median of {repeat} draws)")
+    for size in sizes:
+        with temporary_database() as db_name:
+            with database.QuestionStore(db_name) as store:
+                store.insert_questions('Bench', generate_questions(size))
+            
+            def load_all():
+                return random.sample(quiz_engine.load_questions(db_name, 'Bench'), count)
+            
+            def sample():
+                return quiz_engine.sample_questions(db_name, 'Bench', count)
+            
+            quiz_engine.question_id_cache.clear()
+            cold = timed(sample)
+            results = {label: sorted(timed(func) for _ in range(repeat))[repeat // 2]
+                       for label, func in (("load all", load_all), ("sample", sample))}
+            print(f"  {size:>8} questions  load all {results['load all'] * 1000:9.2f} ms  "
+                  f"sample {results['sample'] * 1000:7.2f} ms (first draw {cold * 1000:.2f} ms)")
+
+class StubChatHandler(http.server.BaseHTTPRequestHandler):
+    """Local stand-in for the chat-completions endpoint that answers after a fixed delay."""
+    protocol_version = "HTTP/1.1"
+    latency = 0.1
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.latency)
+        prompt = request['messages'][0]['content']
+        body = json.dumps({'choices': [{'message': {'content': f"Stub explanation for: {prompt[:40]}"}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(latency):
+    """Start a threaded stub chat-completions server; returns (server, url)."""
+    handler = type('Handler', (StubChatHandler,), {'latency': latency})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+def bench_explanations(count, latency, concurrency):
+    """Fetch explanations one at a time versus through ExplanationFetcher, against a local stub."""
+    from explanations import ExplanationFetcher
+    server, url = start_stub_server(latency)
+    items = [(q['question'], q['answer']) for q in generate_questions(count)]
+    print(f"Fetching {count} explanations from a stub server with {latency * 1000:.0f} ms latency")
+    
+    sequential = ExplanationFetcher('test-key', url=url, max_workers=1)
+    elapsed = timed(lambda: [sequential.get_explanation(*item) for item in items])
+    print(f"  sequential      {elapsed:8.3f}s")
+    sequential.close()
+    
+    for workers in concurrency:
+        fetcher = ExplanationFetcher('test-key', url=url, max_workers=workers)
+        results = []
+        elapsed = timed(lambda: results.extend(fetcher.fetch_all(items)))
+        fetcher.close()
+        ok = all(result.startswith("Stub explanation for:") for result in results)
+        print(f"  concurrent x{workers:<3} {elapsed:8.3f}s  all explanations received: {ok}")
+    
+    from explanations import ExplanationCache
+    with temporary_database() as db_name:
+        for label in ("cache cold", "cache warm"):
+            cache = ExplanationCache(db_name)
+            fetcher = ExplanationFetcher('test-key', url=url, cache=cache)
+            elapsed = timed(fetcher.fetch_all, items)
+            fetcher.close()
+            cache.close()
+            print(f"  {label:<15} {elapsed:8.3f}s")
+    server.shutdown()
+
+def bench_queries(size, repeat=200):
+    """Per-call latency of the quiz_engine.py queries with a fresh connection per call versus the shared one."""
+    import sqlite3
+    import quiz_engine
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name) as store:
+            store.insert_questions('Bench', generate_questions(size))
+            store.insert_references('Bench', generate_references(200))
+        
+        def fresh_connection(sql, params):
+            conn = sqlite3.connect(db_name)
+            rows = conn.execute(sql, params).fetchall()
+            conn.close()
+            return rows
+        
+        subjects_sql = "SELECT name FROM subjects s WHERE EXISTS (SELECT 1 FROM questions q WHERE q.subject_id = s.id)"
+        references_sql = ("SELECT r.reference FROM study_references r JOIN subjects s ON s.id = r.subject_id "
+                          "WHERE s.name = ? ORDER BY r.id")
+        cases = (
+            ("load_subjects", lambda: fresh_connection(subjects_sql, ()), lambda: quiz_engine.load_subjects(db_name)),
+            ("load_references", lambda: fresh_connection(references_sql, ('Bench',)),
+             lambda: quiz_engine.load_references(db_name, 'Bench')),
+            ("sample_questions", None, lambda: quiz_engine.sample_questions(db_name, 'Bench', 25)),
+        )
+        print(f"Median per-call latency over {repeat} calls ({size} questions)")
+        for label, fresh, pooled in cases:
+            pooled_time = sorted(timed(pooled) for _ in range(repeat))[repeat // 2]
+            line = f"  {label:<17} shared connection {pooled_time * 1e6:9.1f} us"
+            if fresh:
+                fresh_time = sorted(timed(fresh) for _ in range(repeat))[repeat // 2]
+                line += f"   fresh connection {fresh_time * 1e6:9.1f} us"
+            print(line)
+
+def bench_search(size, repeat=50):
+    """Median latency of full-text search versus a LIKE scan over the same rows.
+
+    The generated corpus draws from a 30-word vocabulary, so the word queries match most
+    rows and show the worst case for ranking; the question-number queries are selective.
+    """
+    import search
+    queries = ("Q4242", "Q9999", "cloud integration", "tenant secur")
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name) as store:
+            store.insert_questions('Bench', generate_questions(size))
+            store.insert_references('Bench', generate_references(size // 10))
+        conn = data_access.get_connection(db_name)
+        
+        def like_scan(text):
+            # Ranking needs every match, so the scan reads the whole table like the FTS query does
+            pattern = '%' + text + '%'
+            return conn.execute("SELECT id FROM questions WHERE question LIKE ? OR options LIKE ?",
+                                (pattern, pattern)).fetchall()
+        
+        print(f"Median search latency over {repeat} runs ({size} questions, {size // 10} references)")
+        for text in queries:
+            fts_time = sorted(timed(search.search, db_name, text) for _ in range(repeat))[repeat // 2]
+            like_time = sorted(timed(like_scan, text) for _ in range(repeat))[repeat // 2]
+            hits = len(search.search(db_name, text))
+            print(f"  {text!r:<22} fts {fts_time * 1000:8.2f} ms ({hits} results)   LIKE scan {like_time * 1000:8.2f} ms")
+
+def bench_references(references, questions):
+    """Index build time and batch reference scoring against scoring one question at a time."""
+    import reference_index
+    import quiz_engine
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name) as store:
+            store.insert_questions('Bench', generate_questions(questions))
+            build = timed(store.insert_references, 'Bench', generate_references(references))
+
+        test = quiz_engine.load_questions(db_name, 'Bench')
+        index = reference_index.load_index(db_name, 'Bench')
+        texts = [reference_index.question_text(q) for q in test]
+
+        # Per-question loop over the same postings, as a plain-Python baseline
+        postings = {}
+        for term, t in index.vocabulary.items():
+            start, end = index.indptr[t], index.indptr[t + 1]
+            postings[term] = list(zip(index.columns[start:end].tolist(), index.weights[start:end].tolist()))
+
+        def one_at_a_time():
+            matches = []
+            for text in texts:
+                scores = {}
+                for term in set(reference_index.tokenize(text)):
+                    for column, weight in postings.get(term, ()):
+                        scores[column] = scores.get(column, 0.0) + weight
+                best = sorted(scores.items(), key=lambda item: -item[1])[:reference_index.TOP_K]
+                matches.append([index.references[column] for column, _ in best])
+            return matches
+
+        batch_time = timed(index.top_k, texts)
+        loop_time = timed(one_at_a_time)
+        agree = sum(a[:1] == b[:1] for a, b in zip(index.top_k(texts), one_at_a_time()))
+
+        full_dump = len(test) * sum(len(r) for r in index.references)
+        top_k_text = sum(len(r) for matches in index.top_k(texts) for r in matches)
+        print(f"{references} references, Certified test of {len(test)} questions")
+        print(f"  insert + index build   {build * 1000:9.1f} ms")
+        print(f"  batch top-{reference_index.TOP_K} (numpy)   {batch_time * 1000:9.1f} ms")
+        print(f"  per-question loop      {loop_time * 1000:9.1f} ms   (same best match for {agree}/{len(test)})")
+        print(f"  results text           {top_k_text:,} chars instead of {full_dump:,} for the full dump")
+
+def near_duplicates(questions, count, seed=0):
+    """Copies of random questions with a reworded stem and the options in reverse order."""
+    rng = random.Random(seed)
+    copies = []
+    for q in rng.sample(questions, count):
+        copies.append(dict(q, question=q['question'].replace("Which statement", "Which one statement"),
+                           options=q['options'][::-1]))
+    return copies
+
+def bench_dedup(count, brute_force_size=2000):
+    """Ingestion cost of duplicate detection, how many planted copies it finds, and all-pairs for scale."""
+    import dedup
+    questions = generate_questions(count)
+    planted = near_duplicates(questions, count // 10)
+    print(f"Ingesting {count} questions followed by {len(planted)} near-duplicates")
+    for policy in (None,) + dedup.POLICIES:
+        with temporary_database() as db_name:
+            with database.QuestionStore(db_name, duplicates=policy) as store:
+                elapsed = timed(store.insert_questions, 'Bench', questions + planted)
+                found = store.deduplicator.found
+        print(f"  {str(policy):<7} {elapsed:8.3f}s  {(count + len(planted)) / elapsed:10,.0f} questions/sec  "
+              f"found {found}/{len(planted)}")
+
+    # Exact Jaccard over every pair grows quadratically; MinHash/LSH only compares bucket mates
+    sample = [(q['question'], q['options']) for q in questions[:brute_force_size]]
+    shingle_sets = [dedup.shingles(dedup.normalize(*item)) for item in sample]
+    def all_pairs():
+        return sum(len(a & b) / len(a | b) >= dedup.THRESHOLD
+                   for i, a in enumerate(shingle_sets) for b in shingle_sets[i + 1:])
+    pairs_time = timed(all_pairs)
+    fingerprint_time = timed(dedup.fingerprints, sample)
+    print(f"  all-pairs Jaccard on {len(sample)} questions {pairs_time:8.3f}s "
+          f"(~{pairs_time * (count / len(sample)) ** 2:,.0f}s at {count}); "
+          f"MinHash signatures {fingerprint_time * 1000:.1f} ms")
+
+def bench_schedule(size, count=25, repeat=20):
+    """Practice set selection from the review schedule index versus scanning every schedule row."""
+    import history
+    import quiz_engine
+    rng = random.Random(0)
+    now = time.time()
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name, duplicates=None) as store:
+            store.insert_questions('Bench', generate_questions(size))
+        with data_access.transaction(db_name) as conn:
+            # Every question has been answered; a tenth are due, spread over the past week
+            conn.execute('''
+                INSERT INTO review_schedule (subject_id, content_hash, repetitions, interval_days, ease, due_at)
+                SELECT subject_id, content_hash, 1, 6, 2.5, ? FROM question_signatures GROUP BY subject_id, content_hash
+            ''', (now,))
+            rows = conn.execute("SELECT subject_id, content_hash FROM review_schedule").fetchall()
+            conn.executemany('''
+                UPDATE review_schedule SET due_at = ?, ease = ? WHERE subject_id = ? AND content_hash = ?
+            ''', [(now + rng.uniform(-7, 70) * history.DAY, rng.uniform(1.3, 3.0), s, h) for s, h in rows])
+        question_ids = quiz_engine.load_question_ids(db_name, 'Bench')
+        conn = data_access.get_connection(db_name)
+
+        def full_scan():
+            schedule = conn.execute("SELECT content_hash, due_at, ease FROM review_schedule").fetchall()
+            due = sorted((r for r in schedule if r[1] <= now), key=lambda r: r[1])
+            return due[:count] or sorted(schedule, key=lambda r: r[2])[:count]
+
+        def indexed():
+            return history.select_practice_ids(db_name, 'Bench', count, question_ids, rng, now)
+
+        scan_time = sorted(timed(full_scan) for _ in range(repeat))[repeat // 2]
+        indexed_time = sorted(timed(indexed) for _ in range(repeat))[repeat // 2]
+        print(f"Choosing {count} of {len(rows)} scheduled questions (median of {repeat})")
+        print(f"  full scan and sort {scan_time * 1000:9.2f} ms")
+        print(f"  due queue index    {indexed_time * 1000:9.2f} ms")
+        for label, sql in (("due", "WHERE r.subject_id = 1 AND r.due_at <= 0 ORDER BY r.due_at LIMIT 50"),
+                           ("weak", "WHERE r.subject_id = 1 AND r.ease < 2 ORDER BY r.ease LIMIT 50")):
+            plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT g.question_id FROM review_schedule r "
+                                f"JOIN question_signatures g ON g.subject_id = r.subject_id "
+                                f"AND g.content_hash = r.content_hash {sql}").fetchall()
+            print(f"  {label} plan: " + "; ".join(row[-1] for row in plan))
+
+def bench_engine(sessions, questions=25, sample=10000):
+    """Quiz scoring throughput: QuizSession one session at a time versus score_batch and score_answers."""
+    import quiz_engine
+    rng = np.random.default_rng(0)
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name, duplicates=None) as store:
+            store.insert_questions('Bench', generate_questions(questions))
+        test = quiz_engine.load_questions(db_name, 'Bench')
+        letters = np.array([ord(c) for c in 'abcd'])
+        answers = letters[rng.integers(0, 4, size=(sessions, len(test)))]
+
+        def one_at_a_time():
+            for row in answers[:sample].tolist():
+                session = quiz_engine.QuizSession(test, session_id='bench')
+                for code in row:
+                    session.answer(chr(code))
+                session.score()
+
+        key = quiz_engine.answer_key(test)
+        rows = [(str(s), q[0], chr(code)) for s, row in enumerate(answers[:sample].tolist()) for q, code in zip(test, row)]
+        loop_time = timed(one_at_a_time)
+        batch_time = timed(quiz_engine.score_batch, key, answers)
+        rows_time = timed(quiz_engine.score_answers, db_name, rows)
+        print(f"Scoring sessions of {len(test)} questions")
+        print(f"  QuizSession loop   {sample / loop_time:12,.0f} sessions/sec ({sample} sessions)")
+        print(f"  score_batch        {sessions / batch_time:12,.0f} sessions/sec ({sessions} sessions)")
+        print(f"  score_answers rows {sample / rows_time:12,.0f} sessions/sec ({len(rows)} answer rows)")
+
+def bench_pack(size, repeat=20):
+    """Question pack size and draw latency against the database, cold and warm."""
+    import question_pack
+    import quiz_engine
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name, duplicates=None) as store:
+            store.insert_questions('Bench', generate_questions(size))
+            store.insert_references('Bench', generate_references(200))
+        path = os.path.join(os.path.dirname(db_name), 'Bench' + question_pack.PACK_EXTENSION)
+        export_time = timed(question_pack.export_pack, db_name, 'Bench', path)
+        print(f"{size} questions: database {os.path.getsize(db_name):,} bytes, pack {os.path.getsize(path):,} bytes "
+              f"(exported in {export_time * 1000:.0f} ms)")
+
+        def database_draw(test_type, cold):
+            if cold:
+                data_access.close_all()  # Fresh connection, as at startup
+                quiz_engine.question_id_cache.clear()
+            return quiz_engine.draw_questions(db_name, 'Bench', test_type, random.Random(0))
+
+        def pack_draw(test_type):
+            with question_pack.QuestionPack(path) as pack:
+                return pack.draw(test_type, random.Random(0))
+
+        for test_type in ('Preview', 'Certified'):
+            cold = sorted(timed(database_draw, test_type, True) for _ in range(repeat))[repeat // 2]
+            warm = sorted(timed(database_draw, test_type, False) for _ in range(repeat))[repeat // 2]
+            packed = sorted(timed(pack_draw, test_type) for _ in range(repeat))[repeat // 2]
+            print(f"  {test_type:<9} database cold {cold * 1000:8.2f} ms  warm {warm * 1000:8.2f} ms   "
+                  f"open pack + draw {packed * 1000:8.2f} ms")
+
+def bench_adaptive(size, steps=50, responses=1000000):
+    """Adaptive test cost: per-question selection from a large pool and calibration throughput."""
+    import adaptive
+    rng = np.random.default_rng(0)
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name, duplicates=None) as store:
+            store.insert_questions('Bench', generate_questions(size))
+        with data_access.transaction(db_name) as conn:
+            hashes = [row[0] for row in conn.execute("SELECT DISTINCT content_hash FROM question_signatures")]
+            conn.executemany('''
+                INSERT INTO item_parameters (subject_id, content_hash, discrimination, difficulty, responses)
+                VALUES (1, ?, ?, ?, 10)
+            ''', zip(hashes, np.exp(rng.normal(0, 0.3, len(hashes))).tolist(), rng.normal(0, 1, len(hashes)).tolist()))
+            conn.execute("INSERT INTO item_calibrations (subject_id, last_attempt_id, sessions, calibrated_at) VALUES (1, 0, 0, 0)")
+
+        load_time = timed(adaptive.load_item_pool, db_name, 'Bench')
+        session = adaptive.start_session(db_name, 'Bench', random.Random(0), min_items=steps, max_items=steps,
+                                         se_target=0)
+        step_times = []
+        for q in session:
+            start = time.perf_counter()
+            session.answer(0)
+            step_times.append(time.perf_counter() - start)
+        step_times.sort()
+        print(f"Adaptive test over a pool of {len(hashes):,} items")
+        print(f"  load item pool     {load_time * 1000:9.2f} ms")
+        print(f"  answer + select    {step_times[len(step_times) // 2] * 1000:9.2f} ms median, "
+              f"{step_times[-1] * 1000:.2f} ms max ({len(step_times)} questions)")
+
+    # Calibration on simulated responses: sessions of 40 answers from a 2PL model
+    items = size
+    persons = responses // 40
+    a = np.exp(rng.normal(0, 0.3, items))
+    b = rng.normal(0, 1, items)
+    theta = rng.normal(0, 1, persons)
+    person_index = np.repeat(np.arange(persons), 40)
+    item_index = rng.integers(0, items, persons * 40)
+    correct = rng.random(len(item_index)) < adaptive.probability(theta[person_index], a[item_index], b[item_index])
+    start = time.perf_counter()
+    _, fitted_a, fitted_b = adaptive.fit_2pl(person_index, item_index, correct, persons, items)
+    fit_time = time.perf_counter() - start
+    print(f"Calibrating {items:,} items from {len(item_index):,} responses: {fit_time:.2f} s, "
+          f"difficulty correlation {np.corrcoef(fitted_b, b)[0, 1]:.3f}, "
+          f"discrimination correlation {np.corrcoef(fitted_a, a)[0, 1]:.3f}")
+
+# Parses one DOCX in a fresh interpreter and reports time and the growth of peak RSS, which
+# also counts lxml's C-level tree that tracemalloc does not see
+DOCX_SCRIPT = """
+import sys, time
+import database, docx_stream
+import docx
+
+def peak_rss():  # ru_maxrss would carry over the benchmark process's peak through exec
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+
+kind, parser, path = sys.argv[1:4]
+paragraphs = docx_stream.iter_document_paragraphs if parser == 'python-docx' else docx_stream.iter_paragraphs
+before = peak_rss()
+start = time.perf_counter()
+if kind == 'questions':
+    items = list(database.iter_questions(text.strip() for text in paragraphs(path)))
+else:
+    items = [text.strip() for text in paragraphs(path) if text.strip()]
+elapsed = time.perf_counter() - start
+print(elapsed, (peak_rss() - before) * 1024, len(items))
+"""
+
+def bench_docx(count, repeat=5):
+    """python-docx versus the streaming reader on the files in contents/ and a generated large bank."""
+    import subprocess
+    import sys
+    import docx_stream
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        files = sorted((os.path.join(root, name), 'questions' if name.startswith('questions') else 'references')
+                       for root, _, names in os.walk(os.path.join(here, 'contents')) for name in names
+                       if name.endswith('.docx'))
+        large = [(os.path.join(tmp, 'questions.docx'), 'questions'), (os.path.join(tmp, 'notes.docx'), 'references')]
+        write_questions_docx(large[0][0], generate_questions(count))
+        write_notes_docx(large[1][0], generate_references(count * 4))
+
+        print("Paragraphs, questions and references identical to python-docx:")
+        if docx_stream.check_parity([path for path, _ in files + large]):
+            raise SystemExit("The streaming reader differs from python-docx")
+        print(f"Parse time and peak RSS growth, median of {repeat} fresh interpreters")
+        for path, kind in files + large:
+            row = []
+            for parser in ('python-docx', 'streaming'):
+                runs = sorted(tuple(float(value) for value in subprocess.run(
+                    [sys.executable, '-c', DOCX_SCRIPT, kind, parser, path],
+                    cwd=here, capture_output=True, text=True, check=True).stdout.split()) for _ in range(repeat))
+                row.append(runs[repeat // 2])
+            (slow, slow_rss, items), (fast, fast_rss, _) = row
+            name = os.path.relpath(path, here) if path.startswith(here) else os.path.basename(path) + " (generated)"
+            print(f"  {name:<40} {os.path.getsize(path) / 1024:8.0f} KiB  {int(items):>6} {kind}")
+            print(f"    python-docx {slow * 1000:9.1f} ms  rss +{slow_rss / 2**20:6.1f} MiB   "
+                  f"streaming {fast * 1000:9.1f} ms  rss +{fast_rss / 2**20:6.1f} MiB   {slow / fast:5.1f}x faster")
+
+def resident_memory():
+    """Resident set size of this process in bytes (Linux), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+def count_widgets(widget):
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
+
+def bench_transitions(count, window=100):
+    """Per-question transition time, widget count and memory over one long PracticeTestApp session."""
+    import tkinter as tk
+    import study
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        raise SystemExit(f"The transition benchmark needs a display (e.g. run it under xvfb-run): {e}")
+    questions = [(i, 'Bench', q['question'], q['options'], q['answer'], q['explanation'], '')
+                 for i, q in enumerate(generate_questions(count))]
+    # Vary the option count so hidden pool buttons are exercised too
+    questions = [q if i % 3 else q[:3] + (q[3][:3],) + q[4:] for i, q in enumerate(questions)]
+
+    def recreate(master, questions):
+        """The previous load_question: new Radiobuttons for every question, old ones only unpacked."""
+        state = {'buttons': []}
+        label = tk.Label(master, wraplength=800, justify="left")
+        label.pack(pady=20)
+        var = tk.StringVar()
+
+        def load(q):
+            label.config(text=q[2])
+            for btn in state['buttons']:
+                btn.pack_forget()
+            state['buttons'] = []
+            for i, option in enumerate(q[3]):
+                btn = tk.Radiobutton(master, text=option, variable=var, value=i, wraplength=800, anchor='w', justify="left")
+                btn.pack(anchor='w', pady=5)
+                state['buttons'].append(btn)
+            var.set(None)
+        load(questions[0])
+        return lambda i: load(questions[i])
+
+    def pooled(master, questions):
+        app = study.PracticeTestApp(master, questions, fetcher=object(), db_name=None)
+
+        def step(i):
+            app.options_var.set('0')
+            app.next_question()
+        return step
+
+    print(f"Question transitions over a {count}-question session (median per {window} questions)")
+    for label, build in (('recreate widgets', recreate), ('widget pool', pooled)):
+        top = tk.Toplevel(root)
+        step = build(top, questions)
+        root.update()
+        rows = []
+        times = []
+        for i in range(1, count - 1):  # The last answer would open the results window
+            start = time.perf_counter()
+            step(i)
+            root.update()  # Redraw and run the idle prefetch, as the event loop would
+            times.append(time.perf_counter() - start)
+            if len(times) == window:
+                rows.append((i + 1, sorted(times)[window // 2], count_widgets(top), resident_memory()))
+                times = []
+        top.destroy()
+        print(f"  {label}")
+        for question, median, widgets, memory in rows[::max(1, len(rows) // 5)] + rows[-1:]:
+            rss = f"{memory / 2**20:8.1f} MB" if memory is not None else "     n/a"
+            print(f"    question {question:>6}  {median * 1000:7.2f} ms  {widgets:>6} widgets  rss {rss}")
+    root.destroy()
+
+# Modules study.py must not load before the first window appears
+DEFERRED_MODULES = ('numpy', 'docx', 'PyPDF2', 'requests', 'dotenv', 'multiprocessing')
+
+# Everything study.main() does before creating the first window, timed in a fresh interpreter
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import study
+imported = time.perf_counter()
+study.database.create_database(sys.argv[1])
+study.history.import_history_pickles(sys.argv[1], base_dir=sys.argv[2])
+study.load_subjects(sys.argv[1])
+ready = time.perf_counter()
+print(imported - start, ready - start, ','.join(m for m in sys.argv[3].split(',') if m in sys.modules))
+"""
+
+def import_times(stderr):
+    """Parse -X importtime output into {module: cumulative microseconds}."""
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+def bench_startup(threshold_ms, repeat=9):
+    """Time-to-first-window of study.py in fresh interpreters, with an import breakdown and a regression check."""
+    import subprocess
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name) as store:
+            store.insert_questions('Bench', generate_questions(1000))
+        runs = []
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, db_name,
+                                     os.path.dirname(db_name), ','.join(DEFERRED_MODULES)],
+                                    cwd=here, capture_output=True, text=True, check=True)
+            import_time, ready_time, loaded = result.stdout.split(' ', 2)
+            runs.append((float(ready_time), float(import_time), loaded.strip(), import_times(result.stderr)))
+    runs.sort(key=lambda run: run[0])
+    ready_time, import_time, loaded, times = runs[repeat // 2]
+
+    print(f"study.py startup, median of {repeat} fresh interpreters (creating the Tk window itself is not included)")
+    print(f"  import study        {import_time * 1000:8.1f} ms")
+    print(f"  ready for window    {ready_time * 1000:8.1f} ms   (threshold {threshold_ms:.0f} ms)")
+    heaviest = sorted(((us, name) for name, us in times.items()
+                       if name.split('.')[0] in ('study', 'database', 'explanations', 'quiz_engine', 'history',
+                                                 'reference_index', 'dedup', 'tkinter', 'data_access')), reverse=True)
+    for us, name in heaviest[:8]:
+        print(f"    {name:<20} {us / 1000:8.1f} ms cumulative")
+    problems = []
+    if loaded:
+        problems.append(f"modules that should load on first use were imported: {loaded}")
+    if ready_time * 1000 > threshold_ms:
+        problems.append(f"startup took {ready_time * 1000:.1f} ms, over the {threshold_ms:.0f} ms threshold")
+    if problems:
+        raise SystemExit("Startup regression: " + "; ".join(problems))
+    print("  no deferred modules loaded at startup")
+
+def bench_tracing(calls=200000, repeat=5):
+    """Per-call cost of a traced function with tracing off and on, and of a traced query."""
+    import quiz_engine
+    import tracing
+
+    def plain():
+        pass
+
+    wrapped = tracing.traced('bench.noop')(plain)
+
+    def loop(func):
+        for _ in range(calls):
+            func()
+
+    def spans():
+        for _ in range(calls):
+            with tracing.span('bench.span'):
+                pass
+
+    with temporary_database() as db_name:
+        with database.QuestionStore(db_name, duplicates=None) as store:
+            store.insert_questions('Bench', generate_questions(1000))
+        rng = random.Random(0)
+        draw = lambda: quiz_engine.draw_questions(db_name, 'Bench', 'Preview', rng)
+        draw()
+
+        baseline = median_time(loop, plain, repeat=repeat) / calls
+        print(f"Tracing overhead per call (median of {repeat} runs)")
+        print(f"  untraced call        {baseline * 1e9:10.0f} ns")
+        for state in (False, True):
+            tracing.enabled = state
+            label = 'on' if state else 'off'
+            try:
+                traced_call = median_time(loop, wrapped, repeat=repeat) / calls
+                span = median_time(spans, repeat=repeat) / calls
+                draws = median_time(lambda: [draw() for _ in range(200)], repeat=repeat) / 200
+            finally:
+                tracing.enabled = False
+            print(f"  traced call, {label:<3}    {traced_call * 1e9:10.0f} ns  (+{(traced_call - baseline) * 1e9:.0f} ns)")
+            print(f"  span, {label:<3}           {span * 1e9:10.0f} ns")
+            print(f"  draw Preview, {label:<3}   {draws * 1e6:10.1f} us")
+        tracing.reset()
+
+# ----------------------------
+# End-to-end Suite
+# ----------------------------
+
+def median_time(func, *args, repeat=5):
+    return sorted(timed(func, *args) for _ in range(repeat))[repeat // 2]
+
+def git_revision():
+    import subprocess
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(base_dir, db_name, workers=1, repeat=5, seed=0):
+    """Time ingestion, loading, test draws and results scoring on a contents/ tree.
+
+    Returns {name: {'seconds': median seconds, 'items': items handled per run}}.
+    """
+    import quiz_engine
+    import reference_index
+    results = {}
+
+    def record(name, seconds, items):
+        results[name] = {'seconds': seconds, 'items': items}
+        print(f"  {name:<22} {seconds * 1000:10.2f} ms  {items:>9,} items  {items / seconds if seconds else 0:14,.0f} items/sec")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest = timed(load_study_notes.insert_questions_and_references_from_subfolders, base_dir, db_name, workers)
+        reingest = timed(load_study_notes.insert_questions_and_references_from_subfolders, base_dir, db_name, workers)
+    conn = data_access.get_connection(db_name)
+    questions, references = (conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                             for table in ('questions', 'study_references'))
+    record('ingest', ingest, questions + references)
+    record('ingest unchanged', reingest, questions + references)
+
+    subjects = quiz_engine.load_subjects(db_name)
+    record('load_subjects', median_time(quiz_engine.load_subjects, db_name, repeat=repeat), len(subjects))
+    largest = max(subjects, key=lambda subject: len(quiz_engine.load_question_ids(db_name, subject)))
+    bank = quiz_engine.load_questions(db_name, largest)
+    record('load_questions', median_time(quiz_engine.load_questions, db_name, largest, repeat=repeat), len(bank))
+    record('load_references', median_time(quiz_engine.load_references, db_name, largest, repeat=repeat),
+           len(quiz_engine.load_references(db_name, largest)))
+
+    rng = random.Random(seed)
+    tests = {}
+    for test_type in quiz_engine.TEST_TYPES:
+        tests[test_type] = quiz_engine.draw_questions(db_name, largest, test_type, rng)
+        record(f"draw {test_type}", median_time(quiz_engine.draw_questions, db_name, largest, test_type, rng,
+                                                repeat=repeat), len(tests[test_type]))
+
+    certified = tests['Certified']
+    choices = [rng.randrange(len(q[3])) if q[3] else 'a' for q in certified]
+
+    def take_test():
+        session = quiz_engine.QuizSession(certified, session_id='bench')
+        for choice in choices:
+            session.answer(choice)
+        return session.score()
+
+    record('score session', median_time(take_test, repeat=repeat), len(certified))
+    rows = [(str(s), q[0], rng.choice('abcd')) for s in range(1000) for q in tests['Preview']]
+    record('score_answers', median_time(quiz_engine.score_answers, db_name, rows, repeat=repeat), len(rows))
+    record('top_references', median_time(reference_index.top_references, db_name, tests['Preview'], repeat=repeat),
+           len(tests['Preview']))
+    return results
+
+def bench_suite(questions, subjects, files, references, formats, workers, output, corpus=None, repeat=5):
+    """Run the end-to-end suite on a generated (or given) corpus and write the results as JSON."""
+    import platform
+    import sys
+    with tempfile.TemporaryDirectory() as tmp:
+        parameters = {'corpus': corpus}
+        if corpus is None:
+            corpus = os.path.join(tmp, 'contents')
+            per_file = max(1, questions // (subjects * files))
+            parameters = {'questions': per_file * subjects * files, 'subjects': subjects, 'files': files,
+                          'references': references, 'formats': formats}
+            elapsed = timed(generate_contents, corpus, subjects, files, per_file, formats, references, True)
+            print(f"Generated {parameters['questions']:,} questions per format in {subjects} subjects "
+                  f"({', '.join(formats)}) in {elapsed:.1f}s")
+        db_name = os.path.join(tmp, 'suite.db')
+        database.create_database(db_name)
+        try:
+            print(f"Median of {repeat} runs (ingestion runs once), workers={workers}")
+            results = run_suite(corpus, db_name, workers, repeat)
+        finally:
+            data_access.close_all()
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'workers': workers,
+            'repeat': repeat,
+            'parameters': parameters,
+            'argv': sys.argv[1:],
+        },
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+def compare_results(old_path, new_path, threshold):
+    """Print per-benchmark time ratios of two suite result files; fail if any got slower than threshold."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('revision') or old_path} -> {new['meta'].get('revision') or new_path}")
+    regressions = []
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            print(f"  {name:<22} {'':>12} {result['seconds'] * 1000:10.2f} ms  (new)")
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        marker = ''
+        if ratio > threshold:
+            marker = '  SLOWER'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            marker = '  faster'
+        print(f"  {name:<22} {before['seconds'] * 1000:10.2f} ms -> {result['seconds'] * 1000:10.2f} ms  {ratio:6.2f}x{marker}")
+    if regressions:
+        raise SystemExit(f"Slower than {threshold:.2f}x: {', '.join(regressions)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the practice test tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help="Row insertion throughput")
+    ingest_parser.add_argument('--count', type=int, default=2000, help="Questions and references to insert")
+
+    workers_parser = subparsers.add_parser('workers', help="Parallel parsing throughput of the folder walker")
+    workers_parser.add_argument('--subjects', type=int, default=4)
+    workers_parser.add_argument('--files', type=int, default=4, help="Question files per subject")
+    workers_parser.add_argument('--questions', type=int, default=500, help="Questions per file")
+    workers_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+
+    pdf_parser = subparsers.add_parser('pdf', help="Streaming versus materialised PDF parsing")
+    pdf_parser.add_argument('--count', type=int, default=2000, help="Questions in the generated PDF")
+
+    sample_parser = subparsers.add_parser('sample', help="Practice test draw latency by subject size")
+    sample_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    sample_parser.add_argument('--count', type=int, default=25, help="Questions per draw")
+
+    explanations_parser = subparsers.add_parser('explanations', help="Explanation fetching against a local stub server")
+    explanations_parser.add_argument('--count', type=int, default=50, help="Explanations to fetch")
+    explanations_parser.add_argument('--latency', type=float, default=0.1, help="Stub response delay in seconds")
+    explanations_parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 8, 16])
+
+    queries_parser = subparsers.add_parser('queries', help="Per-call query latency through the shared connections")
+    queries_parser.add_argument('--size', type=int, default=10000, help="Questions in the benchmark subject")
+
+    search_parser = subparsers.add_parser('search', help="Full-text search latency")
+    search_parser.add_argument('--size', type=int, default=100000, help="Questions in the benchmark subject")
+
+    references_parser = subparsers.add_parser('references', help="Reference index build and batch scoring")
+    references_parser.add_argument('--references', type=int, default=10000, help="References in the benchmark subject")
+    references_parser.add_argument('--questions', type=int, default=500, help="Questions in the Certified test")
+
+    dedup_parser = subparsers.add_parser('dedup', help="Duplicate detection cost and recall during ingestion")
+    dedup_parser.add_argument('--count', type=int, default=20000, help="Distinct questions to ingest")
+
+    schedule_parser = subparsers.add_parser('schedule', help="Practice set selection from the review schedule")
+    schedule_parser.add_argument('--size', type=int, default=100000, help="Scheduled questions in the benchmark subject")
+
+    engine_parser = subparsers.add_parser('engine', help="Quiz engine scoring throughput")
+    engine_parser.add_argument('--sessions', type=int, default=100000, help="Simulated sessions to score")
+
+    pack_parser = subparsers.add_parser('pack', help="Question pack size and draw latency")
+    pack_parser.add_argument('--size', type=int, default=100000, help="Questions in the benchmark subject")
+
+    startup_parser = subparsers.add_parser('startup', help="study.py time-to-first-window with a regression threshold")
+    startup_parser.add_argument('--threshold-ms', type=float, default=150, help="Fail above this startup time")
+
+    transitions_parser = subparsers.add_parser('transitions', help="Question window transition time and memory (needs a display)")
+    transitions_parser.add_argument('--count', type=int, default=1000, help="Questions in the session")
+
+    docx_parser = subparsers.add_parser('docx', help="Streaming DOCX reader against python-docx")
+    docx_parser.add_argument('--count', type=int, default=20000, help="Questions in the generated bank")
+
+    suite_parser = subparsers.add_parser('suite', help="End-to-end suite on a generated corpus, written as JSON")
+    suite_parser.add_argument('--questions', type=int, default=10000, help="Questions in the corpus, per format")
+    suite_parser.add_argument('--subjects', type=int, default=4)
+    suite_parser.add_argument('--files', type=int, default=1, help="Question files per subject")
+    suite_parser.add_argument('--references', type=int, default=1000, help="Notes lines per subject")
+    suite_parser.add_argument('--format', nargs='+', choices=('docx', 'pdf'), default=['docx'])
+    suite_parser.add_argument('--corpus', help="Use this contents/ tree instead of generating one")
+    suite_parser.add_argument('--workers', type=int, default=1)
+    suite_parser.add_argument('--repeat', type=int, default=5)
+    suite_parser.add_argument('--output', default='benchmark-results.json')
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two suite result files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio reported as a regression")
+
+    subparsers.add_parser('tracing', help="Overhead of the tracing layer when off and on")
+
+    adaptive_parser = subparsers.add_parser('adaptive', help="Adaptive test selection and item calibration cost")
+    adaptive_parser.add_argument('--size', type=int, default=100000, help="Questions in the item pool")
+
+    args = parser.parse_args()
+    if args.command == 'ingest':
+        bench_ingest(args.count)
+    elif args.command == 'workers':
+        bench_workers(args.subjects, args.files, args.questions, args.workers)
+    elif args.command == 'pdf':
+        bench_pdf(args.count)
+    elif args.command == 'sample':
+        bench_sample(args.sizes, args.count)
+    elif args.command == 'explanations':
+        bench_explanations(args.count, args.latency, args.concurrency)
+    elif args.command == 'queries':
+        bench_queries(args.size)
+    elif args.command == 'search':
+        bench_search(args.size)
+    elif args.command == 'references':
+        bench_references(args.references, args.questions)
+    elif args.command == 'dedup':
+        bench_dedup(args.count)
+    elif args.command == 'schedule':
+        bench_schedule(args.size)
+    elif args.command == 'engine':
+        bench_engine(args.sessions)
+    elif args.command == 'pack':
+        bench_pack(args.size)
+    elif args.command == 'startup':
+        bench_startup(args.threshold_ms)
+    elif args.command == 'transitions':
+        bench_transitions(args.count)
+    elif args.command == 'docx':
+        bench_docx(args.count)
+    elif args.command == 'tracing':
+        bench_tracing()
+    elif args.command == 'adaptive':
+        bench_adaptive(args.size)
+    elif args.command == 'suite':
+        bench_suite(args.questions, args.subjects, args.files, args.references, args.format, args.workers,
+                    args.output, args.corpus, args.repeat)
+    elif args.command == 'compare':
+        compare_results(args.old, args.new, args.threshold)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
+import argparse
 import sqlite3
+import data_access
+import database
 
 def clear_database(db_name):
     """Clear all data from the questions and study_references tables in the database."""
-    conn = sqlite3.connect(db_name)
+    database.create_database(db_name)  # Make sure the ingestion manifest exists
+    conn = data_access.get_connection(db_name)
     cursor = conn.cursor()
     
     try:
@@ -10,14 +14,44 @@ def clear_database(db_name):
         cursor.execute("DELETE FROM questions")
         # Clear all data from the study_references table
         cursor.execute("DELETE FROM study_references")
+        # Drop the reference index built from them
+        cursor.execute("DELETE FROM reference_postings")
+        cursor.execute("DELETE FROM reference_indexes")
+        cursor.execute("DELETE FROM question_duplicates")
+        # Forget ingested files so the next load re-parses everything; attempt history is kept
+        cursor.execute("DELETE FROM ingested_files WHERE kind != 'history'")
         
         conn.commit()
+        # Give the freed pages back to the file system
+        database.reclaim_space(db_name)
         print("All data has been successfully cleared from the database.")
     except sqlite3.Error as e:
+        conn.rollback()
         print(f"An error occurred: {e}")
-    finally:
-        conn.close()
+
+def clear_subjects(db_name, subjects):
+    """Clear only the named subjects' questions and references; other subjects stay untouched."""
+    database.create_database(db_name)
+    try:
+        purged = database.purge_subjects(db_name, subjects)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return
+    missing = sorted(set(s.lower() for s in subjects) - set(s.lower() for s in purged))
+    if purged:
+        print(f"Cleared {', '.join(purged)} from the database.")
+    if missing:
+        print(f"No such subject: {', '.join(missing)}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clear questions and references from the database.")
+    parser.add_argument('--subject', action='append', metavar='NAME',
+                        help="Clear only this subject (may be repeated); to re-ingest subjects without "
+                             "emptying the bank, use 'python load_study_notes.py --rebuild' instead")
+    args = parser.parse_args()
+
     db_name = 'questions.db'  # Database name
-    clear_database(db_name) 
\ No newline at end of file
+    if args.subject:
+        clear_subjects(db_name, args.subject)
+    else:
+        clear_database(db_name)
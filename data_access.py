@@ -0,0 +1,84 @@
+import atexit
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import tracing
+
+# Applied to every new connection.  WAL lets readers run while an ingest is writing;
+# synchronous=NORMAL is safe with WAL and avoids an fsync per commit.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",  # 64 MiB page cache
+    "PRAGMA mmap_size = 268435456",  # Map up to 256 MiB of the file
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Prepared statements kept per connection; reused whenever the same SQL text runs again
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_open_connections = []
+_lock = threading.Lock()
+_generation = 0  # Bumped by close_all() so every thread drops its closed connections
+
+def get_connection(db_name):
+    """Return this thread's shared connection to db_name, opening and tuning it on first use.
+
+    Connections stay open for the life of the process so that page cache and prepared
+    statements are reused across calls.  Callers must not close them; commit with
+    `with conn:` or use transaction().
+    """
+    if getattr(_local, 'generation', None) != _generation:
+        _local.connections = {}
+        _local.generation = _generation
+    connections = _local.connections
+
+    key = os.path.abspath(db_name)
+    conn = connections.get(key)
+    if conn is None:
+        # check_same_thread is off only so close_all() can run from the main thread at exit;
+        # each connection is still used by the thread that opened it
+        conn = sqlite3.connect(db_name, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if tracing.enabled:
+            conn.set_trace_callback(_count_statement)
+        connections[key] = conn
+        with _lock:
+            _open_connections.append(conn)
+    return conn
+
+def _count_statement(sql):
+    tracing.count('sql.statements')
+
+@contextmanager
+def transaction(db_name):
+    """Run a block in one transaction on the shared connection, committing on success."""
+    conn = get_connection(db_name)
+    with conn:
+        yield conn
+
+def close_connection(db_name):
+    """Close this thread's connection to db_name, e.g. before replacing or deleting the file."""
+    if getattr(_local, 'generation', None) != _generation:
+        return  # Already closed by close_all()
+    conn = _local.connections.pop(os.path.abspath(db_name), None)
+    if conn is not None:
+        with _lock:
+            _open_connections.remove(conn)
+        conn.close()
+
+def close_all():
+    """Close every connection opened through this module, in all threads."""
+    global _generation
+    with _lock:
+        connections = list(_open_connections)
+        _open_connections.clear()
+        _generation += 1
+    for conn in connections:
+        conn.close()
+
+atexit.register(close_all)
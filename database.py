@@ -1,11 +1,43 @@
-import sqlite3
-from docx import Document
-from PyPDF2 import PdfReader
+import data_access
+import dedup
+import docx_stream
+import reference_index
+import tracing
+import argparse
+import hashlib
+import itertools
 import os
+from collections import deque
+import re
 
+INSERT_QUESTION_SQL = '''
+    INSERT INTO questions (subject, question, options, answer, explanation, tags, source_path, subject_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_REFERENCE_SQL = '''
+    INSERT INTO study_references (subject, reference, source_path, subject_id)
+    VALUES (?, ?, ?, ?)
+'''
+
+INSERT_OPTION_SQL = '''
+    INSERT INTO options (question_id, position, letter, text)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Splits a legacy ', '-joined options string only where the next option starts ("B. ...")
+OPTION_SEPARATOR = re.compile(r', (?=[A-Z]\. )')
+
+# Tables whose rows are owned by a source file, keyed by the manifest's kind column
+SOURCE_TABLES = {'questions': 'questions', 'references': 'study_references'}
+
+# Questions fingerprinted together for duplicate detection while inserting
+DEDUP_BATCH_SIZE = 512
+
+@tracing.traced('sql.create_database')
 def create_database(db_name):
     """Create a SQLite database and tables for questions and references if they do not exist."""
-    conn = sqlite3.connect(db_name)
+    conn = data_access.get_connection(db_name)
     cursor = conn.cursor()
     
     # Create table for questions
@@ -30,178 +62,1046 @@ def create_database(db_name):
         )
     ''')
     
+    migrate_database(conn)
+    
     conn.commit()
-    conn.close()
 
-def insert_question(db_name, subject, question, options, answer, explanation='', tags=''):
-    """Insert a question into the database."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
+def _column_names(cursor, table):
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+
+def _migrate_ingestion_manifest(cursor):
+    """Tie rows to the file they came from and record what has been ingested."""
+    for table in SOURCE_TABLES.values():
+        if 'source_path' not in _column_names(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN source_path TEXT")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_source_path ON {table}(source_path)")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            path TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            PRIMARY KEY (path, kind)
+        )
+    ''')
+
+def _migrate_subjects_and_options(cursor):
+    """Normalise subjects into their own table and options into one row per option."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS options (
+            question_id INTEGER NOT NULL REFERENCES questions(id),
+            position INTEGER NOT NULL,
+            letter TEXT NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (question_id, position)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questions_delete_options AFTER DELETE ON questions
+        BEGIN
+            DELETE FROM options WHERE question_id = old.id;
+        END
+    ''')
+    
+    cursor.execute("INSERT OR IGNORE INTO subjects (name) SELECT DISTINCT subject FROM questions")
+    cursor.execute("INSERT OR IGNORE INTO subjects (name) SELECT DISTINCT subject FROM study_references")
+    for table in SOURCE_TABLES.values():
+        if 'subject_id' not in _column_names(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN subject_id INTEGER REFERENCES subjects(id)")
+        cursor.execute(f"UPDATE {table} SET subject_id = (SELECT id FROM subjects WHERE name = {table}.subject)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_subject_id ON {table}(subject_id)")
     
+    rows = cursor.execute("SELECT id, options FROM questions").fetchall()
+    for question_id, options in rows:
+        cursor.executemany(INSERT_OPTION_SQL, option_rows(question_id, split_options(options)))
+
+def _migrate_subject_revisions(cursor):
+    """Count question changes per subject so readers can cache per-subject data cheaply."""
+    if 'revision' not in _column_names(cursor, 'subjects'):
+        cursor.execute("ALTER TABLE subjects ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questions_insert_revision AFTER INSERT ON questions
+        BEGIN
+            UPDATE subjects SET revision = revision + 1 WHERE id = new.subject_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questions_delete_revision AFTER DELETE ON questions
+        BEGIN
+            UPDATE subjects SET revision = revision + 1 WHERE id = old.subject_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questions_update_revision AFTER UPDATE ON questions
+        BEGIN
+            UPDATE subjects SET revision = revision + 1 WHERE id IN (old.subject_id, new.subject_id);
+        END
+    ''')
+
+def _migrate_explanation_cache(cursor):
+    """Persist generated explanations; entries go away when their question changes."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS explanation_cache (
+            cache_key TEXT PRIMARY KEY,
+            question_id INTEGER,
+            model TEXT NOT NULL,
+            explanation TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_explanation_cache_question_id ON explanation_cache(question_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_explanation_cache_last_used_at ON explanation_cache(last_used_at)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questions_delete_explanations AFTER DELETE ON questions
+        BEGIN
+            DELETE FROM explanation_cache WHERE question_id = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questions_update_explanations AFTER UPDATE OF question, options, answer ON questions
+        BEGIN
+            DELETE FROM explanation_cache WHERE question_id = old.id;
+        END
+    ''')
+
+def _migrate_full_text_search(cursor):
+    """Index question and reference text with FTS5, kept in sync by triggers."""
+    indexes = {
+        'questions': ('questions_fts', ['question', 'options', 'explanation']),
+        'study_references': ('study_references_fts', ['reference']),
+    }
+    for table, (fts, columns) in indexes.items():
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f"new.{column}" for column in columns)
+        old_values = ', '.join(f"old.{column}" for column in columns)
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {column_list}, content='{table}', content_rowid='id', tokenize='porter unicode61'
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE ON {table}
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def _migrate_reference_index(cursor):
+    """Store a BM25 index of each subject's references, rebuilt whenever they change."""
+    if 'reference_revision' not in _column_names(cursor, 'subjects'):
+        cursor.execute("ALTER TABLE subjects ADD COLUMN reference_revision INTEGER NOT NULL DEFAULT 0")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS study_references_insert_revision AFTER INSERT ON study_references
+        BEGIN
+            UPDATE subjects SET reference_revision = reference_revision + 1 WHERE id = new.subject_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS study_references_delete_revision AFTER DELETE ON study_references
+        BEGIN
+            UPDATE subjects SET reference_revision = reference_revision + 1 WHERE id = old.subject_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS study_references_update_revision AFTER UPDATE ON study_references
+        BEGIN
+            UPDATE subjects SET reference_revision = reference_revision + 1 WHERE id IN (old.subject_id, new.subject_id);
+        END
+    ''')
+
+    # The reference revision each subject's postings were built from
     cursor.execute('''
-        INSERT INTO questions (subject, question, options, answer, explanation, tags)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (subject, question, options, answer, explanation, tags))
+        CREATE TABLE IF NOT EXISTS reference_indexes (
+            subject_id INTEGER PRIMARY KEY REFERENCES subjects(id),
+            revision INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reference_postings (
+            subject_id INTEGER NOT NULL,
+            term TEXT NOT NULL,
+            reference_id INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (subject_id, term, reference_id)
+        ) WITHOUT ROWID
+    ''')
+    reference_index.update_indexes(cursor.connection)
+
+def _migrate_duplicate_detection(cursor):
+    """Keep exact hashes and MinHash signatures of questions so ingestion can spot duplicates."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS question_signatures (
+            question_id INTEGER PRIMARY KEY,
+            subject_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            minhash BLOB NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_question_signatures_hash ON question_signatures(subject_id, content_hash)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS question_lsh_buckets (
+            subject_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            PRIMARY KEY (subject_id, bucket, question_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_question_lsh_buckets_question_id ON question_lsh_buckets(question_id)")
+    
+    # Duplicates found during ingestion; duplicate_id is NULL when the copy was not inserted
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS question_duplicates (
+            id INTEGER PRIMARY KEY,
+            question_id INTEGER NOT NULL,
+            duplicate_id INTEGER,
+            source_path TEXT,
+            question TEXT NOT NULL,
+            similarity REAL NOT NULL,
+            action TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_question_duplicates_question_id ON question_duplicates(question_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_question_duplicates_duplicate_id ON question_duplicates(duplicate_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_question_duplicates_source_path ON question_duplicates(source_path)")
     
+    # When a kept question goes away, files whose copies of it were skipped are parsed again
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS questions_delete_signatures AFTER DELETE ON questions
+        BEGIN
+            DELETE FROM question_signatures WHERE question_id = old.id;
+            DELETE FROM question_lsh_buckets WHERE question_id = old.id;
+            DELETE FROM ingested_files WHERE kind = 'questions' AND path IN (
+                SELECT source_path FROM question_duplicates WHERE question_id = old.id AND duplicate_id IS NULL
+            );
+            DELETE FROM question_duplicates WHERE question_id = old.id;
+            DELETE FROM question_duplicates WHERE duplicate_id = old.id;
+        END
+    ''')
+    dedup.backfill(cursor.connection, stored_questions(cursor.connection))
+
+def _migrate_attempt_history(cursor):
+    """Record every answer and keep an SM-2 review schedule per question.
+
+    Both are keyed by subject and content hash rather than question id, because
+    re-ingesting a file gives its questions new ids.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            question_id INTEGER,
+            subject_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            answer TEXT,
+            correct INTEGER,
+            answered_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attempts_session_id ON attempts(session_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attempts_question ON attempts(subject_id, content_hash)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS review_schedule (
+            subject_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            repetitions INTEGER NOT NULL DEFAULT 0,
+            interval_days REAL NOT NULL DEFAULT 0,
+            ease REAL NOT NULL DEFAULT 2.5,
+            due_at REAL NOT NULL,
+            lapses INTEGER NOT NULL DEFAULT 0,
+            reviewed_at REAL,
+            PRIMARY KEY (subject_id, content_hash)
+        ) WITHOUT ROWID
+    ''')
+    # The due queue and the weak list are read in index order
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_review_schedule_due ON review_schedule(subject_id, due_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_review_schedule_ease ON review_schedule(subject_id, ease)")
+
+def _migrate_incremental_vacuum(cursor):
+    """Switch to incremental auto-vacuum so purged subjects give their pages back to the file system.
+
+    Changing auto_vacuum on an existing file takes effect only after a full VACUUM, which
+    runs once here and cannot be inside a transaction.
+    """
+    conn = cursor.connection
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.commit()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+def _migrate_item_parameters(cursor):
+    """Keep calibrated 2PL item parameters for adaptive tests (see adaptive.py).
+
+    Like the attempts they are fitted from, they are keyed by subject and content hash.
+    item_calibrations records the last attempt each subject's fit has seen.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS item_parameters (
+            subject_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            discrimination REAL NOT NULL,
+            difficulty REAL NOT NULL,
+            responses INTEGER NOT NULL,
+            PRIMARY KEY (subject_id, content_hash)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS item_calibrations (
+            subject_id INTEGER PRIMARY KEY,
+            last_attempt_id INTEGER NOT NULL,
+            sessions INTEGER NOT NULL,
+            calibrated_at REAL NOT NULL
+        )
+    ''')
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _migrate_ingestion_manifest,
+    _migrate_subjects_and_options,
+    _migrate_subject_revisions,
+    _migrate_explanation_cache,
+    _migrate_full_text_search,
+    _migrate_reference_index,
+    _migrate_duplicate_detection,
+    _migrate_attempt_history,
+    _migrate_incremental_vacuum,
+    _migrate_item_parameters,
+]
+
+def migrate_database(conn):
+    """Bring an existing database up to the current schema in place."""
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {number}")
     conn.commit()
-    conn.close()
 
-def parse_and_insert_questions(db_name, subject, doc_path):
-    """Parse questions from DOCX or PDF and insert them into the database."""
+def insert_question(db_name, subject, question, options, answer, explanation='', tags=''):
+    """Insert a question into the database."""
+    with QuestionStore(db_name) as store:
+        store.insert_questions(subject, [{
+            'question': question,
+            'options': split_options(options),
+            'answer': answer,
+            'explanation': explanation,
+            'tags': [tags] if tags else [],
+        }])
+
+def split_options(options):
+    """Split a legacy ', '-joined options string back into the option lines."""
+    return OPTION_SEPARATOR.split(options) if options else []
+
+def option_rows(question_id, options):
+    """Yield options table rows for option lines such as 'A. Some text'."""
+    for position, option in enumerate(options):
+        letter, _, text = option.partition('.')
+        yield (question_id, position, letter.strip().lower(), text.strip())
+
+def format_option(letter, text):
+    """Rebuild the 'A. Some text' display form of an options table row."""
+    return f"{letter.upper()}. {text}"
+
+def stored_questions(conn):
+    """Return (id, subject_id, question, option lines) for every stored question."""
+    options = {}
+    for question_id, letter, text in conn.execute("SELECT question_id, letter, text FROM options ORDER BY question_id, position"):
+        options.setdefault(question_id, []).append(format_option(letter, text))
+    rows = conn.execute("SELECT id, subject_id, question FROM questions ORDER BY id")
+    return [(question_id, subject_id, question, options.get(question_id, [])) for question_id, subject_id, question in rows]
+
+class QuestionStore:
+    """Bulk writer that holds one connection and inserts rows in batches.
+
+    Each call to insert_questions / insert_references runs inside a single
+    transaction on a reused connection, so a whole file costs one commit instead
+    of one per row.  Use as a context manager:
+
+        with QuestionStore(db_name) as store:
+            store.insert_questions(subject, questions)
+
+    Questions are checked against the subject's stored questions for exact and
+    near duplicates, which are handled by the duplicates policy ('skip', 'merge' or
+    'report', see dedup.py); pass duplicates=None to insert everything unchecked.
+    Either way each question's fingerprint is stored.
+    """
+
+    def __init__(self, db_name, duplicates=dedup.DEFAULT_POLICY):
+        self.db_name = db_name
+        self.conn = data_access.get_connection(db_name)
+        self.deduplicator = dedup.Deduplicator(self.conn, duplicates)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn = None  # The shared connection stays open for other callers
+
+    @tracing.traced('sql.insert_questions')
+    def insert_questions(self, subject, questions, source_path=None):
+        """Insert parsed question dicts for a subject in one transaction. Returns the row count."""
+        with self.conn:
+            return self._insert_questions(subject, questions, source_path)
+
+    @tracing.traced('sql.insert_references')
+    def insert_references(self, subject, references, source_path=None, reindex=True):
+        """Insert reference strings for a subject in one transaction. Returns the row count.
+
+        With reindex=False the subject's reference index is left stale and rebuilt the
+        next time it is loaded, which suits adding references one at a time.
+        """
+        with self.conn:
+            count = self._insert_references(subject, references, source_path)
+            if reindex:
+                reference_index.update_indexes(self.conn)
+            return count
+
+    def subject_id(self, subject):
+        """Return the id of a subject, adding it to the subjects table if needed."""
+        self.conn.execute("INSERT OR IGNORE INTO subjects (name) VALUES (?)", (subject,))
+        return self.conn.execute("SELECT id FROM subjects WHERE name = ?", (subject,)).fetchone()[0]
+
+    def _insert_questions(self, subject, questions, source_path):
+        """Insert questions and their options; questions may be a generator so parsing streams in."""
+        subject_id = self.subject_id(subject)
+        cursor = self.conn.cursor()
+        deduplicator = self.deduplicator
+        count = 0
+        questions = iter(questions)
+        while True:
+            batch = list(itertools.islice(questions, DEDUP_BATCH_SIZE))
+            if not batch:
+                break
+            # Signatures are hashed a batch at a time; matching is per question, so copies within a file are found
+            fingerprints = deduplicator.fingerprints(batch)
+            options = []
+            for q, fingerprint in zip(batch, fingerprints):
+                match = deduplicator.find(subject_id, fingerprint)
+                if match and deduplicator.policy != 'report':
+                    deduplicator.record(match, q, source_path)
+                    continue
+                
+                cursor.execute(INSERT_QUESTION_SQL, question_row(subject, q, source_path) + (subject_id,))
+                question_id = cursor.lastrowid
+                options.extend(option_rows(question_id, q['options']))
+                count += 1
+                deduplicator.add(question_id, subject_id, fingerprint)
+                if match:
+                    deduplicator.record(match, q, source_path, question_id)
+            cursor.executemany(INSERT_OPTION_SQL, options)
+        return count
+
+    def _insert_references(self, subject, references, source_path):
+        subject_id = self.subject_id(subject)
+        rows = ((subject, reference, source_path, subject_id) for reference in references)
+        return self.conn.executemany(INSERT_REFERENCE_SQL, rows).rowcount
+
+    def manifest(self):
+        """Return {(path, kind): (subject, mtime_ns, size, content_hash)} for every ingested file."""
+        rows = self.conn.execute("SELECT path, kind, subject, mtime_ns, size, content_hash FROM ingested_files")
+        return {(row[0], row[1]): row[2:] for row in rows}
+
+    @tracing.traced('ingest.replace_source')
+    def replace_source(self, path, kind, subject, mtime_ns, size, content_hash, items):
+        """Atomically swap the rows owned by a source file for freshly parsed ones."""
+        with self.conn:
+            if kind == 'questions':
+                self.conn.execute("DELETE FROM question_duplicates WHERE source_path = ?", (path,))
+                # Unchanged questions get new ids; keep their explanations instead of paying for them again
+                keep_explanations(self.conn, "g.question_id IN (SELECT id FROM questions WHERE source_path = ?)", (path,))
+            self.conn.execute(f"DELETE FROM {SOURCE_TABLES[kind]} WHERE source_path = ?", (path,))
+            if kind == 'questions':
+                count = self._insert_questions(subject, items, path)
+                restore_explanations(self.conn, self.subject_id(subject))
+            else:
+                count = self._insert_references(subject, items, path)
+                reference_index.update_indexes(self.conn)
+            self.conn.execute('''
+                INSERT OR REPLACE INTO ingested_files (path, kind, subject, mtime_ns, size, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (path, kind, subject, mtime_ns, size, content_hash))
+        return count
+
+    def touch_source(self, path, kind, mtime_ns, size):
+        """Record a new mtime for a file whose content hash has not changed."""
+        with self.conn:
+            self.conn.execute("UPDATE ingested_files SET mtime_ns = ?, size = ? WHERE path = ? AND kind = ?",
+                              (mtime_ns, size, path, kind))
+
+    @tracing.traced('sql.remove_source')
+    def remove_source(self, path, kind):
+        """Delete the rows and manifest entry of a file that no longer exists."""
+        with self.conn:
+            if kind == 'questions':
+                self.conn.execute("DELETE FROM question_duplicates WHERE source_path = ?", (path,))
+            self.conn.execute(f"DELETE FROM {SOURCE_TABLES[kind]} WHERE source_path = ?", (path,))
+            self.conn.execute("DELETE FROM ingested_files WHERE path = ? AND kind = ?", (path, kind))
+            if kind == 'references':
+                reference_index.update_indexes(self.conn)
+
+def keep_explanations(conn, condition, params):
+    """Set aside the cached explanations of the questions matching condition (on signatures g) before they are deleted.
+
+    The delete trigger drops cache rows with their question; restore_explanations ties
+    the kept rows to whichever stored question has the same content hash afterwards.
+    """
+    conn.execute("DROP TABLE IF EXISTS temp.kept_explanations")
+    conn.execute(f'''
+        CREATE TEMP TABLE kept_explanations AS
+        SELECT e.cache_key, e.model, e.explanation, e.created_at, e.last_used_at, g.content_hash
+        FROM explanation_cache e JOIN question_signatures g ON g.question_id = e.question_id
+        WHERE {condition}
+    ''', params)
+
+def restore_explanations(conn, subject_id):
+    """Re-insert the explanations kept by keep_explanations for questions of a subject that are stored again."""
+    conn.execute('''
+        INSERT OR IGNORE INTO explanation_cache (cache_key, question_id, model, explanation, created_at, last_used_at)
+        SELECT k.cache_key, g.question_id, k.model, k.explanation, k.created_at, k.last_used_at
+        FROM temp.kept_explanations k
+        JOIN question_signatures g ON g.subject_id = ? AND g.content_hash = k.content_hash
+        GROUP BY k.cache_key
+    ''', (subject_id,))
+    conn.execute("DROP TABLE temp.kept_explanations")
+
+def question_row(subject, q, source_path=None):
+    """Convert a parsed question dict into a row for the questions table."""
+    options = ', '.join(q['options'])  # Join options into a single string
+    return (subject, q['question'], options, q['answer'], q['explanation'], ', '.join(q['tags']), source_path)
+
+@tracing.traced('parse.questions')
+def parse_questions(doc_path):
+    """Parse questions from a DOCX or PDF file."""
     if doc_path.endswith('.pdf'):
-        questions = parse_questions_from_pdf(doc_path)
+        return parse_questions_from_pdf(doc_path)
     elif doc_path.endswith('.docx'):
-        questions = parse_questions_from_docx(doc_path)
+        return parse_questions_from_docx(doc_path)
     else:
         raise ValueError("Unsupported file format. Please provide a DOCX or PDF file.")
-    
-    for q in questions:
-        options = ', '.join(q['options'])  # Join options into a single string
-        insert_question(db_name, subject, q['question'], options, q['answer'], q['explanation'], ', '.join(q['tags']))
 
-def parse_questions_from_docx(doc_path):
-    """Parse questions from a DOCX file."""
-    questions = []
-    doc = Document(doc_path)
-    question = {}
+def parse_and_insert_questions(db_name, subject, doc_path, store=None):
+    """Parse questions from DOCX or PDF and insert them into the database.
+
+    Pass an open QuestionStore to reuse its connection across several files.
+    """
+    questions = parse_questions(doc_path)
     
-    for para in doc.paragraphs:
-        text = para.text.strip()
+    if store is not None:
+        return store.insert_questions(subject, questions)
+    with QuestionStore(db_name) as store:
+        return store.insert_questions(subject, questions)
+
+class QuestionParser:
+    """Line-by-line state machine for the Q / A.-D. / Answer: / Referenced from layout.
+
+    feed() takes one stripped line and returns the previous question once a new one
+    starts (only if it has options); finish() returns the last open question.  The
+    state lives in self.question, so a parse can be carried across page breaks or
+    page ranges parsed elsewhere.
+    """
+
+    def __init__(self, strip_question=False):
+        self.question = {}
+        self.strip_question = strip_question
+
+    def feed(self, text):
+        finished = None
         if text.startswith("Q"):  # Check for question
-            if question and question.get('options'):
-                questions.append(question)
-            question = {
-                'question': text.replace("?", ""), 
+            if self.question and self.question.get('options'):
+                finished = self.question
+            text = text.replace("?", "")
+            self.question = {
+                'question': text.strip() if self.strip_question else text, 
                 'options': [], 
                 'answer': '', 
                 'explanation': '', 
                 'tags': []
             }
         elif any(text.startswith(opt) for opt in ["A.", "B.", "C.", "D."]):
-            if question:
-                question['options'].append(text)
+            if self.question:
+                self.question['options'].append(text)
         elif text.startswith("Answer:"):
-            if question:
-                question['answer'] = text.split(":")[1].strip().lower()  # Store answer in lowercase
+            if self.question:
+                self.question['answer'] = text.split(":")[1].strip().lower()  # Store answer in lowercase
         elif text.startswith("Referenced from"):
-            if question:
-                question['explanation'] = text
+            if self.question:
+                self.question['explanation'] = text
+        return finished
 
-    # Append the last question if available
-    if question and question.get('options'):
-        questions.append(question)
+    def finish(self):
+        question, self.question = self.question, {}
+        if question and question.get('options'):
+            return question
+        return None
+
+def iter_questions(lines, strip_question=False):
+    """Yield complete questions from an iterable of stripped lines."""
+    parser = QuestionParser(strip_question)
+    for line in lines:
+        question = parser.feed(line)
+        if question:
+            yield question
     
-    return questions
+    # Yield the last question if available
+    question = parser.finish()
+    if question:
+        yield question
+
+def parse_questions_from_docx(doc_path):
+    """Parse questions from a DOCX file."""
+    return list(iter_questions(text.strip() for text in docx_stream.iter_paragraphs(doc_path)))
+
+# Parse tasks kept in flight per pool worker: enough to keep workers busy while results are written
+POOL_TASKS_PER_WORKER = 2
+
+# Page ranges of this size are parsed as separate tasks when a PDF is split across workers
+PDF_PAGES_PER_TASK = 50
+
+def pdf_page_count(doc_path):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(doc_path).pages)
+
+def iter_pdf_lines(doc_path, start_page=0, end_page=None):
+    """Yield the stripped text lines of a page range, extracting one page at a time."""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(doc_path)
+    end_page = len(reader.pages) if end_page is None else end_page
+    for number in range(start_page, end_page):
+        text = reader.pages[number].extract_text()
+        for line in text.splitlines():
+            yield line.strip()
+
+def iter_questions_from_pdf(doc_path, start_page=0, end_page=None):
+    """Stream questions from a PDF as its pages are extracted."""
+    return iter_questions(iter_pdf_lines(doc_path, start_page, end_page), strip_question=True)
 
 def parse_questions_from_pdf(doc_path):
     """Parse questions from a PDF file."""
-    questions = []
-    reader = PdfReader(doc_path)
-    question = {}
+    return list(iter_questions_from_pdf(doc_path))
+
+@tracing.traced('parse.pdf_pages')
+def parse_pdf_question_pages(doc_path, start_page, end_page):
+    """Parse a page range on its own so ranges can be handled by different workers.
+
+    Returns (head, questions, last): head holds the lines before the first question
+    that still belong to a question from an earlier range, questions are the ones
+    that start and end inside the range, and last is the question still open at the
+    end of the range (None if the range has no question at all).
+    merge_pdf_question_pages() stitches consecutive ranges back together.
+    """
+    parser = QuestionParser(strip_question=True)
+    head, questions = [], []
+    for line in iter_pdf_lines(doc_path, start_page, end_page):
+        if not parser.question:
+            if not line.startswith("Q"):
+                head.append(line)
+                continue
+        question = parser.feed(line)
+        if question:
+            questions.append(question)
+    return head, questions, parser.question or None
+
+def merge_pdf_question_pages(parts):
+    """Yield the questions of consecutive parse_pdf_question_pages() results in order."""
+    parser = QuestionParser(strip_question=True)
+    for head, questions, last in parts:
+        for line in head:
+            parser.feed(line)  # Continues the question carried over from the previous range
+        if last is not None:
+            question = parser.finish()
+            if question:
+                yield question
+            yield from questions
+            parser.question = last
     
-    for page in reader.pages:
-        text = page.extract_text()
-        for line in text.splitlines():
-            line = line.strip()
-            if line.startswith("Q"):  # Check for question
-                if question and question.get('options'):
-                    questions.append(question)
-                question = {
-                    'question': line.replace("?", "").strip(),  # Ensure to clean up the question text
-                    'options': [], 
-                    'answer': '', 
-                    'explanation': '', 
-                    'tags': []
-                }
-            elif any(line.startswith(opt) for opt in ["A.", "B.", "C.", "D."]):
-                if question:
-                    question['options'].append(line.strip())  # Clean up option text
-            elif line.startswith("Answer:"):
-                if question:
-                    question['answer'] = line.split(":")[1].strip().lower()  # Store answer in lowercase
-            elif line.startswith("Referenced from"):
-                if question:
-                    question['explanation'] = line.strip()
-
-    # Append the last question if available
-    if question and question.get('options'):
-        questions.append(question)
-    
-    return questions
-
-def insert_questions_from_subfolders(base_dir, db_name):
+    question = parser.finish()
+    if question:
+        yield question
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _is_within(path, base_dir):
+    return os.path.commonpath([os.path.abspath(path), os.path.abspath(base_dir)]) == os.path.abspath(base_dir)
+
+def iter_source(job):
+    """Stream the items of one (path, kind, ...) job in this process."""
+    path, kind = job[0], job[1]
+    if kind == 'questions':
+        return iter_questions_from_pdf(path) if path.endswith('.pdf') else parse_questions(path)
+    return iter_references_from_pdf(path) if path.endswith('.pdf') else parse_references(path)
+
+def parse_tasks(job):
+    """Split a job into worker tasks; large PDFs become several page ranges."""
+    path, kind = job[0], job[1]
+    if not path.endswith('.pdf'):
+        return [(path, kind, None, None)]
+    pages = pdf_page_count(path)
+    return [(path, kind, start, min(start + PDF_PAGES_PER_TASK, pages))
+            for start in range(0, pages, PDF_PAGES_PER_TASK)] or [(path, kind, 0, 0)]
+
+def parse_task(task):
+    """Parse one worker task; module level so it can run in a worker process."""
+    path, kind, start_page, end_page = task
+    if start_page is None:
+        return parse_questions(path) if kind == 'questions' else parse_references(path)
+    if kind == 'questions':
+        return parse_pdf_question_pages(path, start_page, end_page)
+    return list(iter_references_from_pdf(path, start_page, end_page))
+
+def combine_task_results(job, parts):
+    """Turn the results of a job's tasks, in task order, back into one stream of items."""
+    path, kind = job[0], job[1]
+    if not path.endswith('.pdf'):
+        return parts[0]
+    if kind == 'questions':
+        return merge_pdf_question_pages(parts)
+    return (reference for part in parts for reference in part)
+
+def iter_parsed_in_pool(pool, jobs, window):
+    """Parse jobs in a process pool and yield their items per job, in job order.
+
+    Tasks are submitted only while fewer than window are parsing or waiting to be
+    written, so memory stays flat however many files changed.  A job's tasks are
+    submitted together, so a PDF split into many ranges may overshoot the window once.
+    """
+    jobs = iter(jobs)
+    pending = deque()  # (job, futures of its tasks), in job order
+    in_flight = 0
+    while True:
+        while in_flight < window:
+            job = next(jobs, None)
+            if job is None:
+                break
+            futures = [pool.submit(parse_task, task) for task in parse_tasks(job)]
+            pending.append((job, futures))
+            in_flight += len(futures)
+        if not pending:
+            return
+        job, futures = pending.popleft()
+        in_flight -= len(futures)
+        yield combine_task_results(job, [future.result() for future in futures])
+
+@tracing.traced('ingest.sync_sources')
+def sync_sources(store, base_dir, sources, kinds=('questions',), workers=None):
+    """Ingest only new or modified files and drop rows of files that were deleted.
+
+    sources is a list of (path, kind, subject) tuples found under base_dir, where kind
+    is 'questions' or 'references'.  Files whose size and mtime match the manifest are
+    skipped without being read; files whose content hash still matches only have their
+    mtime refreshed.  Manifest entries of the given kinds under base_dir that are not in
+    sources belong to deleted files and have their rows removed first.  Deleting a
+    question also drops the manifest entries of files whose copies of it were skipped
+    as duplicates, so after writing, files left without an entry are parsed again, until
+    none are left; a question removed from one file stays in the bank through its copy.
+
+    With workers > 1 the changed files are parsed in a process pool while this process
+    stays the only writer; large PDFs are split into page ranges across the workers, and
+    at most POOL_TASKS_PER_WORKER tasks per worker are in flight.  By default there is one
+    worker per CPU, but no more than there are changed files.
+    Results are written in the order of sources, so row ids do not depend on the
+    number of workers.  With one worker, PDFs are streamed into the open transaction
+    page by page instead of being parsed up front.
+    """
+    seen = {(os.path.normpath(path), kind) for path, kind, _ in sources}
+    for path, kind in store.manifest():
+        if kind in kinds and (path, kind) not in seen and _is_within(path, base_dir):
+            print(f"Removing {kind} from deleted file {path}")
+            store.remove_source(path, kind)
+    
+    jobs = _changed_sources(store, sources)
+    while jobs:
+        pool_size = min(os.cpu_count() or 1, len(jobs)) if workers is None else workers
+        if pool_size > 1:
+            from concurrent.futures import ProcessPoolExecutor  # Pulls in multiprocessing; only the parallel path needs it
+            with ProcessPoolExecutor(max_workers=pool_size) as pool:
+                _write_parsed(store, jobs, iter_parsed_in_pool(pool, jobs, pool_size * POOL_TASKS_PER_WORKER))
+        else:
+            _write_parsed(store, jobs, map(iter_source, jobs))
+        jobs = _changed_sources(store, sources)
+
+def _changed_sources(store, sources):
+    """Return the jobs for sources that are new or changed since the manifest, refreshing the mtime of touched ones."""
+    manifest = store.manifest()
+    jobs = []
+    for path, kind, subject in sources:
+        path = os.path.normpath(path)
+        stat = os.stat(path)
+        entry = manifest.get((path, kind))
+        if entry and entry[0] == subject and entry[1:3] == (stat.st_mtime_ns, stat.st_size):
+            continue  # Unchanged since the last run
+        
+        content_hash = hash_file(path)
+        if entry and entry[0] == subject and entry[3] == content_hash:
+            store.touch_source(path, kind, stat.st_mtime_ns, stat.st_size)
+            continue
+        
+        jobs.append((path, kind, subject, stat.st_mtime_ns, stat.st_size, content_hash))
+    return jobs
+
+def _write_parsed(store, jobs, results):
+    for job, items in zip(jobs, results):
+        path, kind, subject = job[:3]
+        if kind == 'questions':
+            print(f"Inserting questions from {path} for subject '{subject}'")
+        else:
+            print(f"Loading references from {path} for subject '{subject}'")
+        store.replace_source(*job, items)
+
+def walk_sources(base_dir):
+    """Yield (root, sorted file names) for every folder under base_dir in a stable order."""
+    for root, dirs, files in os.walk(base_dir):
+        dirs.sort()
+        yield root, sorted(files)
+
+def insert_questions_from_subfolders(base_dir, db_name, workers=None, duplicates=dedup.DEFAULT_POLICY):
     # Create the database and table
     create_database(db_name)
 
     # Walk through all subdirectories in the base directory
-    for root, dirs, files in os.walk(base_dir):
+    sources = []
+    for root, files in walk_sources(base_dir):
         for file in files:
             file_path = os.path.join(root, file)
             subject = os.path.basename(root)  # Get the name of the current folder as the subject
             
-            # Check the file extension and parse accordingly
-            if file.endswith('.docx'):
-                print(f"Inserting questions from {file_path} for subject '{subject}'")
-                parse_and_insert_questions(db_name, subject, file_path)
-            elif file.endswith('.pdf'):
-                print(f"Inserting questions from {file_path} for subject '{subject}'")
-                parse_and_insert_questions(db_name, subject, file_path)
+            # Only DOCX and PDF files hold questions
+            if file.endswith('.docx') or file.endswith('.pdf'):
+                sources.append((file_path, 'questions', subject))
+    
+    # Parse and insert only what changed since the last run
+    with QuestionStore(db_name, duplicates) as store:
+        sync_sources(store, base_dir, sources, workers=workers)
+        report_duplicates(store)
+
+def report_duplicates(store):
+    """Print how many duplicates a store met during ingestion."""
+    if store.deduplicator.found:
+        print(f"Found {store.deduplicator.found} duplicate questions ({store.deduplicator.policy}); "
+              f"run 'python dedup.py report' for details")
+
+# ----------------------------
+# Purging, rebuilding and reclaiming space
+# ----------------------------
+
+# Free pages returned per incremental_vacuum step; each step is its own short write transaction
+VACUUM_STEP_PAGES = 2048
+
+def purge_subject_rows(conn, subject_id):
+    """Delete a subject's questions, references, index and manifest entries inside the caller's transaction.
+
+    Triggers take the options, full-text rows, signatures, duplicates and cached
+    explanations with them.  The subject row, attempts and review schedule are kept,
+    since they are keyed by content hash and carry over to re-ingested questions.
+    """
+    name = conn.execute("SELECT name FROM subjects WHERE id = ?", (subject_id,)).fetchone()[0]
+    conn.execute("DELETE FROM questions WHERE subject_id = ?", (subject_id,))
+    conn.execute("DELETE FROM study_references WHERE subject_id = ?", (subject_id,))
+    conn.execute("DELETE FROM reference_postings WHERE subject_id = ?", (subject_id,))
+    conn.execute("DELETE FROM reference_indexes WHERE subject_id = ?", (subject_id,))
+    conn.execute("DELETE FROM ingested_files WHERE subject = ? COLLATE NOCASE AND kind IN ('questions', 'references')",
+                 (name,))
+
+def purge_subjects(db_name, subjects):
+    """Remove the named subjects' questions and references in one transaction, then reclaim the space.
+
+    Returns the names of the subjects that were found.
+    """
+    conn = data_access.get_connection(db_name)
+    purged = []
+    with conn:
+        for subject in subjects:
+            row = conn.execute("SELECT id, name FROM subjects WHERE name = ?", (subject,)).fetchone()
+            if row:
+                purge_subject_rows(conn, row[0])
+                purged.append(row[1])
+    reclaim_space(db_name)
+    return purged
+
+def swap_in_subjects(db_name, shadow_name, subjects):
+    """Replace subjects in db_name with their rows from the fully ingested database shadow_name.
+
+    Everything happens in one write transaction, so readers (in WAL mode) see either the
+    old bank or the new one and are never blocked; only other writers wait.  Question and
+    reference ids are shifted past the live tables' sequences so the options, signatures,
+    duplicates and manifest copied with them stay consistent.  Cached explanations of
+    questions whose content did not change are kept.  A subject missing from the shadow
+    is simply purged.
+    """
+    conn = data_access.get_connection(db_name)
+    conn.execute("ATTACH DATABASE ? AS shadow", (shadow_name,))
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")  # Take the write lock before reading the id sequences
+            offsets = dict(conn.execute("SELECT name, seq FROM sqlite_sequence"))
+            question_offset = offsets.get('questions', 0)
+            reference_offset = offsets.get('study_references', 0)
+            for subject in subjects:
+                conn.execute("INSERT OR IGNORE INTO subjects (name) VALUES (?)", (subject,))
+                subject_id = conn.execute("SELECT id FROM subjects WHERE name = ?", (subject,)).fetchone()[0]
+                row = conn.execute("SELECT id FROM shadow.subjects WHERE name = ?", (subject,)).fetchone()
+                shadow_id = row[0] if row else None
+
+                keep_explanations(conn, "g.subject_id = ?", (subject_id,))
+                purge_subject_rows(conn, subject_id)
+                if shadow_id is None:
+                    conn.execute("DROP TABLE temp.kept_explanations")
+                    continue
+
+                params = {'offset': question_offset, 'subject_id': subject_id, 'shadow_id': shadow_id}
+                conn.execute('''
+                    INSERT INTO questions (id, subject, question, options, answer, explanation, tags, source_path, subject_id)
+                    SELECT id + :offset, subject, question, options, answer, explanation, tags, source_path, :subject_id
+                    FROM shadow.questions WHERE subject_id = :shadow_id ORDER BY id
+                ''', params)
+                conn.execute('''
+                    INSERT INTO options (question_id, position, letter, text)
+                    SELECT o.question_id + :offset, o.position, o.letter, o.text
+                    FROM shadow.options o JOIN shadow.questions q ON q.id = o.question_id WHERE q.subject_id = :shadow_id
+                ''', params)
+                conn.execute('''
+                    INSERT INTO question_signatures (question_id, subject_id, content_hash, minhash)
+                    SELECT question_id + :offset, :subject_id, content_hash, minhash
+                    FROM shadow.question_signatures WHERE subject_id = :shadow_id
+                ''', params)
+                conn.execute('''
+                    INSERT INTO question_lsh_buckets (subject_id, bucket, question_id)
+                    SELECT :subject_id, bucket, question_id + :offset FROM shadow.question_lsh_buckets WHERE subject_id = :shadow_id
+                ''', params)
+                conn.execute('''
+                    INSERT INTO question_duplicates (question_id, duplicate_id, source_path, question, similarity, action)
+                    SELECT d.question_id + :offset, d.duplicate_id + :offset, d.source_path, d.question, d.similarity, d.action
+                    FROM shadow.question_duplicates d JOIN shadow.questions q ON q.id = d.question_id
+                    WHERE q.subject_id = :shadow_id ORDER BY d.id
+                ''', params)
+                conn.execute('''
+                    INSERT INTO study_references (id, subject, reference, source_path, subject_id)
+                    SELECT id + :offset, subject, reference, source_path, :subject_id
+                    FROM shadow.study_references WHERE subject_id = :shadow_id ORDER BY id
+                ''', dict(params, offset=reference_offset))
+                conn.execute('''
+                    INSERT OR REPLACE INTO ingested_files (path, kind, subject, mtime_ns, size, content_hash)
+                    SELECT path, kind, subject, mtime_ns, size, content_hash FROM shadow.ingested_files
+                    WHERE subject = ? COLLATE NOCASE AND kind IN ('questions', 'references')
+                ''', (subject,))
+                restore_explanations(conn, subject_id)
+            reference_index.update_indexes(conn)
+    finally:
+        conn.execute("DETACH DATABASE shadow")
+
+def reclaim_space(db_name, step=VACUUM_STEP_PAGES):
+    """Return free pages to the file system with incremental_vacuum, a few at a time.
+
+    Each step is a short transaction, so readers and writers interleave with it.
+    Returns the number of pages freed.
+    """
+    conn = data_access.get_connection(db_name)
+    freed = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            break
+        with conn:
+            conn.execute(f"PRAGMA incremental_vacuum({min(step, free)})").fetchall()
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if after >= free:
+            break  # Not in incremental auto-vacuum mode
+        freed += free - after
+    return freed
 
 def insert_reference(db_name, subject, reference):
     """Insert a reference into the database."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO study_references (subject, reference)
-        VALUES (?, ?)
-    ''', (subject, reference))
-    
-    conn.commit()
-    conn.close()
+    with QuestionStore(db_name) as store:
+        store.insert_references(subject, [reference], reindex=False)
 
-def load_references_from_notes(db_name, subject, notes_path):
-    """Load study references from a DOCX or PDF file containing notes and insert into the database."""
+@tracing.traced('parse.references')
+def parse_references(notes_path):
+    """Parse references from a DOCX or PDF notes file."""
     if notes_path.endswith('.docx'):
-        references = parse_references_from_docx(notes_path)
+        return parse_references_from_docx(notes_path)
     elif notes_path.endswith('.pdf'):
-        references = parse_references_from_pdf(notes_path)
+        return parse_references_from_pdf(notes_path)
     else:
         raise ValueError("Unsupported file format. Please provide a DOCX or PDF file.")
+
+def load_references_from_notes(db_name, subject, notes_path, store=None):
+    """Load study references from a DOCX or PDF file containing notes and insert into the database.
+
+    Pass an open QuestionStore to reuse its connection across several files.
+    """
+    references = parse_references(notes_path)
     
-    for reference in references:
-        insert_reference(db_name, subject, reference)
+    if store is not None:
+        return store.insert_references(subject, references)
+    with QuestionStore(db_name) as store:
+        return store.insert_references(subject, references)
 
 def parse_references_from_docx(doc_path):
     """Parse references from a DOCX file."""
     references = []
-    doc = Document(doc_path)
-    
-    for para in doc.paragraphs:
-        text = para.text.strip()
+    for text in docx_stream.iter_paragraphs(doc_path):
+        text = text.strip()
         if text:  # Only add non-empty references
             references.append(text)
     
     return references
 
-def parse_references_from_pdf(doc_path):
-    """Parse references from a PDF file."""
-    references = []
+def iter_references_from_pdf(doc_path, start_page=0, end_page=None):
+    """Stream references from a PDF page range, one line at a time."""
+    from PyPDF2 import PdfReader
     reader = PdfReader(doc_path)
-    
-    for page in reader.pages:
-        text = page.extract_text()
+    end_page = len(reader.pages) if end_page is None else end_page
+    for number in range(start_page, end_page):
+        text = reader.pages[number].extract_text()
         if text:
-            references.extend(text.splitlines())  # Split lines and add to references
-    
-    return references
+            yield from text.splitlines()  # Split lines and add to references
+
+def parse_references_from_pdf(doc_path):
+    """Parse references from a PDF file."""
+    return list(iter_references_from_pdf(doc_path))
 
 def get_references_by_subject(db_name, subject):
     """Retrieve and display references for a specific subject."""
-    conn = sqlite3.connect(db_name)
+    conn = data_access.get_connection(db_name)
     cursor = conn.cursor()
     
-    cursor.execute("SELECT reference FROM study_references WHERE subject = ?", (subject,))
+    cursor.execute('''
+        SELECT r.reference FROM study_references r
+        JOIN subjects s ON s.id = r.subject_id
+        WHERE s.name = ?
+        ORDER BY r.id
+    ''', (subject,))
     rows = cursor.fetchall()
     
     if rows:
@@ -210,11 +1110,16 @@ def get_references_by_subject(db_name, subject):
             print(f"- {row[0]}")
     else:
         print(f"No references found for subject: {subject}")
-    
-    conn.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load questions from the contents/ tree into the database.")
+    parser.add_argument('--workers', type=int,
+                        help="Number of processes used to parse documents (default: one per CPU, at most one per changed file)")
+    parser.add_argument('--duplicates', choices=dedup.POLICIES, default=dedup.DEFAULT_POLICY,
+                        help="What to do with questions that duplicate stored ones")
+    args = parser.parse_args()
+    
     base_directory = 'contents'  # Base directory containing subfolders
     db_name = 'questions.db'  # Database name
-    insert_questions_from_subfolders(base_directory, db_name)
+    insert_questions_from_subfolders(base_directory, db_name, args.workers, args.duplicates)
     print("All questions have been successfully inserted into the database.")
@@ -0,0 +1,309 @@
+import argparse
+import functools
+import hashlib
+import re
+import zlib
+import data_access
+
+# What ingestion does with a question that matches one already stored for the subject:
+#   skip   - drop the new copy and record where it came from
+#   merge  - like skip, but first copy its tags and explanation onto the stored question
+#   report - insert it anyway and only record the pair
+POLICIES = ('skip', 'merge', 'report')
+DEFAULT_POLICY = 'merge'
+
+# MinHash / LSH parameters.  Signatures are stored, so changing any of these (or SEED)
+# requires recomputing them with `python dedup.py backfill --rebuild`.
+NUM_PERMUTATIONS = 128
+BANDS = 16  # 8 rows per band: pairs above ~0.7 Jaccard almost always share a bucket
+SHINGLE_SIZE = 3  # Words per shingle
+SEED = 1729
+
+# Estimated Jaccard similarity at which two questions count as duplicates
+THRESHOLD = 0.8
+
+_SHINGLE_MULTIPLIER = 0x9E3779B97F4A7C15
+
+@functools.cache
+def _hash_parameters():
+    """Draw the hash parameters from SEED; done on first use so importing dedup does not load numpy."""
+    import numpy as np
+    rng = np.random.default_rng(SEED)
+    # Multiply-shift hash functions, one per permutation: ((a * x + b) mod 2**64) >> 32 with odd a
+    a = (rng.integers(0, 1 << 63, NUM_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1))[:, None]
+    b = rng.integers(0, 1 << 63, NUM_PERMUTATIONS, dtype=np.uint64)[:, None]
+    # Random odd multipliers that fold each band's rows into one 64-bit bucket key
+    band_keys = rng.integers(0, 1 << 63, (BANDS, NUM_PERMUTATIONS // BANDS), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    return a, b, band_keys
+
+QUESTION_NUMBER = re.compile(r"^\s*q?\d+\s*[.):]\s*", re.IGNORECASE)
+OPTION_LETTER = re.compile(r"^\s*[a-z]\s*[.)]\s*", re.IGNORECASE)
+WORD = re.compile(r"\w+")
+
+def normalize(question, options):
+    """Reduce a question to comparable words: numbering, letters, case, punctuation and option order removed."""
+    words = WORD.findall(QUESTION_NUMBER.sub('', question).lower())
+    for option in sorted(OPTION_LETTER.sub('', option).lower() for option in options):
+        words.extend(WORD.findall(option))
+    return words
+
+def content_hash(question, options):
+    """The exact-duplicate key of a question, as stored in question_signatures."""
+    return hashlib.sha1(' '.join(normalize(question, options)).encode('utf-8')).hexdigest()
+
+_word_hashes = {}
+
+def shingle_hashes(word_lists):
+    """Hash every run of SHINGLE_SIZE words of each word list to a 32-bit integer.
+
+    Returns (hashes, offsets): the shingles of list i start at offsets[i].  Lists
+    shorter than SHINGLE_SIZE are padded so each yields at least one shingle.
+    """
+    import numpy as np
+    words = []
+    lengths = []
+    for word_list in word_lists:
+        for word in word_list:
+            h = _word_hashes.get(word)
+            if h is None:
+                h = _word_hashes[word] = zlib.crc32(word.encode('utf-8'))
+            words.append(h)
+        padding = max(0, SHINGLE_SIZE - len(word_list))
+        words.extend([0] * padding)
+        lengths.append(len(word_list) + padding)
+    words = np.array(words, dtype=np.uint64)
+    lengths = np.array(lengths)
+
+    # Window start positions, skipping windows that would run into the next list
+    counts = lengths - SHINGLE_SIZE + 1
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    hashes = np.zeros(len(positions), dtype=np.uint64)
+    for i in range(SHINGLE_SIZE):
+        hashes = hashes * np.uint64(_SHINGLE_MULTIPLIER) + words[positions + i]  # uint64 arithmetic wraps
+    return hashes >> np.uint64(32), np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+def shingles(words):
+    """The set of shingle hashes of one word list."""
+    return set(shingle_hashes([words])[0].tolist())
+
+def fingerprints(items):
+    """Return (content_hash, minhash signature, LSH buckets) for each (question, options) pair.
+
+    The whole batch is hashed with a few array operations.
+    """
+    import numpy as np
+    word_lists = [normalize(question, options) for question, options in items]
+    if not word_lists:
+        return []
+
+    values, offsets = shingle_hashes(word_lists)
+    a, b, band_keys = _hash_parameters()
+    # One universal hash per permutation, then the minimum per question
+    permuted = (a * values + b) >> np.uint64(32)
+    signatures = np.ascontiguousarray(np.minimum.reduceat(permuted, offsets, axis=1).T).astype(np.uint32)
+    # One key per band; uint64 arithmetic wraps, and each band has its own multipliers
+    buckets = (signatures.reshape(len(items), BANDS, -1).astype(np.uint64) * band_keys).sum(axis=2, dtype=np.uint64).view(np.int64)
+
+    return [(hashlib.sha1(' '.join(words).encode('utf-8')).hexdigest(), signature, bucket_keys.tolist())
+            for words, signature, bucket_keys in zip(word_lists, signatures, buckets)]
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    return float((a == b).mean())
+
+def signature_from_blob(blob):
+    """Read a stored minhash column back as a uint32 array."""
+    import numpy as np
+    return np.frombuffer(blob, dtype=np.uint32)
+
+class Deduplicator:
+    """Matches questions against the stored signatures of their subject during ingestion.
+
+    Works on the caller's connection and transaction, so a question inserted earlier
+    in the same file is already visible to later ones.  With policy None nothing is
+    matched, but signatures are still stored: their content hashes also identify a
+    question across re-ingestion (see history.py).
+    """
+
+    def __init__(self, conn, policy=DEFAULT_POLICY, threshold=THRESHOLD):
+        if policy is not None and policy not in POLICIES:
+            raise ValueError(f"Unknown duplicate policy {policy!r}; expected one of {', '.join(POLICIES)}")
+        self.conn = conn
+        self.policy = policy
+        self.threshold = threshold
+        self.found = 0
+
+    def fingerprints(self, questions):
+        return fingerprints([(q['question'], q['options']) for q in questions])
+
+    def find(self, subject_id, fingerprint):
+        """Return (question_id, similarity) of the closest stored duplicate, or None."""
+        if self.policy is None:
+            return None
+        content_hash, signature, buckets = fingerprint
+        row = self.conn.execute("SELECT question_id FROM question_signatures WHERE subject_id = ? AND content_hash = ?",
+                                (subject_id, content_hash)).fetchone()
+        if row:
+            return (row[0], 1.0)
+
+        candidates = self.conn.execute(f'''
+            SELECT s.question_id, s.minhash FROM question_signatures s
+            WHERE s.question_id IN (
+                SELECT question_id FROM question_lsh_buckets
+                WHERE subject_id = ? AND bucket IN ({', '.join('?' * len(buckets))})
+            )
+        ''', [subject_id] + buckets).fetchall()
+        best = None
+        for question_id, minhash in candidates:
+            score = similarity(signature, signature_from_blob(minhash))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (question_id, score)
+        return best
+
+    def add(self, question_id, subject_id, fingerprint):
+        """Store the signature and LSH buckets of an inserted question."""
+        content_hash, signature, buckets = fingerprint
+        self.conn.execute('''
+            INSERT OR REPLACE INTO question_signatures (question_id, subject_id, content_hash, minhash)
+            VALUES (?, ?, ?, ?)
+        ''', (question_id, subject_id, content_hash, signature.tobytes()))
+        self.conn.executemany('''
+            INSERT OR IGNORE INTO question_lsh_buckets (subject_id, bucket, question_id) VALUES (?, ?, ?)
+        ''', ((subject_id, bucket, question_id) for bucket in buckets))
+
+    def record(self, match, q, source_path, duplicate_id=None):
+        """Note a duplicate of match[0]; duplicate_id is set when the copy was inserted too."""
+        question_id, score = match
+        self.found += 1
+        action = 'report' if duplicate_id is not None else self.policy
+        self.conn.execute('''
+            INSERT INTO question_duplicates (question_id, duplicate_id, source_path, question, similarity, action)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (question_id, duplicate_id, source_path, q['question'], score, action))
+        if action == 'merge':
+            self.merge(question_id, q)
+
+    def merge(self, question_id, q):
+        """Give the stored question the copy's explanation if it has none, and the union of their tags."""
+        explanation, tags = self.conn.execute("SELECT explanation, tags FROM questions WHERE id = ?",
+                                              (question_id,)).fetchone()
+        merged_tags = [tag for tag in (tags or '').split(', ') if tag]
+        merged_tags += [tag for tag in q['tags'] if tag not in merged_tags]
+        new_explanation = explanation or q['explanation']
+        new_tags = ', '.join(merged_tags)
+        if (new_explanation, new_tags) != (explanation, tags or ''):
+            self.conn.execute("UPDATE questions SET explanation = ?, tags = ? WHERE id = ?",
+                              (new_explanation, new_tags, question_id))
+
+def backfill(conn, rows, rebuild=False):
+    """Store signatures for (question_id, subject_id, question, options) rows that have none.
+
+    Existing rows are only fingerprinted, never removed; use the report to find their
+    duplicates.  Returns the number of questions fingerprinted.
+    """
+    if rebuild:
+        conn.execute("DELETE FROM question_signatures")
+        conn.execute("DELETE FROM question_lsh_buckets")
+    known = {row[0] for row in conn.execute("SELECT question_id FROM question_signatures")}
+    rows = [row for row in rows if row[0] not in known]
+    deduplicator = Deduplicator(conn)
+    for row, fingerprint in zip(rows, fingerprints([(row[2], row[3]) for row in rows])):
+        deduplicator.add(row[0], row[1], fingerprint)
+    return len(rows)
+
+def find_clusters(db_name, subject=None, threshold=THRESHOLD):
+    """Group stored questions into clusters of near-duplicates using their shared LSH buckets.
+
+    Returns a list of clusters, largest first; each is a list of question ids, lowest first.
+    """
+    conn = data_access.get_connection(db_name)
+    subject_filter = "WHERE subject_id = (SELECT id FROM subjects WHERE name = ?)" if subject else ""
+    params = (subject,) if subject else ()
+
+    parent = {}  # Union-find over question ids
+    def root(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    signatures = {}
+    def signature(question_id):
+        if question_id not in signatures:
+            blob = conn.execute("SELECT minhash FROM question_signatures WHERE question_id = ?", (question_id,)).fetchone()
+            signatures[question_id] = signature_from_blob(blob[0])
+        return signatures[question_id]
+
+    buckets = conn.execute(f'''
+        SELECT group_concat(question_id) FROM question_lsh_buckets {subject_filter}
+        GROUP BY subject_id, bucket HAVING count(*) > 1
+    ''', params)
+    for (members,) in buckets:
+        ids = sorted(int(x) for x in members.split(','))
+        for question_id in ids:
+            parent.setdefault(question_id, question_id)
+        for other in ids[1:]:
+            a, b = root(ids[0]), root(other)
+            if a != b and similarity(signature(ids[0]), signature(other)) >= threshold:
+                parent[max(a, b)] = min(a, b)
+
+    clusters = {}
+    for question_id in parent:
+        clusters.setdefault(root(question_id), []).append(question_id)
+    return sorted((sorted(members) for members in clusters.values() if len(members) > 1),
+                  key=lambda c: (-len(c), c[0]))
+
+def report(db_name, subject=None, threshold=THRESHOLD):
+    """Print the duplicate clusters in the database and the copies ingestion left out."""
+    conn = data_access.get_connection(db_name)
+    clusters = find_clusters(db_name, subject, threshold)
+    skipped = {}
+    for question_id, source_path, score, action in conn.execute('''
+        SELECT question_id, source_path, similarity, action FROM question_duplicates
+        WHERE duplicate_id IS NULL ORDER BY id
+    '''):
+        skipped.setdefault(question_id, []).append((source_path, score, action))
+
+    # Questions whose only copies were skipped form clusters of their own
+    clustered = {question_id for cluster in clusters for question_id in cluster}
+    clusters += [[question_id] for question_id in sorted(skipped) if question_id not in clustered]
+
+    shown = duplicates = 0
+    for cluster in clusters:
+        rows = conn.execute(f'''
+            SELECT q.id, s.name, q.question, q.source_path FROM questions q JOIN subjects s ON s.id = q.subject_id
+            WHERE q.id IN ({', '.join('?' * len(cluster))}) ORDER BY q.id
+        ''', cluster).fetchall()
+        if not rows or (subject and rows[0][1].lower() != subject.lower()):
+            continue
+        shown += 1
+        print(f"Cluster {shown} ({rows[0][1]}): {rows[0][2]}")
+        duplicates += len(rows) - 1
+        for question_id, _, _, source_path in rows:
+            print(f"  stored  #{question_id:<6} {source_path or '(no source)'}")
+            for path, score, action in skipped.get(question_id, []):
+                print(f"  {action:<7} copy    {path or '(no source)'} (similarity {score:.2f})")
+                duplicates += 1
+    print(f"{shown} clusters, {duplicates} duplicate questions")
+
+if __name__ == "__main__":
+    import database
+
+    parser = argparse.ArgumentParser(description="Find duplicate questions in the question bank.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report', help="Print clusters of duplicate questions")
+    report_parser.add_argument('--subject', help="Only report this subject")
+    report_parser.add_argument('--threshold', type=float, default=THRESHOLD, help="Minimum estimated similarity")
+    backfill_parser = subparsers.add_parser('backfill', help="Fingerprint questions stored without a signature")
+    backfill_parser.add_argument('--rebuild', action='store_true', help="Recompute every signature")
+    args = parser.parse_args()
+
+    db_name = 'questions.db'  # Database name
+    database.create_database(db_name)
+    if args.command == 'report':
+        report(db_name, args.subject, args.threshold)
+    else:
+        with data_access.transaction(db_name) as conn:
+            count = backfill(conn, database.stored_questions(conn), args.rebuild)
+        print(f"Fingerprinted {count} questions.")
@@ -0,0 +1,133 @@
+import argparse
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Paragraph text straight from word/document.xml, without building python-docx's object model.
+# Only top-level body paragraphs are read and their text is put together exactly like
+# python-docx's Paragraph.text: runs and hyperlink runs in order, with w:t text, w:tab and
+# w:ptab as tabs, w:cr and text-wrapping w:br as newlines, other breaks as '' and
+# w:noBreakHyphen as '-'.  Anything else in a paragraph (fields, tracked changes, content
+# controls) is skipped, as python-docx skips it.
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+DOCUMENT, BODY, PARAGRAPH, RUN, HYPERLINK = W + 'document', W + 'body', W + 'p', W + 'r', W + 'hyperlink'
+RUN_TEXT = {W + 'tab': '\t', W + 'ptab': '\t', W + 'cr': '\n', W + 'noBreakHyphen': '-'}
+TEXT, BREAK, BREAK_TYPE = W + 't', W + 'br', W + 'type'
+
+def main_part_name(archive):
+    """Return the zip member holding the main document, as named by the package relationships, or None."""
+    try:
+        rels = ET.fromstring(archive.read('_rels/.rels'))
+    except (KeyError, ET.ParseError):
+        return None
+    for rel in rels.iter(RELATIONSHIPS):
+        if rel.get('Type') == OFFICE_DOCUMENT and rel.get('TargetMode') != 'External':
+            name = posixpath.normpath(rel.get('Target', '').lstrip('/'))
+            if name in archive.namelist():
+                return name
+    return None
+
+def paragraph_text(p):
+    """The text of a finished w:p element, as python-docx's Paragraph.text returns it."""
+    parts = []
+    for child in p:
+        if child.tag == RUN:
+            runs = (child,)
+        elif child.tag == HYPERLINK:
+            runs = child.iterfind(RUN)
+        else:
+            continue
+        for run in runs:
+            for e in run:
+                if e.tag == TEXT:
+                    parts.append(e.text or '')
+                elif e.tag == BREAK:
+                    parts.append('\n' if e.get(BREAK_TYPE, 'textWrapping') == 'textWrapping' else '')
+                elif e.tag in RUN_TEXT:
+                    parts.append(RUN_TEXT[e.tag])
+    return ''.join(parts)
+
+def iter_document_paragraphs(doc_path):
+    """Yield body paragraph texts through python-docx."""
+    from docx import Document
+    for para in Document(doc_path).paragraphs:
+        yield para.text
+
+def iter_paragraphs(doc_path):
+    """Yield the text of every top-level paragraph of a DOCX.
+
+    The main document part is streamed with iterparse and each paragraph is dropped once
+    read.  Files that are not a WordprocessingML zip package in the transitional namespace
+    (a broken zip, a missing main part, Strict OOXML) go through python-docx instead, which
+    reads what it can and raises its usual errors for the rest.
+    """
+    try:
+        archive = zipfile.ZipFile(doc_path)
+    except zipfile.BadZipFile:
+        yield from iter_document_paragraphs(doc_path)
+        return
+    with archive:
+        name = main_part_name(archive)
+        if name is None:
+            yield from iter_document_paragraphs(doc_path)
+            return
+        with archive.open(name) as stream:
+            events = ET.iterparse(stream, events=('start', 'end'))
+            event, root = next(events)
+            if root.tag != DOCUMENT:
+                yield from iter_document_paragraphs(doc_path)
+                return
+            body = None
+            depth = 0  # Depth below w:body
+            for event, elem in events:
+                if event == 'start':
+                    if body is not None:
+                        depth += 1
+                    elif elem.tag == BODY:
+                        body = elem
+                    continue
+                if body is None:
+                    continue
+                if elem is body:
+                    break
+                depth -= 1
+                if depth == 0:  # A top-level block: paragraph, table, section properties...
+                    if elem.tag == PARAGRAPH:
+                        yield paragraph_text(elem)
+                    del body[:]  # Keep memory flat; the parsed block is no longer needed
+
+def check_parity(paths):
+    """Compare each file's paragraphs, questions and references with what python-docx gives.
+
+    Returns the list of files that differ.
+    """
+    import database
+    mismatched = []
+    for path in paths:
+        lines = [text.strip() for text in iter_document_paragraphs(path)]
+        same = ([text.strip() for text in iter_paragraphs(path)] == lines
+                and database.parse_questions_from_docx(path) == list(database.iter_questions(lines))
+                and database.parse_references_from_docx(path) == [line for line in lines if line])
+        print(f"{'ok  ' if same else 'DIFF'} {path} ({len(lines)} paragraphs)")
+        if not same:
+            mismatched.append(path)
+    return mismatched
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the streaming DOCX reader against python-docx.")
+    parser.add_argument('paths', nargs='*', default=['contents'], help="DOCX files or folders to check")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(root, name) for root, _, names in os.walk(path)
+                            for name in names if name.endswith('.docx'))
+        else:
+            files.append(path)
+    if check_parity(files):
+        raise SystemExit("The streaming reader differs from python-docx")
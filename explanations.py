@@ -0,0 +1,266 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import data_access
+import tracing
+from quiz_engine import correct_option_text, load_questions
+
+# Chat-completions endpoint; override with OPENAI_API_URL to point at a proxy or a local stub server
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+MODEL = "gpt-3.5-turbo"  # or any other model you prefer
+
+# Upper bound on explanation requests in flight at once
+MAX_CONCURRENT_REQUESTS = 8
+
+ERROR_MESSAGE = "Error retrieving explanation from OpenAI API."
+
+# Bump whenever build_prompt changes so cached explanations for the old prompt are not reused
+PROMPT_VERSION = 1
+
+# Cached explanations expire after this many seconds; the table keeps at most this many entries
+EXPLANATION_TTL = 30 * 24 * 3600
+MAX_CACHED_EXPLANATIONS = 50000
+MEMORY_CACHE_SIZE = 1024
+
+def load_api_key():
+    """Read OPENAI_API_KEY, loading the .env file first."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("OPENAI_API_KEY")
+
+def build_prompt(question, correct_answer):
+    return f"Explain why the answer '{correct_answer}' is correct for the following question: {question}"
+
+def cache_key(question, correct_answer, model):
+    """Key an explanation by everything that determines it."""
+    material = "\0".join((question, correct_answer, model, str(PROMPT_VERSION)))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+class ExplanationCache:
+    """Explanation cache in questions.db with an in-memory LRU layer in front of it.
+
+    Entries older than ttl seconds are treated as missing, and the table is trimmed to
+    max_entries by least recent use, every 100 puts and by the prewarm command; creating
+    a cache does not touch the database, so startup never waits on an ingest's write
+    lock.  Rows are tied to a question id, and triggers on the questions table drop them
+    when that question is edited or deleted.  Safe to use from the fetcher's worker threads.
+    """
+
+    def __init__(self, db_name, ttl=EXPLANATION_TTL, max_entries=MAX_CACHED_EXPLANATIONS,
+                 memory_entries=MEMORY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.db_name = db_name
+
+    @tracing.traced('sql.explanation_cache_get')
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[1] > now - self.ttl:
+                self.memory.move_to_end(key)
+                return entry[0]
+
+        conn = data_access.get_connection(self.db_name)  # One connection per worker thread
+        row = conn.execute(
+            "SELECT explanation, created_at FROM explanation_cache WHERE cache_key = ? AND created_at > ?",
+            (key, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+        try:
+            with conn:
+                conn.execute("UPDATE explanation_cache SET last_used_at = ? WHERE cache_key = ?", (now, key))
+        except sqlite3.OperationalError:
+            pass  # Database busy; the hit is still good, only its recency is not recorded
+        with self.lock:
+            self._remember(key, row)
+        return row[0]
+
+    @tracing.traced('sql.explanation_cache_put')
+    def put(self, key, question_id, model, explanation):
+        now = time.time()
+        try:
+            with data_access.transaction(self.db_name) as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO explanation_cache
+                        (cache_key, question_id, model, explanation, created_at, last_used_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (key, question_id, model, explanation, now, now))
+        except sqlite3.OperationalError:
+            pass  # Database busy; keep the explanation in memory for this run
+        with self.lock:
+            self._remember(key, (explanation, now))
+            self.puts += 1
+            trim = self.puts % 100 == 0
+        if trim:
+            self.evict()
+
+    def _remember(self, key, entry):
+        # Callers hold self.lock
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries.
+
+        Returns False, leaving the table as it was, if the database stayed locked by another writer.
+        """
+        try:
+            with data_access.transaction(self.db_name) as conn:
+                conn.execute("DELETE FROM explanation_cache WHERE created_at <= ?", (time.time() - self.ttl,))
+                conn.execute('''
+                    DELETE FROM explanation_cache WHERE cache_key IN (
+                        SELECT cache_key FROM explanation_cache
+                        ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_entries,))
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def close(self):
+        self.memory.clear()
+
+class ExplanationFetcher:
+    """Fetch explanations over a pooled HTTP session with a bounded number of concurrent requests.
+
+    get_explanation() blocks; submit() runs the request on a worker thread and hands the
+    result to a callback on that thread.  Tk callers should pass queue.Queue.put-style
+    callbacks and drain the queue from the main loop with after(), since Tk widgets must
+    only be touched from the main thread.  With an ExplanationCache, cached explanations
+    are returned without a request and successful answers are stored.
+
+    requests is imported and the HTTP session opened on the first request, and without
+    an api_key the key is read from the environment and .env at that point, so creating
+    a fetcher at startup costs nothing.
+    """
+
+    def __init__(self, api_key=None, url=OPENAI_API_URL, model=MODEL, max_workers=MAX_CONCURRENT_REQUESTS, timeout=60,
+                 cache=None):
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.cache = cache
+        self.max_workers = max_workers
+
+        self.session = None
+        self.session_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="explanation")
+
+    def open_session(self):
+        """Return the pooled HTTP session, creating it on first use."""
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                
+                if self.api_key is None:
+                    self.api_key = load_api_key()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.session = session
+            return self.session
+
+    def get_explanation(self, question, correct_answer, question_id=None):
+        """Get an explanation from the cache, or from the OpenAI API on a miss."""
+        if self.cache is None:
+            return self.request_explanation(question, correct_answer)
+        
+        key = cache_key(question, correct_answer, self.model)
+        explanation = self.cache.get(key)
+        tracing.count('explanations.cache_hits' if explanation is not None else 'explanations.cache_misses')
+        if explanation is None:
+            explanation = self.request_explanation(question, correct_answer)
+            if explanation != ERROR_MESSAGE:
+                self.cache.put(key, question_id, self.model, explanation)
+        return explanation
+
+    @tracing.traced('http.explanation')
+    def request_explanation(self, question, correct_answer):
+        """Get explanation from OpenAI API using direct API call."""
+        import requests
+        
+        session = self.open_session()
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "user", "content": build_prompt(question, correct_answer)}
+            ]
+        }
+
+        try:
+            response = session.post(self.url, headers=headers, json=data, timeout=self.timeout)
+            if response.status_code != 200:
+                return ERROR_MESSAGE
+            # A 200 reply can still carry an error object or an unexpected shape
+            return response.json()['choices'][0]['message']['content']
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError):
+            return ERROR_MESSAGE
+
+    def submit(self, key, question, correct_answer, callback, question_id=None):
+        """Fetch an explanation in the background and call callback(key, explanation) when done.
+
+        The callback always runs, with ERROR_MESSAGE if anything fails, so a caller waiting
+        for every key is never left hanging.
+        """
+        def run():
+            try:
+                explanation = self.get_explanation(question, correct_answer, question_id)
+            except Exception:
+                explanation = ERROR_MESSAGE
+            callback(key, explanation)
+        return self.executor.submit(run)
+
+    def fetch_all(self, items):
+        """Fetch explanations for (question, correct_answer[, question_id]) tuples concurrently, in order."""
+        futures = [self.executor.submit(self.get_explanation, *item) for item in items]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.session is not None:
+            self.session.close()
+
+def prewarm(db_name, subject, api_key, max_workers=MAX_CONCURRENT_REQUESTS):
+    """Fill the explanation cache for every question of a subject. Returns (cached, failed) counts."""
+    cache = ExplanationCache(db_name)
+    cache.evict()
+    fetcher = ExplanationFetcher(api_key, max_workers=max_workers, cache=cache)
+    questions = load_questions(db_name, subject)
+    results = fetcher.fetch_all((q[2], correct_option_text(q), q[0]) for q in questions)
+    fetcher.close()
+    cache.close()
+    
+    failed = results.count(ERROR_MESSAGE)
+    return len(results) - failed, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the explanation cache.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    prewarm_parser = subparsers.add_parser('prewarm', help="Fetch and cache explanations for a whole subject")
+    prewarm_parser.add_argument('subject')
+    prewarm_parser.add_argument('--workers', type=int, default=MAX_CONCURRENT_REQUESTS, help="Concurrent requests")
+    args = parser.parse_args()
+    
+    db_name = 'questions.db'  # Database name
+    cached, failed = prewarm(db_name, args.subject, load_api_key(), args.workers)
+    print(f"Cached explanations for {cached} questions in '{args.subject}' ({failed} failed).")
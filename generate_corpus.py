@@ -0,0 +1,239 @@
+import argparse
+import itertools
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+# Synthetic question banks and notes in the layout of the files under contents/:
+# "Q<n>. ...?", "A." - "D." options, "Answer: X", "Referenced from ..." and a blank line.
+# Everything is generated and written as a stream, so a million-question bank never has
+# to be held in memory.
+
+WORDS = (
+    "platform service cloud integration extension data model runtime event api "
+    "workflow security identity deployment tenant module cache latency storage "
+    "analytics process automation gateway connector principle design pattern"
+).split()
+
+STEMS = (
+    "Which statement about {} is correct",
+    "What is the primary purpose of {}",
+    "Which of the following is NOT a feature of {}",
+    "How does {} affect the overall design",
+    "When should a team rely on {}",
+)
+
+def iter_questions(count, seed=0, explained=False, duplicates=0.0):
+    """Yield generated question dicts shaped like the output of parse_questions_from_docx.
+
+    With explained, each question gets a "Referenced from" line naming a notes section.
+    duplicates is the fraction of questions that repeat an earlier question word for word
+    (under their own number), as banks assembled from several sources do.
+    """
+    rng = random.Random(seed)
+    recent = []  # A window of earlier questions to draw duplicates from
+    for i in range(count):
+        if recent and rng.random() < duplicates:
+            q = dict(rng.choice(recent))
+            q['question'] = f"Q{i + 1}." + q['question'].split('.', 1)[1]
+        else:
+            topic = ' '.join(rng.choices(WORDS, k=rng.randint(3, 8)))
+            q = {
+                'question': f"Q{i + 1}. " + rng.choice(STEMS).format(topic),
+                'options': [f"{letter}. {' '.join(rng.choices(WORDS, k=rng.randint(4, 14))).capitalize()}."
+                            for letter in "ABCD"],
+                'answer': rng.choice("abcd"),
+                'explanation': (f"Referenced from {' '.join(rng.choices(WORDS, k=2)).title()} notes, "
+                                f"section {rng.randint(1, 40)}" if explained else ''),
+                'tags': [],
+            }
+            recent.append(q)
+            if len(recent) > 1000:
+                recent.pop(rng.randrange(len(recent)))
+        yield q
+
+def generate_questions(count, seed=0):
+    """Generate parsed question dicts shaped like the output of parse_questions_from_docx."""
+    rng = random.Random(seed)
+    questions = []
+    for i in range(count):
+        questions.append({
+            'question': f"Q{i + 1}. Which statement about {' '.join(rng.choices(WORDS, k=8))} is correct",
+            'options': [f"{letter}. {' '.join(rng.choices(WORDS, k=10))}." for letter in "ABCD"],
+            'answer': rng.choice("abcd"),
+            'explanation': '',
+            'tags': [],
+        })
+    return questions
+
+def iter_references(count, seed=0):
+    """Yield reference lines shaped like the output of parse_references_from_docx."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield f"{' '.join(rng.choices(WORDS, k=3)).title()}: {' '.join(rng.choices(WORDS, k=15))}."
+
+def generate_references(count, seed=0):
+    """Generate reference lines shaped like the output of parse_references_from_docx."""
+    return list(iter_references(count, seed))
+
+def question_lines(questions):
+    """Yield the text lines of questions in the layout the parsers read."""
+    for q in questions:
+        yield q['question'] + "?"
+        yield from q['options']
+        yield f"Answer: {q['answer'].upper()}"
+        if q['explanation']:
+            yield q['explanation']
+
+def question_paragraphs(questions):
+    """Yield the paragraphs of a question bank: a heading, then each question followed by a blank line."""
+    yield "1. Multiple-Choice Questions"
+    for q in questions:
+        yield from question_lines([q])
+        yield ""
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while chunk := tuple(itertools.islice(iterator, size)):
+        yield chunk
+
+# ----------------------------
+# DOCX
+# ----------------------------
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+PACKAGE_RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+DOCUMENT_END = '<w:sectPr/></w:body></w:document>'
+
+def write_docx(path, paragraphs):
+    """Write a minimal DOCX with one paragraph per text, streaming word/document.xml into the zip."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', PACKAGE_RELATIONSHIPS)
+        with archive.open('word/document.xml', 'w') as document:
+            document.write(DOCUMENT_START.encode())
+            for chunk in _batched(paragraphs, 1000):
+                document.write(''.join(
+                    f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>' if text else '<w:p/>'
+                    for text in chunk).encode())
+            document.write(DOCUMENT_END.encode())
+
+def write_questions_docx(path, questions):
+    """Write questions in the Q / A.-D. / Answer: layout that parse_questions_from_docx reads."""
+    write_docx(path, question_paragraphs(questions))
+
+def write_notes_docx(path, references):
+    """Write one reference per paragraph, as parse_references_from_docx reads it."""
+    write_docx(path, references)
+
+# ----------------------------
+# PDF
+# ----------------------------
+
+def pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def write_pdf(path, lines, lines_per_page=45):
+    """Write lines as a plain Helvetica text PDF that PdfReader.extract_text can read back.
+
+    Pages are written as they are filled; the page tree and cross-reference table follow
+    at the end, so the size of the document is limited only by the disk.
+    """
+    font_id, pages_id = 1, 2
+    offsets = {}
+    kids = []
+    with open(path, 'wb') as f:
+        def write_object(obj_id, body):
+            offsets[obj_id] = f.tell()
+            f.write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        write_object(font_id, b"<< /Type /Font /Subtype /Type1 /Name /F1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        next_id = 4
+        for page_lines in _batched(lines, lines_per_page):
+            page_id, content_id, next_id = next_id, next_id + 1, next_id + 2
+            kids.append(f"{page_id} 0 R")
+            body = "BT /F1 9 Tf 12 TL 36 806 Td " + " ".join(f"({pdf_escape(line)}) Tj T*" for line in page_lines) + " ET"
+            stream = body.encode('cp1252', 'replace')
+            write_object(content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            write_object(page_id, (f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] "
+                                   f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>").encode())
+        if not kids:  # An empty document still needs a page
+            kids.append(f"{next_id} 0 R")
+            write_object(next_id, f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] >>".encode())
+        write_object(pages_id, f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode())
+        write_object(3, f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+        xref = f.tell()
+        size = max(offsets) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for obj_id in range(1, size):
+            f.write(b"%010d 00000 n \n" % offsets[obj_id] if obj_id in offsets else b"0000000000 65535 f \n")
+        f.write(b"trailer\n<< /Size %d /Root 3 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref))
+
+# ----------------------------
+# contents/ trees
+# ----------------------------
+
+WRITERS = {
+    'docx': (write_questions_docx, write_notes_docx),
+    'pdf': (lambda path, questions: write_pdf(path, question_lines(questions)), write_pdf),
+}
+
+def generate_contents(base_dir, subjects, files_per_subject, questions_per_file, formats=('docx',),
+                      references_per_subject=None, explained=False, duplicates=0.0, seed=0):
+    """Build a contents/ style tree of generated subject folders. Returns the question count.
+
+    Each subject gets files_per_subject question files per format and a notes file with
+    references_per_subject lines (questions_per_file by default).  Seeds are derived from
+    seed, so the same arguments always produce the same files.
+    """
+    references_per_subject = questions_per_file if references_per_subject is None else references_per_subject
+    for s in range(subjects):
+        subject_dir = os.path.join(base_dir, f"Subject{s + 1}")
+        os.makedirs(subject_dir)
+        for extension in formats:
+            write_questions, write_notes = WRITERS[extension]
+            for f in range(files_per_subject):
+                file_seed = seed + s * files_per_subject + f + 1
+                write_questions(os.path.join(subject_dir, f"questions{f + 1}.{extension}"),
+                                iter_questions(questions_per_file, file_seed, explained, duplicates))
+            write_notes(os.path.join(subject_dir, f"notes.{extension}"),
+                        iter_references(references_per_subject, seed + s * files_per_subject + 1))
+    return subjects * files_per_subject * questions_per_file * len(formats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic contents/ tree of question banks and notes.")
+    parser.add_argument('output', help="Folder to create, e.g. corpus/contents")
+    parser.add_argument('--questions', type=int, default=10000, help="Questions in the whole corpus, per format")
+    parser.add_argument('--subjects', type=int, default=10)
+    parser.add_argument('--files', type=int, default=1, help="Question files per subject")
+    parser.add_argument('--references', type=int, default=1000, help="Notes lines per subject")
+    parser.add_argument('--format', nargs='+', choices=sorted(WRITERS), default=['docx'])
+    parser.add_argument('--duplicates', type=float, default=0.0, help="Fraction of questions repeating an earlier one")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    per_file = max(1, args.questions // (args.subjects * args.files))
+    total = generate_contents(args.output, args.subjects, args.files, per_file, args.format,
+                              args.references, explained=True, duplicates=args.duplicates, seed=args.seed)
+    print(f"Wrote {total:,} questions in {args.subjects} subjects to {args.output}")
@@ -0,0 +1,295 @@
+import argparse
+import os
+import random
+import time
+import uuid
+import data_access
+import database
+import tracing
+
+# SM-2 parameters
+INITIAL_EASE = 2.5
+MINIMUM_EASE = 1.3
+CORRECT_QUALITY = 4  # SM-2 grades answers 0-5; a right answer counts as "correct after hesitation"
+WRONG_QUALITY = 1
+
+# Questions whose ease has dropped below this count as weak and are practised before new ones
+WEAK_EASE = 2.0
+
+DAY = 24 * 3600
+
+# Name of the pickled sets of seen question texts written by earlier versions
+HISTORY_PICKLE = 'question_history.pkl'
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+def sm2(repetitions, interval_days, ease, quality):
+    """One SM-2 review step. Returns the new (repetitions, interval_days, ease, lapsed)."""
+    if quality >= 3:
+        if repetitions == 0:
+            interval_days = 1
+        elif repetitions == 1:
+            interval_days = 6
+        else:
+            interval_days = round(interval_days * ease)
+        repetitions += 1
+        lapsed = False
+    else:
+        repetitions = 0
+        interval_days = 1
+        lapsed = True
+    ease = max(MINIMUM_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return repetitions, interval_days, ease, lapsed
+
+@tracing.traced('sql.record_session')
+def record_session(db_name, session_id, results, now=None):
+    """Store the answers of a finished test and reschedule its questions, in one transaction.
+
+    results holds (question_id, answer, correct) tuples; correct is True, False, or
+    None for an attempt of unknown outcome, which is stored but does not change the
+    schedule.  Questions are tracked by subject and content hash, so their history
+    survives the question being re-ingested under a new id.
+    """
+    now = time.time() if now is None else now
+    with data_access.transaction(db_name) as conn:
+        for question_id, answer, correct in results:
+            row = conn.execute("SELECT subject_id, content_hash FROM question_signatures WHERE question_id = ?",
+                               (question_id,)).fetchone()
+            if row is None:
+                continue  # Deleted since the test started
+            subject_id, content_hash = row
+            record_attempt(conn, session_id, question_id, subject_id, content_hash, answer, correct, now)
+
+@tracing.traced('sql.record_session_by_hash')
+def record_session_by_hash(db_name, session_id, subject, results, now=None):
+    """Like record_session for questions that are known by content hash rather than by id here.
+
+    Questions from a question pack carry the ids of the database the pack was exported
+    from; results holds (content_hash, answer, correct) tuples instead.  The subject is
+    added to this database if needed, and attempts point at the local copy of a question
+    when there is one.
+    """
+    now = time.time() if now is None else now
+    with data_access.transaction(db_name) as conn:
+        conn.execute("INSERT OR IGNORE INTO subjects (name) VALUES (?)", (subject,))
+        subject_id = conn.execute("SELECT id FROM subjects WHERE name = ?", (subject,)).fetchone()[0]
+        local_ids = local_question_ids(conn, subject_id, [content_hash for content_hash, _, _ in results])
+        for content_hash, answer, correct in results:
+            record_attempt(conn, session_id, local_ids.get(content_hash), subject_id, content_hash, answer, correct, now)
+
+def record_attempt(conn, session_id, question_id, subject_id, content_hash, answer, correct, now):
+    """Store one answer and, if its outcome is known, apply it to the question's schedule."""
+    conn.execute('''
+        INSERT INTO attempts (session_id, question_id, subject_id, content_hash, answer, correct, answered_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (session_id, question_id, subject_id, content_hash, answer, correct, now))
+    if correct is not None:
+        review(conn, subject_id, content_hash, CORRECT_QUALITY if correct else WRONG_QUALITY, now)
+
+def local_question_ids(conn, subject_id, content_hashes):
+    """Return {content hash: id of the first stored question with it} for the hashes stored in a subject."""
+    found = {}
+    content_hashes = list(content_hashes)
+    for start in range(0, len(content_hashes), 500):
+        chunk = content_hashes[start:start + 500]
+        found.update(conn.execute(f'''
+            SELECT content_hash, min(question_id) FROM question_signatures
+            WHERE subject_id = ? AND content_hash IN ({', '.join('?' * len(chunk))}) GROUP BY content_hash
+        ''', [subject_id] + chunk))
+    return found
+
+def review(conn, subject_id, content_hash, quality, now):
+    """Apply one graded answer to a question's schedule."""
+    row = conn.execute('''
+        SELECT repetitions, interval_days, ease FROM review_schedule WHERE subject_id = ? AND content_hash = ?
+    ''', (subject_id, content_hash)).fetchone()
+    repetitions, interval_days, ease = row or (0, 0, INITIAL_EASE)
+    repetitions, interval_days, ease, lapsed = sm2(repetitions, interval_days, ease, quality)
+    conn.execute('''
+        INSERT INTO review_schedule (subject_id, content_hash, repetitions, interval_days, ease, due_at, lapses, reviewed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (subject_id, content_hash) DO UPDATE SET
+            repetitions = excluded.repetitions, interval_days = excluded.interval_days, ease = excluded.ease,
+            due_at = excluded.due_at, lapses = lapses + excluded.lapses, reviewed_at = excluded.reviewed_at
+    ''', (subject_id, content_hash, repetitions, interval_days, ease, now + interval_days * DAY, int(lapsed), now))
+
+def _question_ids(conn, sql, params, limit, chosen):
+    """Map scheduled content hashes from sql to stored question ids, skipping hashes already chosen.
+
+    Schedule rows whose question is no longer stored drop out of the join, and of several
+    stored copies of one question only the first is used.
+    """
+    found = []
+    for question_id, content_hash in conn.execute(f'''
+        SELECT g.question_id, g.content_hash FROM review_schedule r
+        JOIN question_signatures g ON g.subject_id = r.subject_id AND g.content_hash = r.content_hash
+        {sql}
+    ''', params):
+        if content_hash not in chosen:
+            found.append(question_id)
+            chosen.add(content_hash)
+            if len(found) == limit:
+                break
+    return found
+
+@tracing.traced('sql.select_practice_ids')
+def select_practice_ids(db_name, subject, count, question_ids, rng=None, now=None):
+    """Choose count question ids for a Practice test of a subject.
+
+    Due questions come first, most overdue first; then weak ones (lowest ease); then
+    random questions never answered before; then the ones due soonest.  question_ids
+    is the subject's full id list, used only to draw the new questions.  Each step
+    reads the review_schedule index in order, so the cost depends on count, not on
+    the size of the bank.  Duplicate copies of a question are picked at most once.
+    """
+    now = time.time() if now is None else now
+    rng = rng or random
+    conn = data_access.get_connection(db_name)
+    row = conn.execute("SELECT id FROM subjects WHERE name = ?", (subject,)).fetchone()
+    if row is None:
+        return []
+    subject_id = row[0]
+
+    chosen = set()  # Content hashes already in the test
+    # Copies share a content hash, so extra rows are read in case some repeat a chosen one
+    selected = _question_ids(conn, "WHERE r.subject_id = ? AND r.due_at <= ? ORDER BY r.due_at LIMIT ?",
+                             (subject_id, now, count * 4), count, chosen)
+    if len(selected) < count:
+        selected += _question_ids(conn, "WHERE r.subject_id = ? AND r.ease < ? ORDER BY r.ease LIMIT ?",
+                                  (subject_id, WEAK_EASE, count * 4), count - len(selected), chosen)
+    if len(selected) < count:
+        # Rejection-sample unseen questions from a small random draw
+        candidates = rng.sample(question_ids, min(len(question_ids), (count - len(selected)) * 4))
+        unseen = {question_id: content_hash for question_id, content_hash in conn.execute(f'''
+            SELECT g.question_id, g.content_hash FROM question_signatures g
+            LEFT JOIN review_schedule r ON r.subject_id = g.subject_id AND r.content_hash = g.content_hash
+            WHERE g.question_id IN ({', '.join('?' * len(candidates))}) AND r.content_hash IS NULL
+        ''', candidates)} if candidates else {}
+        for question_id in candidates:
+            if len(selected) == count:
+                break
+            content_hash = unseen.get(question_id)
+            if content_hash is not None and content_hash not in chosen:
+                selected.append(question_id)
+                chosen.add(content_hash)
+    if len(selected) < count:
+        selected += _question_ids(conn, "WHERE r.subject_id = ? ORDER BY r.due_at LIMIT ?",
+                                  (subject_id, count * 4), count - len(selected), chosen)
+    return selected
+
+@tracing.traced('sql.select_practice_hashes')
+def select_practice_hashes(db_name, subject, count, content_hashes, now=None):
+    """Choose up to count of content_hashes for a Practice test from the review schedule.
+
+    The pack counterpart of select_practice_ids: due questions first, most overdue first,
+    then weak ones (lowest ease).  The caller tops the test up with new questions.
+    Schedule rows are read in index order and those not in content_hashes are skipped.
+    """
+    now = time.time() if now is None else now
+    conn = data_access.get_connection(db_name)
+    row = conn.execute("SELECT id FROM subjects WHERE name = ?", (subject,)).fetchone()
+    if row is None:
+        return []
+    subject_id = row[0]
+
+    selected = []
+    chosen = set()
+    for sql, params in (("WHERE subject_id = ? AND due_at <= ? ORDER BY due_at", (subject_id, now)),
+                        ("WHERE subject_id = ? AND ease < ? ORDER BY ease", (subject_id, WEAK_EASE))):
+        for (content_hash,) in conn.execute(f"SELECT content_hash FROM review_schedule {sql}", params):
+            if len(selected) == count:
+                return selected
+            if content_hash in content_hashes and content_hash not in chosen:
+                selected.append(content_hash)
+                chosen.add(content_hash)
+    return selected
+
+def find_history_pickles(base_dir='.'):
+    """Yield (path, subject or None) for the question history pickles of earlier versions."""
+    root_pickle = os.path.join(base_dir, HISTORY_PICKLE)
+    if os.path.exists(root_pickle):
+        yield root_pickle, None
+    contents = os.path.join(base_dir, 'contents')
+    for root, files in database.walk_sources(contents):
+        if HISTORY_PICKLE in files:
+            yield os.path.join(root, HISTORY_PICKLE), os.path.basename(root)
+
+@tracing.traced('sql.import_history_pickles')
+def import_history_pickles(db_name, base_dir='.'):
+    """Import the seen-question sets pickled by earlier versions, once per file version.
+
+    The pickles only record which question texts were shown, so each match becomes an
+    attempt of unknown outcome and, if the question has no schedule yet, a review
+    that is due now.  Imported files go into the ingestion manifest under the kind
+    'history' and are skipped while unchanged.  Returns the number of attempts added.
+    """
+    conn = data_access.get_connection(db_name)
+    imported = 0
+    for path, subject in find_history_pickles(base_dir):
+        path = os.path.normpath(path)
+        content_hash = database.hash_file(path)
+        row = conn.execute("SELECT content_hash FROM ingested_files WHERE path = ? AND kind = 'history'",
+                           (path,)).fetchone()
+        if row and row[0] == content_hash:
+            continue
+
+        import pickle
+        with open(path, 'rb') as f:
+            seen = pickle.load(f)
+        subject_filter = "AND s.name = ?" if subject else ""
+        now = time.time()
+        session_id = f"import:{path}"
+        with conn:
+            for text in sorted(seen):
+                match = conn.execute(f'''
+                    SELECT g.question_id, g.subject_id, g.content_hash FROM questions q
+                    JOIN subjects s ON s.id = q.subject_id
+                    JOIN question_signatures g ON g.question_id = q.id
+                    WHERE q.question = ? {subject_filter}
+                    ORDER BY q.id LIMIT 1
+                ''', (text, subject) if subject else (text,)).fetchone()
+                if match is None:
+                    continue
+                question_id, subject_id, question_hash = match
+                conn.execute('''
+                    INSERT INTO attempts (session_id, question_id, subject_id, content_hash, answer, correct, answered_at)
+                    VALUES (?, ?, ?, ?, NULL, NULL, ?)
+                ''', (session_id, question_id, subject_id, question_hash, now))
+                conn.execute('''
+                    INSERT OR IGNORE INTO review_schedule (subject_id, content_hash, due_at) VALUES (?, ?, ?)
+                ''', (subject_id, question_hash, now))
+                imported += 1
+            stat = os.stat(path)
+            conn.execute('''
+                INSERT OR REPLACE INTO ingested_files (path, kind, subject, mtime_ns, size, content_hash)
+                VALUES (?, 'history', ?, ?, ?, ?)
+            ''', (path, subject or '', stat.st_mtime_ns, stat.st_size, content_hash))
+    return imported
+
+@tracing.traced('sql.due_counts')
+def due_counts(db_name, now=None):
+    """Return {subject: (due now, scheduled)} for subjects with a schedule."""
+    now = time.time() if now is None else now
+    conn = data_access.get_connection(db_name)
+    rows = conn.execute('''
+        SELECT s.name, sum(r.due_at <= ?), count(*) FROM review_schedule r
+        JOIN subjects s ON s.id = r.subject_id
+        GROUP BY s.name ORDER BY s.name
+    ''', (now,))
+    return {name: (due, total) for name, due, total in rows}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Attempt history and review schedule.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('import', help="Import question_history.pkl files from earlier versions")
+    subparsers.add_parser('due', help="Show how many questions are due per subject")
+    args = parser.parse_args()
+
+    db_name = 'questions.db'  # Database name
+    database.create_database(db_name)
+    if args.command == 'import':
+        print(f"Imported {import_history_pickles(db_name)} attempts.")
+    else:
+        for subject, (due, total) in due_counts(db_name).items():
+            print(f"{subject}: {due} due of {total} scheduled")
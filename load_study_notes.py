@@ -1,40 +1,111 @@
+import argparse
 import os
+import sys
+import data_access
 import database
+import dedup
+import tracing
 
-def insert_questions_and_references_from_subfolders(base_dir, db_name):
-    # Create the database and tables
-    database.create_database(db_name)
-
-    # Walk through all subdirectories in the base directory
-    for root, dirs, files in os.walk(base_dir):
+def find_sources(base_dir):
+    """Return the (path, kind, subject) sources of a contents/ tree: every DOCX/PDF and its notes file."""
+    sources = []
+    for root, files in database.walk_sources(base_dir):
         subject = os.path.basename(root)  # Get the name of the current folder as the subject
         
         for file in files:
             file_path = os.path.join(root, file)
             
-            # Check the file extension and parse accordingly
-            if file.endswith('.docx'):
-                print(f"Inserting questions from {file_path} for subject '{subject}'")
-                database.parse_and_insert_questions(db_name, subject, file_path)
-                
-                # Load references from notes.docx
-                notes_path = os.path.join(root, 'notes.docx')  # Assuming notes file is named 'notes.docx'
-                if os.path.exists(notes_path):
-                    print(f"Loading references from {notes_path} for subject '{subject}'")
-                    database.load_references_from_notes(db_name, subject, notes_path)
+            # Check the file extension and queue the questions and matching notes file
+            for extension in ('.docx', '.pdf'):
+                if file.endswith(extension):
+                    sources.append((file_path, 'questions', subject))
                     
-            elif file.endswith('.pdf'):
-                print(f"Inserting questions from {file_path} for subject '{subject}'")
-                database.parse_and_insert_questions(db_name, subject, file_path)
-                
-                # Load references from notes.pdf
-                notes_path = os.path.join(root, 'notes.pdf')  # Assuming notes file is named 'notes.pdf'
-                if os.path.exists(notes_path):
-                    print(f"Loading references from {notes_path} for subject '{subject}'")
-                    database.load_references_from_notes(db_name, subject, notes_path)
+                    # Load references from notes.docx / notes.pdf
+                    notes_path = os.path.join(root, 'notes' + extension)  # Assuming notes file is named 'notes.<ext>'
+                    if os.path.exists(notes_path) and (notes_path, 'references', subject) not in sources:
+                        sources.append((notes_path, 'references', subject))
+    return sources
+
+def insert_questions_and_references_from_subfolders(base_dir, db_name, workers=None, duplicates=dedup.DEFAULT_POLICY):
+    # Create the database and tables
+    database.create_database(db_name)
+
+    # Walk through all subdirectories in the base directory
+    sources = find_sources(base_dir)
+    
+    # Parse and insert only what changed since the last run
+    with database.QuestionStore(db_name, duplicates) as store:
+        database.sync_sources(store, base_dir, sources, kinds=('questions', 'references'), workers=workers)
+        database.report_duplicates(store)
+
+def remove_database_files(db_name):
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(db_name + suffix):
+            os.remove(db_name + suffix)
+
+def rebuild_from_subfolders(base_dir, db_name, subjects=None, workers=None, duplicates=dedup.DEFAULT_POLICY):
+    """Re-ingest subjects from scratch without exposing a half-loaded bank.
+
+    The subjects' files are ingested into a side database next to db_name, which is then
+    swapped in with database.swap_in_subjects in one transaction, and the freed pages are
+    reclaimed.  Until the swap, study.py and view_database.py keep seeing the old bank.
+    Without subjects, every subject in the tree or in the database is rebuilt, and
+    subjects whose folder is gone are purged.  Names are matched case-insensitively, and
+    one that is neither a content folder nor a stored subject raises ValueError before
+    anything is written.  Returns the rebuilt subject names.
+    """
+    database.create_database(db_name)
+    sources = find_sources(base_dir)
+    stored = [row[0] for row in data_access.get_connection(db_name).execute("SELECT name FROM subjects")]
+    known = {name.lower(): name for name in stored}
+    known.update((source[2].lower(), source[2]) for source in sources)  # Folder spelling wins
+    if subjects:
+        unknown = [subject for subject in subjects if subject.lower() not in known]
+        if unknown:
+            raise ValueError(f"No content folder or stored subject named {', '.join(unknown)}")
+        subjects = sorted({known[subject.lower()] for subject in subjects}, key=str.lower)
+        wanted = {subject.lower() for subject in subjects}
+        sources = [source for source in sources if source[2].lower() in wanted]
+    else:
+        subjects = sorted(known.values(), key=str.lower)
+
+    shadow_name = db_name + '.rebuild'
+    remove_database_files(shadow_name)  # Left over from an interrupted rebuild
+    try:
+        database.create_database(shadow_name)
+        with database.QuestionStore(shadow_name, duplicates) as store:
+            database.sync_sources(store, base_dir, sources, kinds=('questions', 'references'), workers=workers)
+            database.report_duplicates(store)
+        data_access.close_connection(shadow_name)  # Checkpoints the side database's WAL into its file
+        
+        with tracing.span('ingest.swap'):
+            database.swap_in_subjects(db_name, shadow_name, subjects)
+    finally:
+        data_access.close_connection(shadow_name)
+        remove_database_files(shadow_name)
+    database.reclaim_space(db_name)
+    return subjects
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load questions and study notes from the contents/ tree into the database.")
+    parser.add_argument('--workers', type=int,
+                        help="Number of processes used to parse documents (default: one per CPU, at most one per changed file)")
+    parser.add_argument('--duplicates', choices=dedup.POLICIES, default=dedup.DEFAULT_POLICY,
+                        help="What to do with questions that duplicate stored ones")
+    parser.add_argument('--rebuild', nargs='*', metavar='SUBJECT',
+                        help="Re-ingest the given subjects (default: all) from scratch and swap them in atomically")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.enable_from_arguments(args)
+    
     base_directory = 'contents'  # Base directory containing subfolders
     db_name = 'questions.db'  # Database name
-    insert_questions_and_references_from_subfolders(base_directory, db_name)
-    print("All questions and references have been successfully inserted into the database.")
\ No newline at end of file
+    if args.rebuild is not None:
+        try:
+            rebuilt = rebuild_from_subfolders(base_directory, db_name, args.rebuild, args.workers, args.duplicates)
+        except ValueError as error:
+            sys.exit(f"Cannot rebuild: {error}")
+        print(f"Rebuilt {len(rebuilt)} subjects: {', '.join(rebuilt)}")
+    else:
+        insert_questions_and_references_from_subfolders(base_directory, db_name, args.workers, args.duplicates)
+        print("All questions and references have been successfully inserted into the database.")
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+# Each simulated student lists the subjects, draws a test, submits answers and reads the results
+SCENARIO = ('subjects', 'test', 'answers', 'results')
+
+class Client:
+    """A minimal keep-alive HTTP/1.1 JSON client for one connection."""
+
+    def __init__(self, reader, writer, host):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, host)
+
+    async def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        self.writer.close()
+
+async def student(host, port, subject, test_type, rounds, latencies, errors, rng):
+    """Run the scenario rounds times on one connection, recording each request's latency."""
+    client = await Client.connect(host, port)
+    try:
+        for _ in range(rounds):
+            session_id = None
+            for step in SCENARIO:
+                start = time.perf_counter()
+                if step == 'subjects':
+                    status, payload = await client.request('GET', '/subjects')
+                elif step == 'test':
+                    status, payload = await client.request('POST', '/tests', {'subject': subject, 'type': test_type})
+                    questions = payload.get('questions', [])
+                    session_id = payload.get('session_id')
+                elif step == 'answers':
+                    answers = {str(q['id']): rng.choice(q['options']).split('.')[0] for q in questions if q['options']}
+                    status, payload = await client.request('POST', f'/tests/{session_id}/answers', {'answers': answers})
+                else:
+                    status, payload = await client.request('GET', f'/tests/{session_id}/results')
+                latencies[step].append(time.perf_counter() - start)
+                if status >= 400:
+                    errors.append(f"{step}: {status} {payload.get('error')}")
+                    break
+    finally:
+        client.close()
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+async def run(host, port, subject, test_type, students, rounds, seed=0):
+    latencies = {step: [] for step in SCENARIO}
+    errors = []
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    await asyncio.gather(*(student(host, port, subject, test_type, rounds, latencies, errors,
+                                   random.Random(rng.random())) for _ in range(students)))
+    elapsed = time.perf_counter() - start
+
+    every = [latency for values in latencies.values() for latency in values]
+    print(f"{students} students x {rounds} rounds of {test_type} tests on '{subject}': "
+          f"{len(every)} requests in {elapsed:.2f}s = {len(every) / elapsed:,.0f} requests/sec")
+    for step, values in list(latencies.items()) + [('all', every)]:
+        print(f"  {step:<9} p50 {percentile(values, 0.5) * 1000:8.2f} ms   p99 {percentile(values, 0.99) * 1000:8.2f} ms")
+    if errors:
+        print(f"{len(errors)} failed requests, e.g. {errors[0]}")
+
+def start_server(db_name, host, port, workers):
+    """Start quiz_server.py in a subprocess and wait until it accepts connections."""
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quiz_server.py'),
+                               '--db', db_name, '--host', host, '--port', str(port), '--workers', str(workers)],
+                              stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                raise RuntimeError("quiz_server.py did not start")
+            time.sleep(0.1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the practice test service.")
+    parser.add_argument('subject')
+    parser.add_argument('--type', default='Preview', help="Test type each student draws")
+    parser.add_argument('--students', type=int, default=50, help="Concurrent connections")
+    parser.add_argument('--rounds', type=int, default=20, help="Scenarios per student")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--start', metavar='DB', help="Start a server on this database first and stop it afterwards")
+    parser.add_argument('--workers', type=int, default=4, help="Read pool threads of the started server")
+    args = parser.parse_args()
+
+    server = start_server(args.start, args.host, args.port, args.workers) if args.start else None
+    try:
+        asyncio.run(run(args.host, args.port, args.subject, args.type, args.students, args.rounds))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
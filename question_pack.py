@@ -0,0 +1,290 @@
+import argparse
+import bisect
+import mmap
+import os
+import random
+import struct
+import data_access
+import database
+import dedup
+import history
+import reference_index
+from quiz_engine import TEST_TYPES, QuizSession, load_questions, load_references, load_subjects
+
+# A pack holds one subject's questions and references for shipping without the DOCX files.
+# Layout: header, question id table (int64), question records, option offsets, reference
+# offsets, then the string area.  Offsets are absolute file positions and every string is
+# a uint32 byte length followed by its UTF-8 bytes; identical strings are stored once.
+# Since version 2 each question record also holds the question's content hash (see
+# dedup.content_hash), which identifies it in any database: its id only means something
+# in the database the pack was exported from.
+MAGIC = b'QPAK'
+VERSION = 2
+PACK_EXTENSION = '.qpack'
+
+HEADER = struct.Struct('<4sHHIIIIQQ')  # magic, version, reserved, questions, options, references, reserved, subject, revision
+QUESTION = struct.Struct('<QQQQII20s')  # question, answer, explanation, tags string offsets; first option, option count; content hash
+QUESTION_V1 = struct.Struct('<QQQQII')
+OFFSET = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+
+def write_pack(path, subject, revision, questions, references):
+    """Write question tuples (as returned by quiz_engine.load_questions) and references to a pack.
+
+    The file is written next to path and renamed into place, so readers never see a partial pack.
+    """
+    option_count = sum(len(q[3]) for q in questions)
+    strings_start = (HEADER.size + 8 * len(questions) + QUESTION.size * len(questions)
+                     + OFFSET.size * (option_count + len(references)))
+    strings = bytearray()
+    offsets = {}
+
+    def add(text):
+        offset = offsets.get(text)
+        if offset is None:
+            data = (text or '').encode('utf-8')
+            offset = offsets[text] = strings_start + len(strings)
+            strings.extend(LENGTH.pack(len(data)))
+            strings.extend(data)
+        return offset
+
+    ids = bytearray()
+    records = bytearray()
+    options = bytearray()
+    option_index = 0
+    for q in questions:
+        ids.extend(struct.pack('<q', q[0]))
+        records.extend(QUESTION.pack(add(q[2]), add(q[4]), add(q[5]), add(q[6]), option_index, len(q[3]),
+                                     bytes.fromhex(dedup.content_hash(q[2], q[3]))))
+        for option in q[3]:
+            options.extend(OFFSET.pack(add(option)))
+        option_index += len(q[3])
+    reference_offsets = b''.join(OFFSET.pack(add(reference)) for reference in references)
+    header = HEADER.pack(MAGIC, VERSION, 0, len(questions), option_count, len(references), 0, add(subject), revision)
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        for part in (header, ids, records, options, reference_offsets, strings):
+            f.write(part)
+    os.replace(temporary, path)
+    return os.path.getsize(path)
+
+class QuestionPack:
+    """A memory-mapped question pack.
+
+    Opening a pack reads only its header; questions are decoded from the mapping when
+    they are accessed, so drawing 10 questions from a large pack reads 10 records.
+    Questions come back in the tuple form of quiz_engine.load_questions.  Version 1 packs,
+    which have no content hashes, are still read; their hashes are computed when needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mapping)
+        if len(self.mapping) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not a question pack")
+        magic, version, _, count, option_count, reference_count, _, subject_offset, self.revision = \
+            HEADER.unpack_from(self.mapping)
+        if magic != MAGIC or version not in (1, VERSION):
+            self.close()
+            raise ValueError(f"{path} is not a version 1 or {VERSION} question pack")
+        self.record = QUESTION if version == VERSION else QUESTION_V1
+        self.hash_positions = None  # {content hash: position}, built for the first Practice draw
+        self.index_of_references = None
+
+        self.ids_start = HEADER.size
+        self.records_start = self.ids_start + 8 * count
+        self.options_start = self.records_start + self.record.size * count
+        self.references_start = self.options_start + OFFSET.size * option_count
+        self.count = count
+        self.reference_count = reference_count
+        # Offset tables are read in place: ids are sorted, options are grouped by question
+        self.ids = self.view[self.ids_start:self.records_start].cast('q')
+        self.option_offsets = self.view[self.options_start:self.references_start].cast('Q')
+        self.reference_offsets = self.view[self.references_start:
+                                           self.references_start + OFFSET.size * reference_count].cast('Q')
+        self.subject = self.string(subject_offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        for name in ('ids', 'option_offsets', 'reference_offsets'):
+            table = getattr(self, name, None)
+            if table is not None:
+                table.release()
+                setattr(self, name, None)
+        self.view.release()
+        self.mapping.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+    def string(self, offset):
+        (length,) = LENGTH.unpack_from(self.mapping, offset)
+        return str(self.view[offset + LENGTH.size:offset + LENGTH.size + length], 'utf-8')
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        question, answer, explanation, tags, first_option, option_count = \
+            self.record.unpack_from(self.mapping, self.records_start + i * self.record.size)[:6]
+        options = [self.string(offset) for offset in self.option_offsets[first_option:first_option + option_count]]
+        return (self.ids[i], self.subject, self.string(question), options,
+                self.string(answer), self.string(explanation), self.string(tags))
+
+    def index(self, question_id):
+        """Return the position of a question id in the pack, or None."""
+        i = bisect.bisect_left(self.ids, question_id)
+        return i if i < self.count and self.ids[i] == question_id else None
+
+    def content_hash(self, i):
+        """Return the content hash of the question at position i."""
+        if self.record is QUESTION:
+            return self.record.unpack_from(self.mapping, self.records_start + i * self.record.size)[6].hex()
+        q = self[i]
+        return dedup.content_hash(q[2], q[3])
+
+    def references(self):
+        return [self.string(offset) for offset in self.reference_offsets]
+
+    def reference_index(self):
+        """The pack's references as a ReferenceIndex, for the results screen; built once."""
+        if self.index_of_references is None:
+            self.index_of_references = reference_index.memory_index(self.references())
+        return self.index_of_references
+
+    def session(self, questions):
+        """Start a PackSession of questions drawn from this pack."""
+        return PackSession(self, questions)
+
+    def draw(self, test_type, rng=None, db_name=None):
+        """Draw a test like quiz_engine.draw_questions, decoding only the chosen questions.
+
+        Practice tests take due and weak questions from the review schedule in db_name,
+        matched by content hash, so any database's history works; the rest are drawn at random.
+        """
+        if test_type not in TEST_TYPES:
+            raise ValueError(f"Unknown test type {test_type!r}; expected one of {', '.join(TEST_TYPES)}")
+        count = TEST_TYPES[test_type]
+        if count is None:
+            return list(self)
+
+        rng = rng or random
+        chosen = []
+        if test_type == 'Practice' and db_name:
+            if self.hash_positions is None:
+                self.hash_positions = {}
+                for i in range(self.count):
+                    self.hash_positions.setdefault(self.content_hash(i), i)
+            scheduled = history.select_practice_hashes(db_name, self.subject, count, self.hash_positions)
+            chosen = [self.hash_positions[content_hash] for content_hash in scheduled]
+        if len(chosen) < count:
+            taken = set(chosen)
+            extra = [i for i in rng.sample(range(self.count), min(count, self.count)) if i not in taken]
+            chosen += extra[:count - len(chosen)]
+        return [self[i] for i in chosen]
+
+class PackSession(QuizSession):
+    """A QuizSession of pack questions.
+
+    Pack question ids belong to the database the pack was exported from, so answers are
+    recorded in this database by subject and content hash, and cached explanations are
+    tied to this database's copy of a question, if it has one.
+    """
+
+    def __init__(self, pack, questions, session_id=None):
+        super().__init__(questions, session_id)
+        self.pack = pack
+        self.content_hashes = [pack.content_hash(pack.index(q[0])) for q in questions]
+
+    def local_question_ids(self, db_name):
+        conn = data_access.get_connection(db_name)
+        row = conn.execute("SELECT id FROM subjects WHERE name = ?", (self.pack.subject,)).fetchone()
+        local_ids = history.local_question_ids(conn, row[0], self.content_hashes) if row else {}
+        return [local_ids.get(content_hash) for content_hash in self.content_hashes]
+
+    def record(self, db_name):
+        history.record_session_by_hash(db_name, self.session_id, self.pack.subject,
+                                       [(content_hash, r.answer, r.correct)
+                                        for content_hash, r in zip(self.content_hashes, self.results())])
+
+def pack_path(directory, subject):
+    return os.path.join(directory, subject + PACK_EXTENSION)
+
+def export_pack(db_name, subject, path):
+    """Build a pack of a subject's questions and references from the database. Returns the file size."""
+    conn = data_access.get_connection(db_name)
+    row = conn.execute("SELECT name, revision FROM subjects WHERE name = ?", (subject,)).fetchone()
+    if row is None:
+        raise ValueError(f"Unknown subject '{subject}'")
+    name, revision = row
+    return write_pack(path, name, revision, load_questions(db_name, name), load_references(db_name, name))
+
+def open_packs(paths):
+    """Open the packs at paths, which may be pack files or folders of them. Returns {subject: QuestionPack}."""
+    packs = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(PACK_EXTENSION)]
+        else:
+            files = [path]
+        for file in files:
+            pack = QuestionPack(file)
+            packs[pack.subject] = pack
+    return packs
+
+def import_pack(db_name, path, duplicates=dedup.DEFAULT_POLICY):
+    """Load a pack into the database. Returns (questions inserted, references inserted).
+
+    Questions go through the duplicates policy like any other source, so importing the
+    same pack twice does not repeat them; references already stored are skipped.
+    """
+    with QuestionPack(path) as pack:
+        questions = [{
+            'question': q[2],
+            'options': q[3],
+            'answer': q[4],
+            'explanation': q[5],
+            'tags': [q[6]] if q[6] else [],
+        } for q in pack]
+        stored = set(load_references(db_name, pack.subject))
+        references = [reference for reference in pack.references() if reference not in stored]
+        with database.QuestionStore(db_name, duplicates) as store:
+            inserted = store.insert_questions(pack.subject, questions, source_path=path)
+            store.insert_references(pack.subject, references, source_path=path)
+    return inserted, len(references)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and import compiled question packs.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="Write one pack per subject from the database")
+    export_parser.add_argument('subjects', nargs='*', help="Subjects to export (default: all)")
+    export_parser.add_argument('--output', default='packs', help="Folder for the pack files")
+    import_parser = subparsers.add_parser('import', help="Load packs into the database")
+    import_parser.add_argument('paths', nargs='+')
+    import_parser.add_argument('--duplicates', choices=dedup.POLICIES, default=dedup.DEFAULT_POLICY,
+                               help="What to do with questions that duplicate stored ones")
+    args = parser.parse_args()
+
+    db_name = 'questions.db'  # Database name
+    database.create_database(db_name)
+    if args.command == 'export':
+        os.makedirs(args.output, exist_ok=True)
+        for subject in args.subjects or load_subjects(db_name):
+            path = pack_path(args.output, subject)
+            size = export_pack(db_name, subject, path)
+            print(f"Wrote {path} ({size:,} bytes)")
+    else:
+        for path in args.paths:
+            inserted, references = import_pack(db_name, path, args.duplicates)
+            print(f"Imported {inserted} questions and {references} references from {path}")
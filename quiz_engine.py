@@ -0,0 +1,432 @@
+import argparse
+import csv
+import json
+import random
+import sys
+from collections import namedtuple
+import data_access
+import database
+import history
+import reference_index
+import tracing
+
+# Questions per test type; None means every question of the subject
+TEST_TYPES = {
+    'Preview': 10,  # Random questions
+    'Practice': 25,  # Due, weak or new questions (see history.py)
+    'Certified': None,  # All questions
+}
+
+# Letter codes used by the batch scorer for a missing answer and a question without an answer key
+NO_ANSWER = 0
+NO_KEY = 1
+
+# ----------------------------
+# Question Loading
+# ----------------------------
+
+@tracing.traced('sql.load_subjects')
+def load_subjects(db_name):
+    """Load all subjects that have questions."""
+    conn = data_access.get_connection(db_name)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT name FROM subjects s
+        WHERE EXISTS (SELECT 1 FROM questions q WHERE q.subject_id = s.id)
+        ORDER BY name
+    ''')
+    subjects = cursor.fetchall()
+
+    return [subject[0] for subject in subjects]  # Extracting the subject names
+
+@tracing.traced('sql.load_questions')
+def load_questions(db_name, subject):
+    """Load questions from the database for a specific subject.
+
+    Each question is a tuple (id, subject, question, options, answer, explanation, tags)
+    where options is the list of option lines, e.g. ['A. ...', 'B. ...'].
+    """
+    conn = data_access.get_connection(db_name)
+    cursor = conn.cursor()
+
+    # subjects.name is COLLATE NOCASE, so this is a case-insensitive indexed lookup
+    cursor.execute('''
+        SELECT q.id, q.subject, q.question, q.answer, q.explanation, q.tags
+        FROM questions q JOIN subjects s ON s.id = q.subject_id
+        WHERE s.name = ?
+        ORDER BY q.id
+    ''', (subject,))
+    rows = cursor.fetchall()
+
+    cursor.execute('''
+        SELECT o.question_id, o.letter, o.text
+        FROM options o
+        JOIN questions q ON q.id = o.question_id
+        JOIN subjects s ON s.id = q.subject_id
+        WHERE s.name = ?
+        ORDER BY o.question_id, o.position
+    ''', (subject,))
+    options = group_options(cursor.fetchall())
+
+    return [question_tuple(row, options) for row in rows]
+
+def group_options(rows):
+    """Group (question_id, letter, text) rows into {question_id: ['A. ...', ...]}."""
+    options = {}
+    for question_id, letter, text in rows:
+        options.setdefault(question_id, []).append(database.format_option(letter, text))
+    return options
+
+def question_tuple(row, options):
+    return (row[0], row[1], row[2], options.get(row[0], []), *row[3:])
+
+# SQLite caps the number of bound parameters, so IN (...) lists are sent in chunks
+MAX_IN_PARAMETERS = 500
+
+@tracing.traced('sql.load_questions_by_id')
+def load_questions_by_id(db_name, question_ids):
+    """Load specific questions, in the order of question_ids."""
+    conn = data_access.get_connection(db_name)
+    cursor = conn.cursor()
+
+    rows = {}
+    options = {}
+    for start in range(0, len(question_ids), MAX_IN_PARAMETERS):
+        chunk = question_ids[start:start + MAX_IN_PARAMETERS]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT id, subject, question, answer, explanation, tags
+            FROM questions WHERE id IN ({placeholders})
+        ''', chunk)
+        rows.update((row[0], row) for row in cursor.fetchall())
+        cursor.execute(f'''
+            SELECT question_id, letter, text FROM options
+            WHERE question_id IN ({placeholders})
+            ORDER BY question_id, position
+        ''', chunk)
+        options.update(group_options(cursor.fetchall()))
+
+    return [question_tuple(rows[question_id], options) for question_id in question_ids if question_id in rows]
+
+# (db_name, subject name) -> (subject revision, sorted question ids)
+question_id_cache = {}
+
+@tracing.traced('sql.load_question_ids')
+def load_question_ids(db_name, subject):
+    """Return the sorted question ids of a subject, cached until its questions change."""
+    conn = data_access.get_connection(db_name)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT id, revision FROM subjects WHERE name = ?", (subject,))
+    row = cursor.fetchone()
+    if row is None:
+        return []
+
+    key = (db_name, subject.lower())
+    cached = question_id_cache.get(key)
+    if cached is None or cached[0] != row[1]:
+        cursor.execute("SELECT id FROM questions WHERE subject_id = ? ORDER BY id", (row[0],))
+        cached = question_id_cache[key] = (row[1], [r[0] for r in cursor.fetchall()])
+
+    return cached[1]
+
+def sample_questions(db_name, subject, count, rng=None):
+    """Draw count random questions of a subject, fetching only the chosen rows.
+
+    Pass rng=random.Random(seed) for a reproducible draw.
+    """
+    question_ids = load_question_ids(db_name, subject)
+    chosen = (rng or random).sample(question_ids, min(count, len(question_ids)))
+    return load_questions_by_id(db_name, chosen)
+
+def practice_questions(db_name, subject, count, rng=None):
+    """Draw a Practice test: due and weak questions of a subject first, topped up with new ones."""
+    question_ids = load_question_ids(db_name, subject)
+    return load_questions_by_id(db_name, history.select_practice_ids(db_name, subject, count, question_ids, rng))
+
+@tracing.traced('sql.load_references')
+def load_references(db_name, subject):
+    """Load references for a specific subject."""
+    conn = data_access.get_connection(db_name)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT r.reference FROM study_references r
+        JOIN subjects s ON s.id = r.subject_id
+        WHERE s.name = ?
+        ORDER BY r.id
+    ''', (subject,))
+    references = cursor.fetchall()
+
+    return [ref[0] for ref in references]  # Extracting the reference text
+
+@tracing.traced('quiz.draw_questions')
+def draw_questions(db_name, subject, test_type, rng=None):
+    """Load only as many questions as the test type needs."""
+    if test_type not in TEST_TYPES:
+        raise ValueError(f"Unknown test type {test_type!r}; expected one of {', '.join(TEST_TYPES)}")
+    if test_type == 'Preview':
+        return sample_questions(db_name, subject, TEST_TYPES[test_type], rng)
+    if test_type == 'Practice':
+        return practice_questions(db_name, subject, TEST_TYPES[test_type], rng)
+    return load_questions(db_name, subject)
+
+# ----------------------------
+# Sessions and Scoring
+# ----------------------------
+
+def option_letter(option):
+    """Return the lower-case letter of an option line, e.g. 'b' for 'B. ...'."""
+    return option.split('.')[0].strip().lower()
+
+def correct_option_text(q):
+    """Return the full text of a question tuple's correct option, e.g. 'B. ...', or the bare answer."""
+    for option in q[3]:
+        if option_letter(option) == q[4].strip().lower():
+            return option
+    return q[4]
+
+def selected_option_text(q, letter):
+    """Return the option line a letter picks in a question tuple, or the letter itself."""
+    for option in q[3]:
+        if option_letter(option) == letter:
+            return option
+    return letter
+
+# One scored answer: the question tuple, the answer letter, the option lines it and the key pick
+QuestionResult = namedtuple('QuestionResult', 'question answer selected correct_option correct')
+
+class QuizSession:
+    """One test run independent of any user interface: its questions, answers and score.
+
+    Iterating yields the next unanswered question until every question has an answer,
+    so a front end loops over the session and calls answer() once per question.
+    """
+
+    def __init__(self, questions, session_id=None):
+        self.questions = questions
+        self.answers = []  # Lower-case answer letters, in question order
+        self.session_id = session_id or history.new_session_id()  # Groups the answers in the attempt history
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __iter__(self):
+        while not self.finished:
+            yield self.current
+
+    @property
+    def current(self):
+        """The question waiting for an answer, or None when the test is finished."""
+        return None if self.finished else self.questions[len(self.answers)]
+
+    @property
+    def finished(self):
+        return len(self.answers) >= len(self.questions)
+
+    def progress(self):
+        """Position of the current question for display, e.g. 'Question 3 of 10'."""
+        return f"Question {len(self.answers) + 1} of {len(self)}"
+
+    def answer(self, choice):
+        """Answer the current question with an option index or an option letter.
+
+        Raises ValueError if the choice is not one of the question's options.
+        """
+        q = self.current
+        if q is None:
+            raise ValueError("Every question has already been answered.")
+        letters = [option_letter(option) for option in q[3]]
+        if isinstance(choice, int):
+            if not 0 <= choice < len(letters):
+                raise ValueError(f"Option {choice} out of range for a question with {len(letters)} options.")
+            letter = letters[choice]
+        else:
+            letter = choice.strip().lower()
+            if not letter or (letters and letter not in letters):
+                raise ValueError(f"Choose one of {', '.join(letters).upper()}.")
+        self.answers.append(letter)
+        return letter
+
+    def results(self):
+        """Score the answers given so far, one QuestionResult per answered question."""
+        return [QuestionResult(q, letter, selected_option_text(q, letter), correct_option_text(q),
+                               letter == q[4].strip().lower())
+                for q, letter in zip(self.questions, self.answers)]
+
+    def score(self):
+        """Return (correct answers, answered questions)."""
+        correct = sum(letter == q[4].strip().lower() for q, letter in zip(self.questions, self.answers))
+        return correct, len(self.answers)
+
+    def local_question_ids(self, db_name):
+        """Ids in db_name of the questions, or None for those it does not hold; cached explanations are tied to them."""
+        return [q[0] for q in self.questions]
+
+    def record(self, db_name):
+        """Store the answers in the attempt history and reschedule the questions."""
+        history.record_session(db_name, self.session_id, [(r.question[0], r.answer, r.correct) for r in self.results()])
+
+def letter_codes(letters, missing):
+    """Encode answer letters as integers for vectorised comparison; empty ones become missing."""
+    import numpy as np  # Only batch scoring needs numpy; the interactive front ends do not load it
+    return np.fromiter((ord(letter[0]) if letter else missing for letter in letters), dtype=np.int64, count=len(letters))
+
+def answer_key(questions):
+    """Return the letter codes of the correct answers of a list of question tuples."""
+    return letter_codes([q[4].strip().lower() for q in questions], NO_KEY)
+
+def score_batch(key, answers):
+    """Score many sessions of the same questions at once.
+
+    answers is a (sessions, questions) array of letter codes in the order of key;
+    returns the number of correct answers of each session.
+    """
+    import numpy as np
+    return (np.asarray(answers) == key).sum(axis=1)
+
+@tracing.traced('sql.load_answer_key')
+def load_answer_key(db_name, question_ids):
+    """Return (sorted ids, letter codes) of the stored questions among question_ids."""
+    import numpy as np
+    conn = data_access.get_connection(db_name)
+    question_ids = sorted(set(question_ids))
+    rows = []
+    for start in range(0, len(question_ids), MAX_IN_PARAMETERS):
+        chunk = question_ids[start:start + MAX_IN_PARAMETERS]
+        rows += conn.execute(f"SELECT id, answer FROM questions WHERE id IN ({', '.join('?' * len(chunk))}) ORDER BY id",
+                             chunk).fetchall()
+    return (np.array([row[0] for row in rows], dtype=np.int64),
+            letter_codes([row[1].strip().lower() for row in rows], NO_KEY))
+
+@tracing.traced('quiz.score_answers')
+def score_answers(db_name, rows):
+    """Score (session, question_id, answer) rows of any number of sessions in one pass.
+
+    Returns (scores, unknown, correct): scores lists (session, correct, answered) in order
+    of first appearance, unknown counts the rows whose question is not in the database and
+    correct is a boolean array over the rows.
+    """
+    import numpy as np
+    sessions = {}
+    count = len(rows)
+    session_index = np.fromiter((sessions.setdefault(row[0], len(sessions)) for row in rows), dtype=np.int64, count=count)
+    question_ids = np.fromiter((int(row[1]) for row in rows), dtype=np.int64, count=count)
+    given = letter_codes([str(row[2]).strip().lower() for row in rows], NO_ANSWER)
+
+    known_ids, key = load_answer_key(db_name, question_ids.tolist())
+    positions = np.minimum(np.searchsorted(known_ids, question_ids), max(len(known_ids) - 1, 0))
+    known = known_ids[positions] == question_ids if len(known_ids) else np.zeros(count, dtype=bool)
+    correct = known & (key[positions] == given) if len(known_ids) else known
+
+    correct_counts = np.bincount(session_index, weights=correct, minlength=len(sessions))
+    answered_counts = np.bincount(session_index, weights=known, minlength=len(sessions))
+    scores = [(session, int(c), int(a)) for session, c, a in zip(sessions, correct_counts, answered_counts)]
+    return scores, count - int(known.sum()), correct
+
+def read_answer_file(path):
+    """Read (session, question_id, answer) rows from a CSV file with those columns or a JSON list of objects."""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            records = json.load(f)
+    else:
+        with open(path, newline='', encoding='utf-8') as f:
+            records = list(csv.DictReader(f))
+    try:
+        return [(str(r['session']), int(r['question_id']), r['answer'] or '') for r in records]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"every answer needs session, question_id and answer fields ({e})") from None
+
+def score_answer_file(db_name, path, record=False):
+    """Score an answer file and print one line per session. With record, add the answers to the history."""
+    rows = read_answer_file(path)
+    scores, unknown, correct = score_answers(db_name, rows)
+    for session, right, answered in scores:
+        percent = 100 * right / answered if answered else 0
+        print(f"{session}: {right}/{answered} ({percent:.0f}%)")
+    if unknown:
+        print(f"Skipped {unknown} answers to questions that are not in the database.")
+
+    if record:
+        by_session = {}
+        for (session, question_id, answer), is_correct in zip(rows, correct.tolist()):
+            by_session.setdefault(session, []).append((question_id, answer.strip().lower(), is_correct))
+        for session, attempts in by_session.items():
+            history.record_session(db_name, f"batch:{session}", attempts)
+    return scores
+
+# ----------------------------
+# Terminal Front End
+# ----------------------------
+
+def run_terminal(db_name, subject, test_type, rng=None, explain=False):
+    """Take a test on the terminal: ask each question, then show the results and record them."""
+    questions = draw_questions(db_name, subject, test_type, rng)
+    if not questions:
+        print(f"No questions found for '{subject}'.")
+        return None
+
+    session = QuizSession(questions)
+    for q in session:
+        print(f"\n{session.progress()}")
+        print(q[2])
+        for option in q[3]:
+            print(f"  {option}")
+        while True:
+            try:
+                session.answer(input("Your answer: "))
+                break
+            except ValueError as e:
+                print(e)
+
+    print("\nQuiz Results:")
+    results = session.results()
+    explanations = [None] * len(results)
+    if explain:
+        from explanations import ExplanationCache, ExplanationFetcher
+        fetcher = ExplanationFetcher(cache=ExplanationCache(db_name))
+        explanations = fetcher.fetch_all((r.question[2], r.correct_option, r.question[0]) for r in results)
+        fetcher.close()
+
+    matches = reference_index.top_references(db_name, questions)
+    for i, (r, explanation, references) in enumerate(zip(results, explanations, matches)):
+        print(f"\nQ{i + 1}. {r.question[2]}")
+        if r.correct:
+            print(f"Your Answer: {r.selected} (Correct)")
+        else:
+            print(f"Your Answer: {r.selected} (Wrong)")
+            print(f"Correct Answer: {r.correct_option}")
+        if explanation:
+            print(f"Explanation: {explanation}")
+        if references:
+            print("References:\n" + "\n".join(references))
+
+    correct, answered = session.score()
+    print(f"\nYour Score: {correct}/{answered}")
+    session.record(db_name)
+    return session
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Take or score practice tests without the GUI.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    take_parser = subparsers.add_parser('take', help="Take a test on the terminal")
+    take_parser.add_argument('subject')
+    take_parser.add_argument('--type', choices=TEST_TYPES, default='Preview', help="Test type")
+    take_parser.add_argument('--seed', type=int, help="Seed for reproducible question draws")
+    take_parser.add_argument('--explain', action='store_true', help="Fetch explanations for the results")
+    score_parser = subparsers.add_parser('score', help="Score a CSV or JSON file of session, question_id, answer rows")
+    score_parser.add_argument('path')
+    score_parser.add_argument('--record', action='store_true', help="Add the answers to the attempt history")
+    args = parser.parse_args()
+
+    db_name = 'questions.db'  # Database name
+    database.create_database(db_name)
+    if args.command == 'take':
+        history.import_history_pickles(db_name)  # One-time import of question_history.pkl files
+        run_terminal(db_name, args.subject, args.type, random.Random(args.seed), args.explain)
+    else:
+        try:
+            score_answer_file(db_name, args.path, args.record)
+        except (OSError, ValueError) as error:
+            sys.exit(f"Cannot score {args.path}: {error}")
@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+import data_access
+import database
+import history
+import quiz_engine
+import reference_index
+import tracing
+
+HOST = '127.0.0.1'
+PORT = 8000
+
+# Threads running database reads; each keeps its own connection through data_access
+READ_POOL_SIZE = 4
+
+# How long a cached subject is served before its revision is checked again
+CACHE_CHECK_INTERVAL = 1.0
+
+# Unfinished and finished tests are kept this long, and at most this many at once
+SESSION_TTL = 4 * 3600
+MAX_SESSIONS = 100000
+
+MAX_BODY_SIZE = 1 << 20
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class SubjectCache:
+    """Hot in-memory copies of the question sets of subjects.
+
+    An entry is served without touching the database for CACHE_CHECK_INTERVAL seconds,
+    then reloaded only if the subject's revision changed in the meantime.
+    """
+
+    def __init__(self, db_name, check_interval=CACHE_CHECK_INTERVAL):
+        self.db_name = db_name
+        self.check_interval = check_interval
+        self.entries = {}  # subject name in lower case -> SubjectEntry
+        self.lock = threading.Lock()
+
+    def get(self, subject):
+        """Return the cached entry if it was checked recently, else None. Safe on the event loop."""
+        entry = self.entries.get(subject.lower())
+        if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+            return entry
+        return None
+
+    def load(self, subject):
+        """Return a current entry, reloading the subject if it changed. Runs in a read pool thread."""
+        conn = data_access.get_connection(self.db_name)
+        row = conn.execute("SELECT name, revision FROM subjects WHERE name = ?", (subject,)).fetchone()
+        if row is None:
+            return None
+        name, revision = row
+        entry = self.entries.get(subject.lower())
+        if entry is None or entry.revision != revision:
+            entry = SubjectEntry(name, revision, quiz_engine.load_questions(self.db_name, name))
+        entry.checked_at = time.monotonic()
+        with self.lock:
+            self.entries[subject.lower()] = entry
+        return entry
+
+class SubjectEntry:
+    """A subject's questions with the lookups the service needs, built once per revision."""
+
+    def __init__(self, name, revision, questions):
+        self.name = name
+        self.revision = revision
+        self.questions = questions
+        self.question_ids = [q[0] for q in questions]
+        self.by_id = {q[0]: q for q in questions}
+        # What students see: no answer key or explanation
+        self.public = {q[0]: {'id': q[0], 'question': q[2], 'options': q[3]} for q in questions}
+        self.checked_at = 0.0
+
+class QuizService:
+    """The quiz API: subjects, test sampling, answer submission and results.
+
+    Request parsing runs on the event loop; database reads go to a pool of threads with
+    one connection each, and history writes to a single writer thread.
+    """
+
+    def __init__(self, db_name, read_workers=READ_POOL_SIZE, seed=None):
+        self.db_name = db_name
+        self.reads = ThreadPoolExecutor(read_workers, thread_name_prefix='quiz-read')
+        self.writes = ThreadPoolExecutor(1, thread_name_prefix='quiz-write')
+        self.cache = SubjectCache(db_name)
+        self.sessions = OrderedDict()  # session id -> (created_at, subject, test type, QuizSession)
+        self.rng = random.Random(seed)
+
+    async def read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.reads, func, *args)
+
+    async def write(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.writes, func, *args)
+
+    async def subject(self, subject):
+        entry = self.cache.get(subject) or await self.read(self.cache.load, subject)
+        if entry is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown subject '{subject}'.")
+        return entry
+
+    def session(self, session_id):
+        self.expire_sessions()
+        stored = self.sessions.get(session_id)
+        if stored is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown or expired test '{session_id}'.")
+        return stored
+
+    def expire_sessions(self):
+        cutoff = time.time() - SESSION_TTL
+        while self.sessions and (len(self.sessions) > MAX_SESSIONS or next(iter(self.sessions.values()))[0] < cutoff):
+            self.sessions.popitem(last=False)
+
+    async def dispatch(self, method, path, query, body):
+        """Route a request to its handler and return (status, payload)."""
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if parts == ['subjects']:
+            self.allow(method, 'GET')
+            return HTTPStatus.OK, {'subjects': await self.read(quiz_engine.load_subjects, self.db_name)}
+        if len(parts) == 3 and parts[0] == 'subjects' and parts[2] == 'references':
+            self.allow(method, 'GET')
+            entry = await self.subject(parts[1])
+            return HTTPStatus.OK, {'subject': entry.name,
+                                   'references': await self.read(quiz_engine.load_references, self.db_name, entry.name)}
+        if parts == ['tests']:
+            self.allow(method, 'POST')
+            return HTTPStatus.CREATED, await self.create_test(self.json(body))
+        if len(parts) == 3 and parts[0] == 'tests' and parts[2] == 'answers':
+            self.allow(method, 'POST')
+            return HTTPStatus.OK, await self.submit(parts[1], self.json(body))
+        if len(parts) == 3 and parts[0] == 'tests' and parts[2] == 'results':
+            self.allow(method, 'GET')
+            return HTTPStatus.OK, await self.results(parts[1], 'references' in query)
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No such endpoint: {path}")
+
+    def allow(self, method, expected):
+        if method != expected:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"Use {expected} for this endpoint.")
+
+    def json(self, body):
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "The request body is not valid JSON.") from None
+        if not isinstance(payload, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "The request body must be a JSON object.")
+        return payload
+
+    async def create_test(self, request):
+        """Draw a test; body {"subject": ..., "type": "Preview" | "Practice" | "Certified", "seed": optional}."""
+        test_type = request.get('type', 'Preview')
+        if test_type not in quiz_engine.TEST_TYPES:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"type must be one of {', '.join(quiz_engine.TEST_TYPES)}.")
+        entry = await self.subject(str(request.get('subject', '')))
+        rng = random.Random(request['seed']) if request.get('seed') is not None else self.rng
+
+        count = quiz_engine.TEST_TYPES[test_type]
+        if test_type == 'Preview':
+            question_ids = rng.sample(entry.question_ids, min(count, len(entry.question_ids)))
+        elif test_type == 'Practice':
+            question_ids = await self.read(history.select_practice_ids, self.db_name, entry.name, count,
+                                           entry.question_ids, rng)
+        else:
+            question_ids = entry.question_ids
+        questions = [entry.by_id[question_id] for question_id in question_ids if question_id in entry.by_id]
+
+        session = quiz_engine.QuizSession(questions)
+        self.expire_sessions()
+        self.sessions[session.session_id] = (time.time(), entry.name, test_type, session)
+        return {'session_id': session.session_id, 'subject': entry.name, 'type': test_type,
+                'questions': [entry.public[q[0]] for q in questions]}
+
+    async def submit(self, session_id, request):
+        """Answer every question of a test at once; body {"answers": {"<question id>": "b", ...}}."""
+        _, _, _, session = self.session(session_id)
+        if session.answers:
+            raise HTTPError(HTTPStatus.CONFLICT, "This test has already been submitted.")
+        answers = request.get('answers')
+        if not isinstance(answers, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "answers must map question ids to option letters.")
+        missing = [q[0] for q in session.questions if str(q[0]) not in answers]
+        if missing:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Missing answers for questions {missing[:10]}.")
+
+        answered = quiz_engine.QuizSession(session.questions, session.session_id)
+        for q in session.questions:
+            try:
+                answered.answer(str(answers[str(q[0])]))
+            except ValueError as e:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Question {q[0]}: {e}") from None
+        session.answers = answered.answers
+        await self.write(session.record, self.db_name)
+        return await self.results(session_id)
+
+    async def results(self, session_id, references=False):
+        """Score of a submitted test, per question; with references, the best matching notes too."""
+        _, subject, test_type, session = self.session(session_id)
+        if not session.finished:
+            raise HTTPError(HTTPStatus.CONFLICT, "This test has not been submitted yet.")
+        results = session.results()
+        correct, answered = session.score()
+        payload = {'session_id': session_id, 'subject': subject, 'type': test_type,
+                   'score': correct, 'total': answered,
+                   'results': [{'question_id': r.question[0], 'answer': r.answer, 'correct': r.correct,
+                                'correct_option': r.correct_option} for r in results]}
+        if references:
+            matches = await self.read(reference_index.top_references, self.db_name, session.questions)
+            for item, match in zip(payload['results'], matches):
+                item['references'] = match
+        return payload
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': "Malformed request line."}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_SIZE:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "Body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+
+                url = urlsplit(target)
+                try:
+                    status, payload = await self.dispatch(method, url.path, parse_qs(url.query, keep_blank_values=True), body)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(e).__name__}: {e}"}
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # Client went away or sent a broken request
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    def close(self):
+        self.reads.shutdown(wait=False, cancel_futures=True)
+        self.writes.shutdown(wait=True)
+
+async def serve(db_name, host=HOST, port=PORT, read_workers=READ_POOL_SIZE):
+    """Run the quiz service until cancelled."""
+    service = QuizService(db_name, read_workers)
+    server = await asyncio.start_server(service.handle_connection, host, port, backlog=1024)
+    print(f"Serving practice tests from {db_name} on http://{host}:{port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON practice test service.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--db', default='questions.db', help="Database to serve")
+    parser.add_argument('--workers', type=int, default=READ_POOL_SIZE, help="Threads in the read pool")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.enable_from_arguments(args)  # The report is printed when the server is stopped with Ctrl-C
+
+    database.create_database(args.db)  # Migrate older databases in place
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,238 @@
+import math
+import re
+from collections import Counter
+import data_access
+import tracing
+
+# BM25 parameters: term-frequency saturation and document-length normalisation
+K1 = 1.2
+B = 0.75
+
+# References shown under each question in the results
+TOP_K = 3
+
+# Upper bound on score cells (questions x references) computed at once
+SCORE_BLOCK = 1 << 21
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset('''
+    a an and are as at be by can do does for from has have how in is it its of on or that the
+    their this to was what when which who why will with you your not all following true correct
+    statement statements
+'''.split())
+
+def tokenize(text):
+    """Split text into lower-case index terms, dropping stopwords and single characters."""
+    return [token for token in TOKEN.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+def bm25_postings(references):
+    """Yield (reference id, term, BM25 weight) for (reference id, text) pairs."""
+    documents = [(reference_id, Counter(tokenize(text))) for reference_id, text in references]
+    documents = [(reference_id, counts) for reference_id, counts in documents if counts]
+
+    document_frequency = Counter()
+    for _, counts in documents:
+        document_frequency.update(counts.keys())
+    count = len(documents)
+    average_length = sum(sum(counts.values()) for _, counts in documents) / count if count else 0
+    idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    for reference_id, counts in documents:
+        norm = K1 * (1 - B + B * sum(counts.values()) / average_length)
+        for term, tf in counts.items():
+            yield (reference_id, term, idf[term] * tf * (K1 + 1) / (tf + norm))
+
+@tracing.traced('sql.build_reference_index')
+def build_index(conn, subject_id, revision):
+    """Recompute the BM25 postings of one subject's references inside the caller's transaction.
+
+    Each posting stores the full BM25 term weight of a reference, so scoring a query is a
+    sum of stored weights over the query's terms.
+    """
+    rows = conn.execute("SELECT id, reference FROM study_references WHERE subject_id = ? ORDER BY id",
+                        (subject_id,)).fetchall()
+    conn.execute("DELETE FROM reference_postings WHERE subject_id = ?", (subject_id,))
+    conn.executemany('''
+        INSERT INTO reference_postings (subject_id, term, reference_id, weight) VALUES (?, ?, ?, ?)
+    ''', ((subject_id, term, reference_id, weight) for reference_id, term, weight in bm25_postings(rows)))
+    conn.execute("INSERT OR REPLACE INTO reference_indexes (subject_id, revision) VALUES (?, ?)",
+                 (subject_id, revision))
+
+def update_indexes(conn):
+    """Rebuild the index of every subject whose references changed since it was built."""
+    stale = conn.execute('''
+        SELECT s.id, s.reference_revision FROM subjects s
+        LEFT JOIN reference_indexes i ON i.subject_id = s.id
+        WHERE i.revision IS NOT s.reference_revision
+    ''').fetchall()
+    for subject_id, revision in stale:
+        build_index(conn, subject_id, revision)
+    return len(stale)
+
+class ReferenceIndex:
+    """A subject's BM25 postings loaded as CSR-style arrays for batch scoring.
+
+    Postings for term t are columns[indptr[t]:indptr[t + 1]] (positions in references)
+    with matching weights.
+    """
+
+    def __init__(self, references, vocabulary, indptr, columns, weights):
+        self.references = references
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.columns = columns
+        self.weights = weights
+        self.size = len(references)
+
+    def scores(self, texts):
+        """Return a (len(texts), size) array of BM25 scores for a batch of query texts.
+
+        The batch becomes a 0/1 query-by-term matrix; the postings of the terms it uses are
+        expanded into dense rows a block at a time, so each block is one matrix product.
+        """
+        import numpy as np
+        rows_by_term = {}
+        for row, text in enumerate(texts):
+            for term in set(tokenize(text)):
+                t = self.vocabulary.get(term)
+                if t is not None:
+                    rows_by_term.setdefault(t, []).append(row)
+
+        scores = np.zeros((len(texts), self.size))
+        terms = list(rows_by_term)
+        step = max(1, SCORE_BLOCK // max(self.size, 1))
+        for start in range(0, len(terms), step):
+            block = terms[start:start + step]
+            query = np.zeros((len(texts), len(block)))
+            weights = np.zeros((len(block), self.size))
+            for j, t in enumerate(block):
+                query[rows_by_term[t], j] = 1
+                begin, end = self.indptr[t], self.indptr[t + 1]
+                weights[j, self.columns[begin:end]] = self.weights[begin:end]
+            scores += query @ weights
+        return scores
+
+    def top_k(self, texts, k=TOP_K):
+        """Return the k best matching references for each text, best first, skipping non-matches."""
+        import numpy as np
+        matches = []
+        if not self.size or k <= 0:
+            return [[] for _ in texts]
+
+        k = min(k, self.size)
+        block = max(1, SCORE_BLOCK // self.size)
+        for start in range(0, len(texts), block):
+            scores = self.scores(texts[start:start + block])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for columns, column_scores in zip(top, top_scores):
+                matches.append([self.references[c] for c, score in zip(columns, column_scores) if score > 0])
+        return matches
+
+# (db_name, subject name in lower case) -> (reference revision, ReferenceIndex)
+index_cache = {}
+
+@tracing.traced('sql.load_reference_index')
+def load_index(db_name, subject):
+    """Return the ReferenceIndex of a subject, rebuilding a stale one first; cached per revision.
+
+    numpy is imported here rather than at module level, so only opening the results of a
+    test loads it.
+    """
+    import numpy as np
+    conn = data_access.get_connection(db_name)
+    row = conn.execute("SELECT id, reference_revision FROM subjects WHERE name = ?", (subject,)).fetchone()
+    if row is None:
+        return ReferenceIndex([], {}, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    subject_id, revision = row
+
+    key = (db_name, subject.lower())
+    cached = index_cache.get(key)
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+
+    built = conn.execute("SELECT revision FROM reference_indexes WHERE subject_id = ?", (subject_id,)).fetchone()
+    if built is None or built[0] != revision:
+        with conn:
+            build_index(conn, subject_id, revision)
+
+    rows = conn.execute("SELECT id, reference FROM study_references WHERE subject_id = ? ORDER BY id",
+                        (subject_id,)).fetchall()
+    reference_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    references = [r[1] for r in rows]
+
+    vocabulary = {}
+    indptr = [0]
+    reference_columns = []
+    weights = []
+    for i, (term, reference_id, weight) in enumerate(conn.execute('''
+        SELECT term, reference_id, weight FROM reference_postings WHERE subject_id = ? ORDER BY term, reference_id
+    ''', (subject_id,))):
+        if term not in vocabulary:
+            vocabulary[term] = len(vocabulary)
+            if i:
+                indptr.append(i)
+        reference_columns.append(reference_id)
+        weights.append(weight)
+    indptr.append(len(weights))
+    if not vocabulary:
+        indptr = [0]
+
+    index = ReferenceIndex(references, vocabulary, np.array(indptr, dtype=np.int64),
+                           np.searchsorted(reference_ids, np.array(reference_columns, dtype=np.int64)),
+                           np.array(weights, dtype=np.float64))
+    index_cache[key] = (revision, index)
+    return index
+
+def memory_index(references):
+    """Build a ReferenceIndex of reference strings without the database, e.g. for a question pack."""
+    import numpy as np
+    postings = sorted((term, position, weight) for position, term, weight in bm25_postings(enumerate(references)))
+    vocabulary = {}
+    indptr = [0]
+    for i, (term, _, _) in enumerate(postings):
+        if term not in vocabulary:
+            vocabulary[term] = len(vocabulary)
+            if i:
+                indptr.append(i)
+    indptr.append(len(postings))
+    if not vocabulary:
+        indptr = [0]
+    return ReferenceIndex(list(references), vocabulary, np.array(indptr, dtype=np.int64),
+                          np.array([p[1] for p in postings], dtype=np.int64),
+                          np.array([p[2] for p in postings], dtype=np.float64))
+
+def question_text(q):
+    """Text of a question tuple used as the search query: the question and its options."""
+    return " ".join([q[2]] + list(q[3]))
+
+def load_indexes(db_name, questions):
+    """Return {subject name in lower case: ReferenceIndex} for the subjects of some question tuples."""
+    indexes = {}
+    for q in questions:
+        if q[1].lower() not in indexes:
+            indexes[q[1].lower()] = load_index(db_name, q[1])
+    return indexes
+
+@tracing.traced('quiz.top_references')
+def top_references(db_name, questions, k=TOP_K, indexes=None):
+    """Return the k most relevant references for each question tuple, one batch per subject.
+
+    indexes, as returned by load_indexes, saves loading them again.
+    """
+    if indexes is None:
+        indexes = load_indexes(db_name, questions)
+    matches = [[] for _ in questions]
+    by_subject = {}
+    for i, q in enumerate(questions):
+        by_subject.setdefault(q[1].lower(), []).append(i)
+
+    for subject, positions in by_subject.items():
+        index = indexes[subject]
+        texts = [question_text(questions[i]) for i in positions]
+        for i, references in zip(positions, index.top_k(texts, k)):
+            matches[i] = references
+    return matches
@@ -0,0 +1,127 @@
+import argparse
+import re
+import time
+import data_access
+import database
+import tracing
+
+# Column weights for bm25(): a hit in the question text counts more than one in the options
+QUESTION_WEIGHTS = (10.0, 2.0, 1.0)  # question, options, explanation
+
+# Only the newest this many matches of each kind are ranked, so words that appear in most
+# rows do not cost a bm25() score for every row in the table
+SEARCH_CANDIDATES = 1000
+
+def candidate_filter(fts_table, rows_table, subject):
+    """Return an SQL condition keeping the newest SEARCH_CANDIDATES matches of fts_table,
+    and the parameters it takes after its own copy of the query text.
+
+    The cutoff is a rowid range, which FTS5 applies while reading its index; a rowid IN (...)
+    list would re-run the MATCH once per candidate.
+    """
+    subject_join = f"JOIN {rows_table} t ON t.id = c.rowid JOIN subjects s ON s.id = t.subject_id" if subject else ""
+    subject_filter = "AND s.name = ?" if subject else ""
+    condition = f'''{fts_table}.rowid >= coalesce((
+            SELECT c.rowid FROM {fts_table} c {subject_join}
+            WHERE c.{fts_table} MATCH ? {subject_filter}
+            ORDER BY c.rowid DESC LIMIT 1 OFFSET ?
+        ), 0)'''
+    return condition, ([subject] if subject else []) + [SEARCH_CANDIDATES - 1]
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+@tracing.traced('sql.search_questions')
+def search_questions(db_name, text, subject=None, limit=20):
+    """Full-text search over question text, options and explanations, best match first.
+
+    Returns a list of ('question', id, subject, question text, snippet, rank) tuples;
+    lower rank is better.
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+
+    subject_filter = "AND s.name = ?" if subject else ""
+    candidates, candidate_params = candidate_filter('questions_fts', 'questions', subject)
+    params = [query, query] + candidate_params + ([subject] if subject else []) + [limit]
+    conn = data_access.get_connection(db_name)
+    cursor = conn.execute(f'''
+        SELECT 'question', q.id, q.subject, q.question,
+               snippet(questions_fts, -1, '[', ']', '...', 12),
+               bm25(questions_fts, {', '.join(map(str, QUESTION_WEIGHTS))}) AS rank
+        FROM questions_fts
+        JOIN questions q ON q.id = questions_fts.rowid
+        JOIN subjects s ON s.id = q.subject_id
+        WHERE questions_fts MATCH ? AND {candidates} {subject_filter}
+        ORDER BY rank
+        LIMIT ?
+    ''', params)
+    return cursor.fetchall()
+
+@tracing.traced('sql.search_references')
+def search_references(db_name, text, subject=None, limit=20):
+    """Full-text search over study references, best match first.
+
+    Returns a list of ('reference', id, subject, reference text, snippet, rank) tuples.
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+
+    subject_filter = "AND s.name = ?" if subject else ""
+    candidates, candidate_params = candidate_filter('study_references_fts', 'study_references', subject)
+    params = [query, query] + candidate_params + ([subject] if subject else []) + [limit]
+    conn = data_access.get_connection(db_name)
+    cursor = conn.execute(f'''
+        SELECT 'reference', r.id, r.subject, r.reference,
+               snippet(study_references_fts, 0, '[', ']', '...', 12),
+               bm25(study_references_fts) AS rank
+        FROM study_references_fts
+        JOIN study_references r ON r.id = study_references_fts.rowid
+        JOIN subjects s ON s.id = r.subject_id
+        WHERE study_references_fts MATCH ? AND {candidates} {subject_filter}
+        ORDER BY rank
+        LIMIT ?
+    ''', params)
+    return cursor.fetchall()
+
+def search(db_name, text, subject=None, limit=20, kinds=('questions', 'references')):
+    """Search questions and/or references and merge the results by relevance.
+
+    bm25 scores from the two indexes are not on the same scale, and question columns are
+    weighted, so each result is merged by its score relative to the best hit of its own kind.
+    """
+    results = []
+    for kind, search_kind in (('questions', search_questions), ('references', search_references)):
+        if kind in kinds:
+            hits = search_kind(db_name, text, subject, limit)
+            best = hits[0][5] if hits and hits[0][5] else -1.0
+            results.extend((result[5] / best, result) for result in hits)
+    results.sort(key=lambda scored: scored[0], reverse=True)
+    return [result for score, result in results[:limit]]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the question bank and study references.")
+    parser.add_argument('query', help="Words to search for")
+    parser.add_argument('--subject', help="Only search this subject")
+    parser.add_argument('--limit', type=int, default=20, help="Maximum number of results")
+    parser.add_argument('--kind', choices=['all', 'questions', 'references'], default='all')
+    args = parser.parse_args()
+
+    db_name = 'questions.db'  # Database name
+    database.create_database(db_name)  # Older databases get their search index here
+    kinds = ('questions', 'references') if args.kind == 'all' else (args.kind,)
+    start = time.perf_counter()
+    results = search(db_name, args.query, args.subject, args.limit, kinds)
+    elapsed = time.perf_counter() - start
+
+    for kind, row_id, subject, text, snippet, rank in results:
+        print(f"[{kind} {row_id}] ({subject}) {snippet}")
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms")
@@ -2,67 +2,36 @@ import argparse
 import tkinter as tk
 from tkinter import messagebox, simpledialog
 from tkinter import ttk
-from docx import Document
 import random
-import os
-import pickle
-import requests
-from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-import sqlite3
+import queue
+import threading
+import adaptive
+import data_access
+import database
+import history
+import reference_index
+import tracing
+from explanations import ExplanationCache, ExplanationFetcher
+from quiz_engine import QuizSession, correct_option_text, draw_questions, load_subjects
 
-# Load the OpenAI API key from the .env file
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-# ----------------------------
-# Database Functions
-# ----------------------------
-
-def load_subjects(db_name):
-    """Load all distinct subjects from the questions table."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT DISTINCT subject FROM questions")
-    subjects = cursor.fetchall()
-    
-    conn.close()
-    return [subject[0] for subject in subjects]  # Extracting the subject names
-
-def load_questions(db_name, subject):
-    """Load questions from the database for a specific subject."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM questions WHERE LOWER(subject) = LOWER(?)", (subject,))
-    questions = cursor.fetchall()
-    
-    conn.close()
-    return questions
-
-def load_references(db_name, subject):
-    """Load references for a specific subject."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT reference FROM study_references WHERE subject = ?", (subject,))
-    references = cursor.fetchall()
-    
-    conn.close()
-    return [ref[0] for ref in references]  # Extracting the reference text
+# Most relevant study references shown under each question in the results
+REFERENCES_PER_QUESTION = reference_index.TOP_K
 
 # ----------------------------
 # Main GUI Application
 # ----------------------------
 
 class SubjectSelectionApp:
-    def __init__(self, master, db_name):
+    def __init__(self, master, db_name, seed=None, packs=None):
         self.master = master
         self.master.title("Select Subject")
         
         self.db_name = db_name
-        self.subjects = load_subjects(db_name)
+        self.rng = random.Random(seed)  # Seeded for reproducible test draws
+        # Shared HTTP session and explanation cache for all tests; the API key is read from .env on first use
+        self.fetcher = ExplanationFetcher(cache=ExplanationCache(db_name))
+        self.packs = packs  # {subject: QuestionPack} when running from question packs
+        self.subjects = sorted(packs) if packs else load_subjects(db_name)
         
         self.label = tk.Label(master, text="Select a subject for the test:")
         self.label.pack(pady=10)
@@ -78,104 +47,184 @@ class SubjectSelectionApp:
         self.preview_radio = tk.Radiobutton(master, text="Preview (10 questions)", variable=self.test_type_var, value="Preview")
         self.preview_radio.pack(anchor='w')
         
-        self.practice_radio = tk.Radiobutton(master, text="Practice (25 questions)", variable=self.test_type_var, value="Practice")
+        self.practice_radio = tk.Radiobutton(master, text="Practice (25 questions, due and weak first)", variable=self.test_type_var, value="Practice")
         self.practice_radio.pack(anchor='w')
         
         self.certified_radio = tk.Radiobutton(master, text="Certified Simulation (All questions)", variable=self.test_type_var, value="Certified")
         self.certified_radio.pack(anchor='w')
         
+        if not packs:  # Adaptive tests need the attempt history, which packs do not carry
+            self.adaptive_radio = tk.Radiobutton(master, text="Adaptive (stops once your level is measured)", variable=self.test_type_var, value="Adaptive")
+            self.adaptive_radio.pack(anchor='w')
+        
         self.select_button = tk.Button(master, text="Start Test", command=self.start_test)
         self.select_button.pack(pady=20)
     
+    @tracing.traced('ui.start_test')
     def start_test(self):
         selected_subject = self.subject_var.get()
         if not selected_subject:
             messagebox.showwarning("No Subject Selected", "Please select a subject.")
             return
         
-        # Load questions for the selected subject
-        questions = load_questions(self.db_name, selected_subject)  # Load questions for the selected subject
-        references = load_references(self.db_name, selected_subject)  # Load references for the selected subject
+        # Adaptive tests pick each question after the previous answer
+        if self.test_type_var.get() == "Adaptive":
+            self.start_adaptive_test(selected_subject)
+            return
         
-        # Determine the number of questions based on the selected test type
-        test_type = self.test_type_var.get()
-        if test_type == "Preview":
-            questions = random.sample(questions, min(10, len(questions)))  # 10 random questions
-        elif test_type == "Practice":
-            questions = random.sample(questions, min(25, len(questions)))  # 25 random questions
-        elif test_type == "Certified":
-            questions = questions  # All questions
+        # Load only as many questions as the selected test type needs
+        session = None
+        if self.packs:
+            pack = self.packs.get(selected_subject)
+            questions = pack.draw(self.test_type_var.get(), self.rng, self.db_name) if pack else []
+            if pack:
+                session = pack.session(questions)  # Recorded by content hash; pack ids are not this database's
+        else:
+            questions = draw_questions(self.db_name, selected_subject, self.test_type_var.get(), self.rng)
         
         # Open the test window without destroying the main window
-        self.open_test_window(questions, references)
+        self.open_test_window(questions, session)
+    
+    def start_adaptive_test(self, subject):
+        """Calibrate and load the item pool on a worker thread, which takes seconds on a large bank."""
+        self.select_button.config(state=tk.DISABLED, text="Preparing test...")
+        sessions = queue.Queue()
+        
+        def run():
+            try:
+                sessions.put(adaptive.start_session(self.db_name, subject, self.rng))
+            except Exception as error:
+                sessions.put(error)
+            finally:
+                data_access.close_connection(self.db_name)  # The thread ends here
+        
+        threading.Thread(target=run, name="adaptive-start", daemon=True).start()
+        self.master.after(50, self.open_adaptive_test, subject, sessions)
+    
+    def open_adaptive_test(self, subject, sessions):
+        """Open the adaptive test once the worker thread has its session, polling on the Tk main thread."""
+        try:
+            session = sessions.get_nowait()
+        except queue.Empty:
+            self.master.after(50, self.open_adaptive_test, subject, sessions)
+            return
+        
+        self.select_button.config(state=tk.NORMAL, text="Start Test")
+        if isinstance(session, Exception):
+            messagebox.showerror("Adaptive Test", f"Could not start the test: {session}")
+        elif session is None:
+            messagebox.showwarning("No Questions", f"No questions found for '{subject}'.")
+        else:
+            self.open_test_window(session.questions, session)
     
-    def open_test_window(self, questions, references):
+    def open_test_window(self, questions, session=None):
         test_window = tk.Toplevel(self.master)
-        app = PracticeTestApp(test_window, questions, references)
+        app = PracticeTestApp(test_window, questions, self.fetcher, self.db_name, session)
+
+class QuestionView:
+    """A question label and a fixed pool of option buttons, reconfigured for each question.
+
+    The widgets are created once, so a long test does not pile up Radiobuttons; buttons a
+    question does not need are hidden with grid_remove() and shown again for the next one.
+    The pool only grows when a question has more options than any before it, which happens
+    in adaptive tests, whose questions are not known up front.
+    """
+
+    def __init__(self, master, variable, option_count):
+        self.frame = tk.Frame(master)
+        self.variable = variable
+        self.index = None  # Position in the session of the question shown, if any
+        self.question_label = tk.Label(self.frame, text="", wraplength=800, justify="left")
+        self.question_label.grid(row=0, column=0, sticky='w', pady=20)
+        self.option_buttons = []
+        self.add_buttons(option_count)
+
+    def add_buttons(self, option_count):
+        for i in range(len(self.option_buttons), option_count):
+            btn = tk.Radiobutton(self.frame, text="", variable=self.variable, value=i, wraplength=800, anchor='w', justify="left")
+            btn.grid(row=i + 1, column=0, sticky='w', pady=5)
+            self.option_buttons.append(btn)
+
+    def show(self, index, q):
+        """Configure the pool for question q (a quiz_engine question tuple) at index."""
+        self.index = index
+        self.question_label.config(text=q[2])  # Question text
+        options = q[3]  # Option lines, e.g. 'A. ...', in their original order
+        self.add_buttons(len(options))
+        for i, btn in enumerate(self.option_buttons):
+            if i < len(options):
+                btn.config(text=options[i])
+                btn.grid()  # Restores the grid options given at creation
+            else:
+                btn.grid_remove()
 
 class PracticeTestApp:
-    def __init__(self, master, questions, references):
+    def __init__(self, master, questions, fetcher=None, db_name='questions.db', session=None):
         self.master = master
         self.master.title("Practice Test")
         
-        self.questions = questions
-        self.references = references
-        self.current_question = 0
-        self.user_answers = []
+        self.db_name = db_name
+        self.fetcher = fetcher or ExplanationFetcher()
+        self.session = session if session is not None else QuizSession(questions)  # Answers and scoring live in the engine
+        self.questions = self.session.questions  # An adaptive session appends each question as it is chosen
         
         # GUI Widgets
-        self.question_label = tk.Label(master, text="", wraplength=800, justify="left")
-        self.question_label.pack(pady=20)
+        self.options_var = tk.StringVar()
+        # Two views sized for the largest question: one is shown while the next question is laid out in the other
+        option_count = max((len(q[3]) for q in questions), default=0)
+        self.views = [QuestionView(master, self.options_var, option_count) for _ in range(2)]
+        self.views[0].frame.pack(anchor='w')
         
         self.question_count_label = tk.Label(master, text="", wraplength=800, justify="left")
         self.question_count_label.pack(pady=5)
-
-        self.options_var = tk.StringVar()
-        self.option_buttons = []
         
         self.next_button = tk.Button(master, text="Next", command=self.next_question)
         self.next_button.pack(pady=20)
         
         self.load_question()
     
+    @tracing.traced('ui.load_question')
     def load_question(self):
-        if self.current_question >= len(self.questions):
+        q = self.session.current
+        if q is None:
             messagebox.showerror("Error", "No more questions available.")
             return
-        q = self.questions[self.current_question]
-        self.question_label.config(text=q[2])  # Question text
-        options = q[3].split(', ')  # Assuming options are stored as a comma-separated string
-        
-        # Clear existing option buttons
-        for btn in self.option_buttons:
-            btn.pack_forget()  # Remove the button from the window
-
-        # Create new option buttons based on the number of options
-        self.option_buttons = []  # Reset the option buttons list
-        for i, option in enumerate(options):
-            btn = tk.Radiobutton(self.master, text=option, variable=self.options_var, value=i, wraplength=800, anchor='w', justify="left")
-            btn.pack(anchor='w', pady=5)
-            self.option_buttons.append(btn)
+        index = len(self.session.answers)
+        shown, spare = self.views
+        if shown.index != index:
+            if spare.index != index:
+                spare.show(index, q)  # Not prefetched yet, e.g. the first question
+            # Swap in the prepared view; hiding one frame and packing the other is a single relayout
+            shown.frame.pack_forget()
+            spare.frame.pack(anchor='w', before=self.question_count_label)
+            self.views = shown, spare = spare, shown
 
         # Reset the selected option to None
         self.options_var.set(None)  # Clear any previous selection
         
         # Update the question count label
-        self.question_count_label.config(text=f"Question {self.current_question + 1} of {len(self.questions)}")
+        self.question_count_label.config(text=self.session.progress())
+        
+        # Lay out the next question in the hidden view while the student reads this one
+        self.master.after_idle(self.prefetch_question, index + 1)
+    
+    def prefetch_question(self, index):
+        spare = self.views[1]
+        if index < len(self.questions) and spare.index != index and self.master.winfo_exists():
+            spare.show(index, self.questions[index])
     
     def next_question(self):
-        if self.options_var.get() is None:
+        if not self.options_var.get().isdigit():  # Nothing selected yet
             messagebox.showwarning("No selection", "Please select an answer before proceeding.")
             return
-        self.user_answers.append(self.options_var.get())
-        self.current_question += 1
-        if self.current_question < len(self.questions):
-            self.load_question()
-        else:
+        self.session.answer(int(self.options_var.get()))
+        if self.session.finished:
             self.show_results()
+        else:
+            self.load_question()
     
+    @tracing.traced('ui.show_results')
     def show_results(self):
-        correct = 0
         results_window = tk.Toplevel(self.master)
         results_window.title("Results")
         
@@ -187,99 +236,127 @@ class PracticeTestApp:
         result_text_widget.tag_config("wrong", foreground="red")
 
         result_summary = "Quiz Results:\n"
-        for i, q in enumerate(self.questions):
-            selected = self.user_answers[i]
-            correct_answer = q[4]  # Assuming the correct answer is stored in the 5th column
+        prompted_topics = set()
+        # The most relevant references of every question, scored in one batch per subject
+        pack = getattr(self.session, 'pack', None)
+        if pack:
+            # The references shipped with the pack; a reference added to this database would not show up here
+            indexes = {pack.subject.lower(): pack.reference_index()}
+            unreferenced = set()
+        else:
+            indexes = reference_index.load_indexes(self.db_name, self.questions)
+            unreferenced = {subject for subject, index in indexes.items() if not index.size}  # Subjects without references
+        matches = reference_index.top_references(self.db_name, self.questions, REFERENCES_PER_QUESTION, indexes)
+        for i, result in enumerate(self.session.results()):
+            q = result.question
             question_text = q[2]
-            
-            selected_option_text = q[3].split(', ')[int(selected)]  # Get the selected option text
-            correct_option_text = correct_answer  # Assuming the correct answer is stored as a single letter
-            
-            # Extract only the letter from the selected option
-            selected_letter = selected_option_text.split('.')[0].strip().lower()  # Get the letter part and convert to lowercase
-            correct_letter = correct_option_text.strip().lower()  # Convert correct answer to lowercase
+            selected_option_text = result.selected  # The chosen option line, e.g. 'B. ...'
+            correct_answer = q[4]  # The correct answer letter
             
             result_text_widget.insert(tk.END, f"Q{i + 1}. {question_text}\n")
-            if selected_letter == correct_letter:
-                correct += 1
+            if result.correct:
                 result_text_widget.insert(tk.END, f"Your Answer: {selected_option_text} (Correct)\n\n", "correct")
                 result_summary += f"Q{i + 1}: Correct\nYour Answer: {selected_option_text}\n"
             else:
                 result_text_widget.insert(tk.END, f"Your Answer: {selected_option_text} (Wrong)\n", "wrong")
-                result_text_widget.insert(tk.END, f"Correct Answer: {correct_option_text} (Correct)\n\n", "correct")
-                result_summary += f"Q{i + 1}: Wrong\nYour Answer: {selected_option_text}\nCorrect Answer: {correct_option_text}\n"
+                result_text_widget.insert(tk.END, f"Correct Answer: {correct_answer} (Correct)\n\n", "correct")
+                result_summary += f"Q{i + 1}: Wrong\nYour Answer: {selected_option_text}\nCorrect Answer: {correct_answer}\n"
             
-            # Get explanation from OpenAI
-            explanation = self.get_explanation(question_text, correct_option_text)
-            result_text_widget.insert(tk.END, f"Explanation: {explanation}\n\n")
+            # Leave a placeholder; the explanation is fetched in the background and filled in later
+            result_text_widget.insert(tk.END, "Explanation: ")
+            result_text_widget.insert(tk.END, "Loading...", f"explanation{i}")
+            result_text_widget.insert(tk.END, "\n\n")
             
-            # Load references for the topic
+            # Show the references that best match the question
             topic = q[1]  # Assuming the topic is in the second column
-            references = load_references(self.db_name, topic)
-            if references:
-                result_text_widget.insert(tk.END, "References:\n" + "\n".join(references) + "\n\n")
-            else:
-                # Prompt to add a new reference
+            if matches[i]:
+                result_text_widget.insert(tk.END, "References:\n" + "\n".join(matches[i]) + "\n\n")
+            elif topic.lower() in unreferenced and topic.lower() not in prompted_topics:
+                # Prompt to add a new reference, once per topic
+                prompted_topics.add(topic.lower())
                 add_reference = messagebox.askyesno("Add Reference", f"No references found for '{topic}'. Would you like to add one?")
                 if add_reference:
                     self.add_reference(topic)
 
-        score_text = f"Your Score: {correct}/{len(self.questions)}\n\n"
+        correct, answered = self.session.score()
+        score_text = f"Your Score: {correct}/{answered}\n\n"
         result_text_widget.insert(tk.END, score_text)
         result_summary += score_text
+        if isinstance(self.session, adaptive.AdaptiveSession):
+            theta, se = self.session.ability
+            ability_text = f"Estimated ability: {theta:+.2f} (standard error {se:.2f})\n\n"
+            result_text_widget.insert(tk.END, ability_text)
+            result_summary += ability_text
         result_text_widget.config(state=tk.DISABLED)
         
-        # Show references for the subject
-        references_text = "\nReferences:\n" + "\n".join(self.references)
-        result_text_widget.insert(tk.END, references_text)
+        # Keep the answers and reschedule the questions for spaced repetition
+        self.session.record(self.db_name)
         
         ok_button = tk.Button(results_window, text="OK", command=results_window.destroy)
         ok_button.grid(row=1, column=0, columnspan=2, pady=10)
+        
+        self.fetch_explanations(result_text_widget)
+
+    def fetch_explanations(self, result_text_widget):
+        """Request all explanations concurrently and fill them in as they arrive."""
+        explanations = queue.Queue()
+        question_ids = self.session.local_question_ids(self.db_name)
+        for i, (q, question_id) in enumerate(zip(self.questions, question_ids)):
+            self.fetcher.submit(i, q[2], correct_option_text(q), lambda i, explanation: explanations.put((i, explanation)),
+                                question_id=question_id)
+        result_text_widget.after(50, self.show_explanations, result_text_widget, explanations, len(self.questions))
+
+    def show_explanations(self, result_text_widget, explanations, remaining):
+        """Drain finished explanations into their placeholders on the Tk main thread."""
+        if not result_text_widget.winfo_exists():
+            return  # Results window was closed
+        
+        result_text_widget.config(state=tk.NORMAL)
+        while remaining:
+            try:
+                i, explanation = explanations.get_nowait()
+            except queue.Empty:
+                break
+            start, end = result_text_widget.tag_ranges(f"explanation{i}")
+            result_text_widget.delete(start, end)
+            result_text_widget.insert(start, explanation, f"explanation{i}")
+            remaining -= 1
+        result_text_widget.config(state=tk.DISABLED)
+        
+        if remaining:
+            result_text_widget.after(50, self.show_explanations, result_text_widget, explanations, remaining)
 
     def add_reference(self, topic):
         """Prompt user to add a new reference for the given topic."""
         new_reference = simpledialog.askstring("Add Reference", f"Enter a new reference for '{topic}':")
         if new_reference:
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO study_references (subject, reference) VALUES (?, ?)", (topic, new_reference))
-            conn.commit()
-            conn.close()
+            database.insert_reference(self.db_name, topic, new_reference)
             messagebox.showinfo("Success", "Reference added successfully!")
 
-    def get_explanation(self, question, correct_answer):
-        """Get explanation from OpenAI API using direct API call."""
-        prompt = f"Explain why the answer '{correct_answer}' is correct for the following question: {question}"
-        
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": "gpt-3.5-turbo",  # or any other model you prefer
-            "messages": [
-                {"role": "user", "content": prompt}
-            ]
-        }
-        
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data)
-        
-        if response.status_code == 200:
-            explanation = response.json()['choices'][0]['message']['content']
-            return explanation
-        else:
-            return "Error retrieving explanation from OpenAI API."
-
 # ----------------------------
 # Main Function
 # ----------------------------
 
 def main():
+    parser = argparse.ArgumentParser(description="SAP certification practice tests.")
+    parser.add_argument('--seed', type=int, help="Seed for reproducible question draws")
+    parser.add_argument('--pack', nargs='+', metavar='PATH',
+                        help="Take questions from question packs (files or folders) instead of the database")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.enable_from_arguments(args)
+    
     db_name = 'questions.db'  # Database name
+    database.create_database(db_name)  # Migrate older databases in place
+    history.import_history_pickles(db_name)  # One-time import of question_history.pkl files
     root = tk.Tk()
-    app = SubjectSelectionApp(root, db_name)
+    packs = None
+    if args.pack:
+        import question_pack
+        packs = question_pack.open_packs(args.pack)
+    app = SubjectSelectionApp(root, db_name, args.seed, packs)
     root.mainloop()
+    app.fetcher.close()  # Cancel queued explanation requests and close the HTTP session
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,171 @@
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+
+# Lightweight spans and counters for finding where a slow run spends its time.
+# Tracing is off unless QUIZ_TRACE is set (or a front end's --trace flag calls enable()):
+#   QUIZ_TRACE=1            print a timing report to stderr at exit
+#   QUIZ_TRACE=trace.json   also write every span as a Chrome trace (chrome://tracing, Perfetto)
+#   QUIZ_PROFILE=run.prof   also run cProfile on the main thread and dump its stats
+# While tracing is off, traced functions cost one global check per call and span() returns
+# a shared no-op context manager.
+TRACE_VARIABLE = 'QUIZ_TRACE'
+PROFILE_VARIABLE = 'QUIZ_PROFILE'
+
+enabled = False
+_lock = threading.Lock()
+_spans = {}  # name -> [calls, total seconds, max seconds]
+_counters = {}
+_events = None  # Chrome trace events, collected only when a trace file was requested
+_origin = time.perf_counter()
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _finish(self.name, self.start)
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+NO_SPAN = _NoSpan()
+
+def span(name):
+    """Time a block: `with tracing.span('parse.pdf'):`."""
+    return _Span(name) if enabled else NO_SPAN
+
+def traced(name):
+    """Decorator timing every call of a function as a span called name."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _finish(name, start)
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    """Add n to a counter, e.g. cache hits or SQL statements."""
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+def _finish(name, start):
+    end = time.perf_counter()
+    elapsed = end - start
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            _spans[name] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+        if _events is not None:
+            _events.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': os.getpid(),
+                            'tid': threading.get_ident(), 'ts': (start - _origin) * 1e6, 'dur': elapsed * 1e6})
+
+def enable(trace_path=None, profile_path=None, report=True):
+    """Start collecting spans and counters; the report and dumps are written at exit.
+
+    Spans in worker processes (parallel ingestion) are not collected; the parent's spans
+    around the pool still are.  cProfile covers the calling thread only.
+    """
+    global enabled, _events
+    if enabled:
+        return
+    enabled = True
+    if trace_path:
+        _events = []
+        atexit.register(write_trace, trace_path)
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        atexit.register(_dump_profile, profiler, profile_path)
+    if report:
+        atexit.register(print_report)
+
+def enable_from_environment():
+    """Enable tracing as QUIZ_TRACE and QUIZ_PROFILE ask."""
+    setting = os.environ.get(TRACE_VARIABLE, '')
+    profile_path = os.environ.get(PROFILE_VARIABLE)
+    if setting or profile_path:
+        enable(trace_path=setting if setting.endswith('.json') else None, profile_path=profile_path)
+
+def add_arguments(parser):
+    """Add --trace and --profile to a front end's argument parser."""
+    parser.add_argument('--trace', nargs='?', const='', metavar='JSON',
+                        help="Print a timing report at exit; with a path, also write a Chrome trace there")
+    parser.add_argument('--profile', metavar='PROF', help="Write cProfile stats of the run to this file")
+
+def enable_from_arguments(args):
+    if args.trace is not None or args.profile:
+        enable(trace_path=args.trace or None, profile_path=args.profile)
+
+def snapshot():
+    """Return ({span: (calls, total, max)}, {counter: value}) collected so far."""
+    with _lock:
+        return {name: tuple(stats) for name, stats in _spans.items()}, dict(_counters)
+
+def reset():
+    global _events
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        if _events is not None:
+            _events = []
+
+def print_report(file=None):
+    """Print spans by total time, then counters."""
+    file = file or sys.stderr
+    spans, counters = snapshot()
+    if not spans and not counters:
+        return
+    print(f"\n{'span':<32} {'calls':>8} {'total ms':>11} {'mean ms':>10} {'max ms':>10}", file=file)
+    for name, (calls, total, longest) in sorted(spans.items(), key=lambda item: -item[1][1]):
+        print(f"{name:<32} {calls:>8} {total * 1000:11.2f} {total * 1000 / calls:10.3f} {longest * 1000:10.2f}", file=file)
+    for name, value in sorted(counters.items()):
+        print(f"{name:<32} {value:>8}", file=file)
+
+def write_trace(path):
+    """Write the collected spans and final counters in Chrome trace event format."""
+    import json
+    spans, counters = snapshot()
+    with _lock:
+        events = list(_events or ())
+    end = (time.perf_counter() - _origin) * 1e6
+    events += [{'name': name, 'ph': 'C', 'pid': os.getpid(), 'ts': end, 'args': {'value': value}}
+               for name, value in counters.items()]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    print(f"Wrote trace of {len(events)} events to {path}", file=sys.stderr)
+
+def _dump_profile(profiler, path):
+    profiler.disable()
+    profiler.dump_stats(path)
+    print(f"Wrote profile to {path} (python -m pstats {path})", file=sys.stderr)
+
+enable_from_environment()
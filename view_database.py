@@ -1,12 +1,108 @@
+import queue
+import sqlite3
+import threading
+import time
 import tkinter as tk
 from tkinter import messagebox, ttk
-import sqlite3
+import data_access
+import search
+
+# Rows fetched per query, and how many pages the Treeview holds at once
+PAGE_SIZE = 200
+MAX_PAGES = 3
+
+# Number of full-text search results shown
+SEARCH_LIMIT = 200
+
+def quote_identifier(name):
+    """Quote a table or column name for use in SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+class TablePager:
+    """Keyset pagination over one table, with optional sorting and filtering in SQL.
+
+    Rows are ordered by (sort column, key columns), where the key columns are the rowid
+    or, for WITHOUT ROWID tables, the primary key.  Each page continues from the key of
+    the last row seen with a row-value comparison instead of OFFSET, so fetching a page
+    costs the same however deep into the table it is.  Pages are lists of (key, row).
+    """
+
+    def __init__(self, db_name, table, sort_column=None, descending=False, filter_column=None, filter_text='',
+                 page_size=PAGE_SIZE):
+        self.db_name = db_name
+        self.table = table
+        self.page_size = page_size
+        self.descending = descending
+
+        conn = data_access.get_connection(db_name)
+        cursor = conn.execute(f"SELECT * FROM {quote_identifier(table)} LIMIT 0")
+        self.columns = [description[0] for description in cursor.description]
+        self.key_columns = self._key_columns(conn)
+
+        # Sort on the key alone, or on a column with the key as tie-breaker; NULLs sort as ''
+        # so that row-value comparisons never see a NULL
+        key_exprs = [quote_identifier(column) if column != 'rowid' else 'rowid' for column in self.key_columns]
+        self.sort_column = sort_column if sort_column in self.columns else None
+        sort_exprs = [f"IFNULL({quote_identifier(self.sort_column)}, '')"] if self.sort_column else []
+        self.order_exprs = sort_exprs + key_exprs
+
+        self.where = ""
+        self.params = []
+        if filter_column in self.columns and filter_text:
+            self.where = f"CAST({quote_identifier(filter_column)} AS TEXT) LIKE ?"
+            self.params = [f"%{filter_text}%"]
+
+    def _key_columns(self, conn):
+        try:
+            conn.execute(f"SELECT rowid FROM {quote_identifier(self.table)} LIMIT 0")
+            return ['rowid']
+        except sqlite3.OperationalError:
+            info = conn.execute(f"PRAGMA table_info({quote_identifier(self.table)})").fetchall()
+            return [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+
+    def _fetch(self, key, forward):
+        ascending = forward != self.descending
+        order = ', '.join(f"{expr} {'ASC' if ascending else 'DESC'}" for expr in self.order_exprs)
+        conditions = [self.where] if self.where else []
+        params = list(self.params)
+        if key is not None:
+            conditions.append(f"({', '.join(self.order_exprs)}) {'>' if ascending else '<'} "
+                              f"({', '.join('?' * len(key))})")
+            params.extend(key)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = data_access.get_connection(self.db_name)
+        rows = conn.execute(f'''
+            SELECT {', '.join(self.order_exprs)}, * FROM {quote_identifier(self.table)}
+            {where} ORDER BY {order} LIMIT ?
+        ''', params + [self.page_size]).fetchall()
+        width = len(self.order_exprs)
+        return [(row[:width], row[width:]) for row in rows]
+
+    def page_after(self, key=None):
+        """Return the page that follows key, or the first page."""
+        return self._fetch(key, forward=True)
+
+    def page_before(self, key):
+        """Return the page that precedes key, in display order."""
+        return self._fetch(key, forward=False)[::-1]
+
+    def count(self):
+        """Count the rows that match the filter; can take a while on big tables."""
+        where = f"WHERE {self.where}" if self.where else ""
+        conn = data_access.get_connection(self.db_name)
+        return conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(self.table)} {where}", self.params).fetchone()[0]
 
 class ViewDatabaseApp:
     def __init__(self, master, db_name):
         self.master = master
         self.master.title("View Database")
         self.db_name = db_name
+        self.pager = None
+        self.pages = []  # [(first key, last key, tree item ids)] for the pages in the Treeview
+        self.more_above = self.more_below = False  # Whether rows exist outside the loaded pages
+        self.loading = False
+        self.count_results = queue.Queue()
         
         self.label = tk.Label(master, text="Select a table to view:")
         self.label.pack(pady=10)
@@ -15,9 +111,42 @@ class ViewDatabaseApp:
         self.table_listbox.pack(pady=10, fill=tk.BOTH, expand=True)
         self.table_listbox.bind('<<ListboxSelect>>', self.on_table_select)
 
-        # Create a Treeview for displaying data
-        self.tree = ttk.Treeview(master)
-        self.tree.pack(pady=10, fill=tk.BOTH, expand=True)
+        # Full-text search over questions and references
+        self.search_frame = tk.Frame(master)
+        self.search_frame.pack(pady=5)
+        tk.Label(self.search_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(self.search_frame, textvariable=self.search_var, width=50)
+        self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind('<Return>', lambda e: self.show_search_results())
+        self.search_button = tk.Button(self.search_frame, text="Search", command=self.show_search_results)
+        self.search_button.pack(side=tk.LEFT, padx=5)
+
+        # Filter controls: column, text to match, apply
+        self.filter_frame = tk.Frame(master)
+        self.filter_frame.pack(pady=5)
+        tk.Label(self.filter_frame, text="Filter column:").pack(side=tk.LEFT)
+        self.filter_column_var = tk.StringVar()
+        self.filter_column_combobox = ttk.Combobox(self.filter_frame, textvariable=self.filter_column_var, state="readonly")
+        self.filter_column_combobox.pack(side=tk.LEFT, padx=5)
+        self.filter_text_var = tk.StringVar()
+        self.filter_entry = tk.Entry(self.filter_frame, textvariable=self.filter_text_var)
+        self.filter_entry.pack(side=tk.LEFT, padx=5)
+        self.filter_entry.bind('<Return>', lambda e: self.show_data())
+        self.filter_button = tk.Button(self.filter_frame, text="Apply Filter", command=self.show_data)
+        self.filter_button.pack(side=tk.LEFT, padx=5)
+
+        # Create a Treeview for displaying data; rows are loaded a page at a time as it scrolls
+        self.tree_frame = tk.Frame(master)
+        self.tree_frame.pack(pady=10, fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(self.tree_frame)
+        self.scrollbar = ttk.Scrollbar(self.tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.status_label = tk.Label(master, text="")
+        self.status_label.pack()
 
         self.show_data_button = tk.Button(master, text="Show Data", command=self.show_data)
         self.show_data_button.pack(pady=10)
@@ -26,18 +155,18 @@ class ViewDatabaseApp:
         self.exit_button = tk.Button(master, text="Exit", command=self.exit_app)
         self.exit_button.pack(pady=10)
 
+        self.sort_column = None
+        self.sort_descending = False
         self.load_tables()
 
     def load_tables(self):
         """Load table names from the database and display them in the listbox."""
-        conn = sqlite3.connect(self.db_name)
+        conn = data_access.get_connection(self.db_name)
         cursor = conn.cursor()
         
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = cursor.fetchall()
         
-        conn.close()
-        
         for table in tables:
             self.table_listbox.insert(tk.END, table[0])  # Insert table names into the listbox
 
@@ -47,40 +176,152 @@ class ViewDatabaseApp:
         if selected_index:
             self.selected_table = self.table_listbox.get(selected_index)
             self.tree.delete(*self.tree.get_children())  # Clear previous data
+            self.pages = []
+            self.pager = None
+            self.sort_column = None
+            self.sort_descending = False
+            self.filter_column_var.set('')
+            self.filter_text_var.set('')
 
     def show_data(self):
-        """Show data from the selected table."""
+        """Show the first page of the selected table, with the current sort and filter."""
         selected_index = self.table_listbox.curselection()
-        if not selected_index:
+        if selected_index:
+            self.selected_table = self.table_listbox.get(selected_index)
+        if not getattr(self, 'selected_table', None):
             messagebox.showwarning("No Selection", "Please select a table to view.")
             return
         
-        table_name = self.table_listbox.get(selected_index)
-        
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute(f"SELECT * FROM {table_name};")  # Retrieve all data from the selected table
-        rows = cursor.fetchall()
-        column_names = [description[0] for description in cursor.description]  # Get column names
-        
-        conn.close()
+        self.pager = TablePager(self.db_name, self.selected_table, self.sort_column, self.sort_descending,
+                                self.filter_column_var.get(), self.filter_text_var.get())
+        column_names = self.pager.columns
+        self.filter_column_combobox["values"] = column_names
         
         # Clear the Treeview
         self.tree.delete(*self.tree.get_children())
+        self.pages = []
+        self.more_above = False
         
         # Define the columns
         self.tree["columns"] = column_names
         self.tree["show"] = "headings"  # Hide the first empty column
 
-        # Create column headings
+        # Create column headings; clicking one sorts by it in SQL
         for col in column_names:
-            self.tree.heading(col, text=col)  # Set the column heading
+            arrow = ""
+            if col == self.sort_column:
+                arrow = " ▼" if self.sort_descending else " ▲"
+            self.tree.heading(col, text=col + arrow, command=lambda c=col: self.sort_by(c))
             self.tree.column(col, anchor="center")  # Center align the column
 
-        # Insert rows into the Treeview
-        for row in rows:
-            self.tree.insert("", "end", values=row)
+        self.append_page()
+        self.tree.yview_moveto(0)
+        self.start_count()
+
+    def show_search_results(self):
+        """Show the best full-text matches for the search box in the Treeview."""
+        text = self.search_var.get()
+        if not text.strip():
+            messagebox.showwarning("No Search", "Please enter words to search for.")
+            return
+
+        start = time.perf_counter()
+        results = search.search(self.db_name, text, limit=SEARCH_LIMIT)
+        elapsed = time.perf_counter() - start
+
+        self.pager = None  # Search results are not paged
+        self.pages = []
+        self.tree.delete(*self.tree.get_children())
+        column_names = ["kind", "id", "subject", "match"]
+        self.tree["columns"] = column_names
+        self.tree["show"] = "headings"
+        for col in column_names:
+            self.tree.heading(col, text=col, command=lambda: None)
+            self.tree.column(col, anchor="w" if col == "match" else "center")
+        for kind, row_id, subject, text, snippet, rank in results:
+            self.tree.insert("", "end", values=(kind, row_id, subject, snippet))
+        self.status_label.config(text=f"{len(results)} results in {elapsed * 1000:.1f} ms")
+
+    def sort_by(self, column):
+        """Sort by a column, toggling the direction on repeated clicks."""
+        if self.sort_column == column:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_column, self.sort_descending = column, False
+        self.show_data()
+
+    def insert_page(self, page, index):
+        items = [self.tree.insert("", index if index == "end" else index + i, values=row)
+                 for i, (key, row) in enumerate(page)]
+        return (page[0][0], page[-1][0], items)
+
+    def append_page(self):
+        """Load the page after the last one shown, dropping the top page if too many are loaded."""
+        page = self.pager.page_after(self.pages[-1][1] if self.pages else None)
+        self.more_below = len(page) == self.pager.page_size
+        if not page:
+            return False
+        self.pages.append(self.insert_page(page, "end"))
+        if len(self.pages) > MAX_PAGES:
+            self.tree.delete(*self.pages.pop(0)[2])
+            self.more_above = True
+        return True
+
+    def prepend_page(self):
+        """Load the page before the first one shown, dropping the bottom page if too many are loaded."""
+        page = self.pager.page_before(self.pages[0][0])
+        self.more_above = len(page) == self.pager.page_size
+        if not page:
+            return False
+        self.pages.insert(0, self.insert_page(page, 0))
+        if len(self.pages) > MAX_PAGES:
+            self.tree.delete(*self.pages.pop()[2])
+            self.more_below = True
+        return True
+
+    def on_tree_scroll(self, first, last):
+        """Keep the scrollbar in sync and fetch the neighbouring page near either end."""
+        self.scrollbar.set(first, last)
+        if self.pager is None or not self.pages or self.loading:
+            return
+        first, last = float(first), float(last)
+        if last >= 0.9 and self.more_below:
+            self.load_more(self.append_page, first)
+        elif first <= 0.1 and self.more_above:
+            self.load_more(self.prepend_page, first)
+
+    def load_more(self, load, first):
+        """Run append_page/prepend_page while keeping the same row at the top of the view."""
+        children = self.tree.get_children()
+        anchor = children[min(int(first * len(children)), len(children) - 1)]
+        self.loading = True  # Moving the view below calls back into on_tree_scroll
+        try:
+            if load() and self.tree.exists(anchor):
+                self.tree.yview_moveto(self.tree.index(anchor) / len(self.tree.get_children()))
+        finally:
+            self.loading = False
+
+    def start_count(self):
+        """Count matching rows on a background thread and show the total when it is ready."""
+        pager = self.pager
+        self.status_label.config(text="Counting rows...")
+        
+        def count_rows():
+            total = pager.count()
+            data_access.close_connection(pager.db_name)  # This thread's connection is not needed again
+            self.count_results.put((pager, total))
+        
+        threading.Thread(target=count_rows, daemon=True).start()
+        self.master.after(100, self.show_count)
+
+    def show_count(self):
+        try:
+            pager, total = self.count_results.get_nowait()
+        except queue.Empty:
+            self.master.after(100, self.show_count)
+            return
+        if pager is self.pager:  # Ignore counts for a table or filter that is no longer shown
+            self.status_label.config(text=f"{total:,} rows")
 
     def exit_app(self):
         """Close the application."""
@@ -102,4 +343,4 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()